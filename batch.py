@@ -0,0 +1,262 @@
+"""
+تشغيل دفعة روابط من سطر الأوامر بدون ديسكورد، عبر نفس محركات الاستخراج المستخدمة في البوتين.
+
+ملف الإدخال: رابط في كل سطر، أو كائن JSON بالخيارات الخاصة بذلك الرابط. الأسطر الفارغة و# تُتجاهل.
+روابط جوجل درايف تُستخرج كـ PDF (bot.py)، وغيرها كفصول مانجا (main.py) إلا إذا حُدد "kind".
+
+    https://drive.google.com/file/d/XXXX/view
+    https://example.com/series/chapter-1
+    {"url": "https://example.com/series/chapter-1", "chapters": 5, "merge_images": true}
+    {"url": "https://drive.google.com/file/d/XXXX/view", "quality": "low", "speed": "fast"}
+
+    python batch.py urls.txt --workers 3 --output-dir batch_output
+    python batch.py urls.txt --chapters 2 --image-format webp --summary summary.json
+
+المخرجات (PDF و ZIP) تُحفظ في مجلد الإخراج، مع ملف JSON بأزمنة كل مهمة ومراحلها وأخطائها.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import time
+
+import jobs
+
+QUALITY_ALIASES = {"high": "عالية", "medium": "متوسطة", "low": "منخفضة"}
+SPEED_ALIASES = {"slow": "بطيئة", "medium": "متوسطة", "fast": "سريعة"}
+QUALITY_FLOOR_ALIASES = {"excellent": "ممتازة", "good": "جيدة", "acceptable": "مقبولة"}
+PDF_HOSTS = ("drive.google.com", "docs.google.com")
+
+JOB_OPTIONS = (
+    "kind", "quality", "speed", "target_size_mb", "quality_floor",
+    "chapter_number", "chapters", "merge_images", "image_format", "skip_banners", "deliver_every",
+)
+
+
+def read_entries(path, defaults):
+    """يقرأ ملف الإدخال ويعيد قائمة مهام: كل مهمة قاموس بالرابط والخيارات بعد دمجها مع الافتراضية."""
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                try:
+                    entry = json.loads(line)
+                except ValueError as e:
+                    raise SystemExit(f"{path}:{line_number}: invalid JSON - {e}")
+                unknown = set(entry) - set(JOB_OPTIONS) - {"url"}
+                if "url" not in entry or unknown:
+                    raise SystemExit(f"{path}:{line_number}: expected a url and known options, got {sorted(unknown) or 'no url'}")
+            else:
+                entry = {"url": line}
+            merged = {**defaults, **entry}
+            if not merged.get("kind"):
+                merged["kind"] = "pdf" if any(host in merged["url"] for host in PDF_HOSTS) else "manga"
+            merged["line"] = line_number
+            entries.append(merged)
+    return entries
+
+
+def _collect_outputs(paths, output_dir, prefix):
+    """ينقل ملفات الإخراج لمجلد الدفعة باسم يبدأ برقم المهمة. يعيد المسارات الجديدة."""
+    moved = []
+    for path in paths:
+        if path and os.path.exists(path):
+            destination = os.path.join(output_dir, f"{prefix}_{os.path.basename(path)}")
+            shutil.move(path, destination)
+            moved.append(destination)
+    return moved
+
+
+async def run_pdf(entry, index, output_dir):
+    import bot
+    import encoder
+
+    quality = QUALITY_ALIASES.get(entry["quality"], entry["quality"])
+    speed = SPEED_ALIASES.get(entry["speed"], entry["speed"])
+    quality_preset = bot.resolve_preset(bot.QUALITY_PRESETS, quality)
+    speed_preset = bot.resolve_preset(bot.SPEED_PRESETS, speed)
+    min_psnr = encoder.QUALITY_FLOORS.get(QUALITY_FLOOR_ALIASES.get(entry["quality_floor"], entry["quality_floor"]))
+    target_size_mb = entry["target_size_mb"]
+
+    job = jobs.registry.start("fetchpdf", url=entry["url"], source="batch", quality=quality, speed=speed)
+    output_id = f"batch_{job.trace_id}"
+    progress_state = {"status": "", "pages": 0, "title": "", "start_time": None, "extracting": True, "done": False, "error": None}
+    try:
+        result = await bot.fetch_pdf_over_http(
+            entry["url"], output_id, progress_state, quality_preset["max_dim"], job,
+            target_size_mb=target_size_mb, min_psnr=min_psnr
+        )
+        if result is None:
+            result = await asyncio.to_thread(
+                bot.extract_pdf_via_canvas, entry["url"], output_id, progress_state, **quality_preset, **speed_preset,
+                job=job, target_size_mb=target_size_mb, min_psnr=min_psnr
+            )
+        outputs = _collect_outputs([result.get("file_path")] if result.get("success") else [], output_dir, f"{index:03d}")
+    except Exception as e:
+        # المحرك انهار: نغلق المهمة حتى لا تبقى "قيد التشغيل" في /jobs ومقاييس المهام النشطة
+        job.finish(False, str(e))
+        raise
+    finally:
+        shutil.rmtree(os.path.join(bot.DOWNLOADS_DIR, output_id), ignore_errors=True)
+    job.finish(result.get("success", False), result.get("error"))
+    return job, result, outputs, {"pages": progress_state["pages"], "source": result.get("source", "browser"), "missing_pages": result.get("missing_pages", [])}
+
+
+async def run_manga(entry, index, output_dir):
+    import encoder
+    import main
+
+    min_psnr = encoder.QUALITY_FLOORS.get(QUALITY_FLOOR_ALIASES.get(entry["quality_floor"], entry["quality_floor"]))
+    job = jobs.registry.start("download", url=entry["url"], source="batch", chapters=entry["chapters"])
+    # مجلد عمل مستقل لكل مهمة: المهام تعمل بالتوازي في نفس العملية
+    work_dir = os.path.join(output_dir, ".work", job.trace_id)
+    zip_dir = os.path.join(output_dir, ".work", f"{job.trace_id}_zip")
+    os.makedirs(zip_dir, exist_ok=True)
+    progress_state = {}
+    try:
+        result = await asyncio.to_thread(
+            main._process_manga_download,
+            entry["url"],
+            entry["chapter_number"],
+            entry["chapters"],
+            entry["merge_images"],
+            entry["image_format"].lower(),
+            progress_state,
+            upload=False,
+            job=job,
+            skip_banners=entry["skip_banners"],
+            target_size_mb=entry["target_size_mb"],
+            min_psnr=min_psnr,
+            deliver_every=entry["deliver_every"],
+            work_dir=work_dir,
+            output_dir=zip_dir,
+        )
+        zip_paths = [result.get("zip_path")] + [d.get("zip_path") for d in result.get("deliveries", [])]
+        outputs = _collect_outputs(zip_paths, output_dir, f"{index:03d}")
+    except Exception as e:
+        job.finish(False, str(e))
+        raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        shutil.rmtree(zip_dir, ignore_errors=True)
+    job.finish(result.get("success", False), result.get("error"))
+    return job, result, outputs, {
+        "chapters": result.get("chapters_processed", 0),
+        "images": result.get("images_downloaded", 0),
+        "zip_bytes": result.get("zip_bytes", 0),
+        "failed_batches": result.get("failed_batches", []),
+    }
+
+
+async def run_entry(entry, index, output_dir, semaphore):
+    async with semaphore:
+        print(f"[INFO] [{index}] {entry['kind']} {entry['url']}")
+        started = time.perf_counter()
+        runner = run_pdf if entry["kind"] == "pdf" else run_manga
+        try:
+            job, result, outputs, details = await runner(entry, index, output_dir)
+        except Exception as e:
+            print(f"[ERROR LOG] [{index}] Batch job crashed: {type(e).__name__} - {e}")
+            return {
+                "index": index, "line": entry["line"], "url": entry["url"], "kind": entry["kind"],
+                "success": False, "error": f"{type(e).__name__}: {e}", "wall_seconds": round(time.perf_counter() - started, 3),
+            }
+        wall = time.perf_counter() - started
+        status = "OK" if result.get("success") else "FAILED"
+        print(f"[INFO] [{index}] {status} in {wall:.1f}s {result.get('error') or ''}".rstrip())
+        return {
+            "index": index,
+            "line": entry["line"],
+            "url": entry["url"],
+            "kind": entry["kind"],
+            "trace_id": job.trace_id,
+            "success": bool(result.get("success")),
+            "error": result.get("error"),
+            "wall_seconds": round(wall, 3),
+            "outputs": outputs,
+            "output_bytes": sum(os.path.getsize(path) for path in outputs),
+            "timings": {k: round(v, 4) for k, v in job.timings.items()},
+            "counters": dict(job.counters),
+            **details,
+        }
+
+
+async def run_batch(entries, output_dir, workers):
+    semaphore = asyncio.Semaphore(max(1, workers))
+    try:
+        return await asyncio.gather(*(run_entry(entry, index, output_dir, semaphore) for index, entry in enumerate(entries, start=1)))
+    finally:
+        if any(entry["kind"] == "pdf" for entry in entries):
+            import drive_direct
+            await drive_direct.close()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Run /fetchpdf and /download extractions in bulk without Discord")
+    parser.add_argument("input", help="ملف الروابط (رابط أو كائن JSON في كل سطر)")
+    parser.add_argument("--workers", type=int, default=2, help="عدد المهام التي تعمل بالتوازي (كل مهمة متصفح مستقل)")
+    parser.add_argument("--output-dir", default="batch_output")
+    parser.add_argument("--summary", default=None, help="مسار ملف الملخص (افتراضياً summary.json داخل مجلد الإخراج)")
+    parser.add_argument("--quality", default="medium", help="جودة PDF: high / medium / low")
+    parser.add_argument("--speed", default="slow", help="سرعة سحب PDF: slow / medium / fast")
+    parser.add_argument("--target-size-mb", type=int, default=None)
+    parser.add_argument("--quality-floor", default=None, choices=[*QUALITY_FLOOR_ALIASES, *QUALITY_FLOOR_ALIASES.values()])
+    parser.add_argument("--chapter-number", type=int, default=1)
+    parser.add_argument("--chapters", type=int, default=1)
+    parser.add_argument("--image-format", default="jpg")
+    parser.add_argument("--merge", action="store_true", help="دمج صور الفصل (JPG فقط)")
+    parser.add_argument("--skip-banners", action="store_true")
+    parser.add_argument("--deliver-every", type=int, default=0, help="ZIP لكل N فصول بدلاً من ملف واحد")
+    args = parser.parse_args()
+
+    defaults = {
+        "kind": None,
+        "quality": args.quality,
+        "speed": args.speed,
+        "target_size_mb": args.target_size_mb,
+        "quality_floor": args.quality_floor,
+        "chapter_number": args.chapter_number,
+        "chapters": args.chapters,
+        "merge_images": args.merge,
+        "image_format": args.image_format,
+        "skip_banners": args.skip_banners,
+        "deliver_every": args.deliver_every,
+    }
+    entries = read_entries(args.input, defaults)
+    if not entries:
+        raise SystemExit("No URLs found in the input file.")
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    started_at = time.time()
+    started = time.perf_counter()
+    results = asyncio.run(run_batch(entries, args.output_dir, args.workers))
+    wall = time.perf_counter() - started
+    shutil.rmtree(os.path.join(args.output_dir, ".work"), ignore_errors=True)
+
+    succeeded = sum(1 for r in results if r["success"])
+    summary = {
+        "input": os.path.abspath(args.input),
+        "started_at": started_at,
+        "wall_seconds": round(wall, 3),
+        "workers": args.workers,
+        "jobs": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "jobs_per_minute": round(len(results) / wall * 60, 3) if wall else 0.0,
+        "output_bytes": sum(r.get("output_bytes", 0) for r in results),
+        "results": results,
+    }
+    summary_path = args.summary or os.path.join(args.output_dir, "summary.json")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    print(f"[INFO] {succeeded}/{len(results)} jobs succeeded in {wall:.1f}s. Summary: {summary_path}")
+    sys.exit(0 if succeeded == len(results) else 1)
+
+
+if __name__ == "__main__":
+    main_cli()
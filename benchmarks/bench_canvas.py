@@ -0,0 +1,228 @@
+"""
+قياس أداء extract_pdf_via_canvas (bot.py) ضد العارض المحلي لكل إعدادات الجودة والسرعة.
+
+يقيس: الصفحات في الثانية، الصفحات المفقودة والمكررة، أقصى ذاكرة لعملية بايثون ولعمليات Chrome،
+وزمن تجميع ملف الـ PDF. يحتاج GOOGLE_CHROME_BIN كما في الإنتاج.
+
+    python benchmarks/bench_canvas.py --pages 40 --render-delay-ms 400 --regenerate-rate 0.05
+    python benchmarks/bench_canvas.py --quality منخفضة --speed سريعة
+    python benchmarks/bench_canvas.py --fast-path --download disabled   # المسار بدون متصفح (صور العارض)
+"""
+import argparse
+import asyncio
+import base64
+import glob
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import uuid
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from drive_viewer import DriveViewerStandIn, add_config_arguments, config_from_args, page_index_from_color  # noqa: E402
+from manga_server import BackgroundServer  # noqa: E402
+
+import bot  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+IMAGE_STREAM_RE = re.compile(rb"<<([^<>]*?/Subtype\s*/Image[^<>]*?)>>\s*stream\r?\n(.*?)\s*endstream", re.DOTALL)
+
+
+def _rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _descendants(root_pid):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    found, stack = [], [root_pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+class MemorySampler:
+    """يسجل أقصى استهلاك للذاكرة (RSS) لعملية بايثون ولمجموع عمليات Chrome التابعة لها."""
+
+    def __init__(self, interval=0.25):
+        self.interval = interval
+        self.peak_python = 0
+        self.peak_chrome = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        pid = os.getpid()
+        while not self._stop.is_set():
+            self.peak_python = max(self.peak_python, _rss_bytes(pid))
+            self.peak_chrome = max(self.peak_chrome, sum(_rss_bytes(p) for p in _descendants(pid)))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def pdf_page_indexes(pdf_path):
+    """يستخرج صور JPEG من ملف الـ PDF ويعيد رقم الصفحة المرمّز في لون كل صورة."""
+    with open(pdf_path, "rb") as f:
+        data = f.read()
+    indexes = []
+    for header, stream in IMAGE_STREAM_RE.findall(data):
+        if b"ASCII85Decode" in header:
+            stream = stream.strip()
+            if stream.endswith(b"~>"):
+                stream = stream[:-2]
+            stream = base64.a85decode(stream)
+        if b"DCTDecode" not in header:
+            continue
+        with Image.open(BytesIO(stream)) as img:
+            indexes.append(page_index_from_color(img.convert("RGB").getpixel((4, 4))))
+    return indexes
+
+
+def run_preset(url, quality_name, speed_name, expected_pages, fast_path=False):
+    output_id = f"bench_{uuid.uuid4().hex[:8]}"
+    progress_state = {"status": "", "pages": 0, "title": "", "start_time": None, "extracting": True, "done": False, "error": None}
+    preset = {**bot.QUALITY_PRESETS[quality_name], **bot.SPEED_PRESETS[speed_name]}
+
+    started = time.perf_counter()
+    with MemorySampler() as sampler:
+        if fast_path:
+            job = bot.jobs.Job("fetchpdf", url=url)
+            result = asyncio.run(bot.fetch_pdf_over_http(url, output_id, progress_state, preset["max_dim"], job))
+            result = result or {"success": False, "error": "fast path fell back to the browser"}
+        else:
+            result = bot.extract_pdf_via_canvas(url, output_id, progress_state, **preset)
+    wall = time.perf_counter() - started
+
+    run = {
+        "quality": quality_name,
+        "speed": speed_name,
+        "success": bool(result.get("success")),
+        "source": result.get("source", "browser"),
+        "wall_seconds": wall,
+        "peak_python_rss": sampler.peak_python,
+        "peak_chrome_rss": sampler.peak_chrome,
+    }
+    try:
+        if not result.get("success"):
+            run["error"] = result.get("error")
+            return run
+        if result.get("source") == "export":
+            # الملف الأصلي كما هو: لا توجد صور صفحات لفحصها
+            indexes = list(range(result.get("pages") or expected_pages))
+        else:
+            indexes = pdf_page_indexes(result["file_path"])
+        unique = set(indexes)
+        timings = result["timings"]
+        capture_seconds = timings.get("capture") or (timings.get("http_export", 0) + timings.get("http_pages", 0)) or wall
+        run.update({
+            "pages_captured": len(indexes),
+            "pages_per_second": len(indexes) / capture_seconds if capture_seconds else 0.0,
+            "missed_pages": sorted(set(range(expected_pages)) - unique),
+            "duplicate_pages": len(indexes) - len(unique),
+            "viewer_total_pages": result.get("total_pages"),
+            "reported_missing_pages": result.get("missing_pages", []),
+            "pdf_bytes": os.path.getsize(result["file_path"]),
+            "pdf_assembly_seconds": result["timings"].get("pdf_assembly", 0.0),
+            "stages": result["timings"],
+        })
+        return run
+    finally:
+        shutil.rmtree(os.path.join(bot.DOWNLOADS_DIR, output_id), ignore_errors=True)
+
+
+def latest_previous_run():
+    runs = sorted(glob.glob(os.path.join(RESULTS_DIR, "canvas_*.json")))
+    if not runs:
+        return None
+    with open(runs[-1], "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def print_report(report, previous):
+    previous_runs = {}
+    if previous:
+        previous_runs = {(r["quality"], r["speed"], r.get("source", "browser")): r for r in previous["runs"] if r.get("success")}
+    for run in report["runs"]:
+        label = f"{run['quality']}/{run['speed']}" + ("" if run.get("source", "browser") == "browser" else f" [{run['source']}]")
+        if not run["success"]:
+            print(f"{label:>16}: FAILED - {run.get('error')}")
+            continue
+        text = (
+            f"{label:>16}: {run['pages_per_second']:.2f} pages/s, missed={len(run['missed_pages'])}, "
+            f"dup={run['duplicate_pages']}, py={run['peak_python_rss'] / 2**20:.0f}MB, "
+            f"chrome={run['peak_chrome_rss'] / 2**20:.0f}MB, pdf={run['pdf_assembly_seconds']:.2f}s"
+        )
+        before = previous_runs.get((run["quality"], run["speed"], run.get("source", "browser")))
+        if before and before.get("pages_per_second"):
+            text += f" ({(run['pages_per_second'] - before['pages_per_second']) / before['pages_per_second'] * 100:+.1f}%)"
+        print(text)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline benchmark for extract_pdf_via_canvas")
+    parser.add_argument("--quality", nargs="+", default=list(bot.QUALITY_PRESETS), choices=list(bot.QUALITY_PRESETS))
+    parser.add_argument("--speed", nargs="+", default=list(bot.SPEED_PRESETS), choices=list(bot.SPEED_PRESETS))
+    parser.add_argument("--no-save", action="store_true", help="عدم حفظ النتائج")
+    parser.add_argument("--fast-path", action="store_true", help="قياس المسار بدون متصفح (fetch_pdf_over_http) بدلاً من العارض")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    config = config_from_args(args)
+    runs = []
+    with BackgroundServer(DriveViewerStandIn(config).build_app()) as server:
+        url = f"{server.base_url}/file/d/benchmark_document/view"
+        bot.drive_direct.DRIVE_BASE_URL = server.base_url
+        for quality_name in args.quality:
+            for speed_name in args.speed:
+                print(f"[BENCH] {quality_name}/{speed_name} ...")
+                runs.append(run_preset(url, quality_name, speed_name, config.pages, fast_path=args.fast_path))
+
+    report = {
+        "benchmark": "extract_pdf_via_canvas",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "runs": runs,
+    }
+    print_report(report, latest_previous_run())
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out_path = os.path.join(RESULTS_DIR, f"canvas_{time.strftime('%Y%m%d_%H%M%S')}.json")
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"[BENCH] Results saved to {out_path}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,137 @@
+"""
+مقارنة زمن الأمر الواحد بين Selenium (ChromeDriver) ومشغل DevTools المباشر (cdp_driver) ضد العارض المحلي.
+
+لكل أمر مما يستخدمه المستخرجان (execute_script، find_elements، get_attribute، التقاط canvas،
+execute_cdp_cmd) يقيس الوسيط وp95 بالمللي ثانية لكل مشغل. يحتاج GOOGLE_CHROME_BIN كما في الإنتاج.
+
+    python benchmarks/bench_cdp.py --iterations 200
+    python benchmarks/bench_cdp.py --backends cdp --pages 10
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from drive_viewer import DriveViewerStandIn, add_config_arguments, config_from_args  # noqa: E402
+from manga_server import BackgroundServer  # noqa: E402
+
+import bot  # noqa: E402
+import cdp_driver  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+BACKENDS = ("selenium", "cdp")
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def _time(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"p50_ms": _percentile(samples, 0.5), "p95_ms": _percentile(samples, 0.95), "iterations": iterations}
+
+
+def run_backend(backend, url, iterations):
+    cdp_driver.BROWSER_BACKEND = backend
+    started = time.perf_counter()
+    driver = bot.init_driver(1.0, "1280,1024")
+    if driver is None:
+        return {"backend": backend, "error": "driver failed to start"}
+    launch_seconds = time.perf_counter() - started
+    try:
+        started = time.perf_counter()
+        driver.get(url)
+        load_seconds = time.perf_counter() - started
+        # ننتظر ظهور صورة صفحة واحدة على الأقل حتى يكون للقياسات ما تعمل عليه
+        deadline = time.monotonic() + 30
+        while not driver.find_elements("tag name", "img") and time.monotonic() < deadline:
+            time.sleep(0.1)
+        images = driver.find_elements("tag name", "img")
+        if not images:
+            return {"backend": backend, "error": "viewer rendered no page images"}
+        image = images[0]
+
+        commands = {
+            "execute_script": lambda: driver.execute_script("return 1;"),
+            "execute_script_args": lambda: driver.execute_script("return arguments[0] + arguments[1];", 1, 2),
+            "find_elements": lambda: driver.find_elements("tag name", "img"),
+            "get_attribute": lambda: image.get_attribute("src"),
+            "execute_cdp_cmd": lambda: driver.execute_cdp_cmd("Runtime.evaluate", {"expression": "1"}),
+            "canvas_capture": lambda: driver.execute_script(bot.CANVAS_CAPTURE_JS, image, "image/jpeg", 0.9, 2000),
+        }
+        results = {name: _time(fn, iterations) for name, fn in commands.items()}
+        captured = driver.execute_script(bot.CANVAS_CAPTURE_JS, image, "image/jpeg", 0.9, 2000) or ""
+        return {
+            "backend": backend,
+            "launch_seconds": launch_seconds,
+            "page_load_seconds": load_seconds,
+            "canvas_payload_bytes": len(captured),
+            "commands": results,
+        }
+    finally:
+        driver.quit()
+
+
+def print_report(report):
+    runs = [r for r in report["runs"] if "commands" in r]
+    for run in report["runs"]:
+        if "error" in run:
+            print(f"{run['backend']:>10}: FAILED - {run['error']}")
+    if not runs:
+        return
+    header = f"{'command':>22}" + "".join(f"{r['backend'] + ' p50':>16}{r['backend'] + ' p95':>16}" for r in runs)
+    print(header)
+    for name in runs[0]["commands"]:
+        row = f"{name:>22}"
+        for run in runs:
+            stats = run["commands"][name]
+            row += f"{stats['p50_ms']:>14.2f}ms{stats['p95_ms']:>14.2f}ms"
+        print(row)
+    if len(runs) == 2:
+        base, other = runs
+        for name in base["commands"]:
+            ratio = base["commands"][name]["p50_ms"] / max(other["commands"][name]["p50_ms"], 1e-6)
+            print(f"{name:>22}: {other['backend']} is {ratio:.2f}x faster than {base['backend']} (p50)")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Per-command latency: Selenium WebDriver vs direct DevTools")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--no-save", action="store_true", help="عدم حفظ النتائج")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    config = config_from_args(args)
+    runs = []
+    with BackgroundServer(DriveViewerStandIn(config).build_app()) as server:
+        url = f"{server.base_url}/file/d/benchmark_document/view"
+        for backend in args.backends:
+            print(f"[BENCH] {backend} ...")
+            runs.append(run_backend(backend, url, args.iterations))
+
+    report = {
+        "benchmark": "browser_command_latency",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "runs": runs,
+    }
+    print_report(report)
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out_path = os.path.join(RESULTS_DIR, f"cdp_{time.strftime('%Y%m%d_%H%M%S')}.json")
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"[BENCH] Results saved to {out_path}")
+
+
+if __name__ == "__main__":
+    main_cli()
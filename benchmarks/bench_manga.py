@@ -0,0 +1,138 @@
+"""
+قياس أداء مسار /download (main._process_manga_download) من البداية للنهاية ضد الخادم المحلي.
+
+يحتاج نفس متغيرات البيئة المستخدمة في الإنتاج لتشغيل المتصفح (CHROME_BIN و CHROMEDRIVER_PATH).
+يتم تخطي الرفع إلى Dropbox، وتُحفظ النتائج كـ JSON في benchmarks/results/ مع مقارنة بآخر تشغيل.
+
+    python benchmarks/bench_manga.py --chapters 3 --images 40 --latency-ms 30 --failure-rate 0.02
+    python benchmarks/bench_manga.py --layouts madara toon --merge
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from manga_server import BackgroundServer, LAYOUTS, MangaStandIn, add_config_arguments, config_from_args  # noqa: E402
+
+import browser  # noqa: E402
+import main  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+HEADLINE_METRICS = ("chapters_per_minute", "images_per_second", "bytes_per_second")
+
+
+def run_layout(base_url, layout, args):
+    url = f"{base_url}/series/{layout}/chapter-1"
+    started = time.perf_counter()
+    result = main._process_manga_download(
+        url, 1, args.chapters, args.merge, args.image_format, upload=False,
+        skip_banners=args.skip_banners, deliver_every=args.deliver_every
+    )
+    wall = time.perf_counter() - started
+
+    zip_paths = [result.get("zip_path")] + [d.get("zip_path") for d in result.get("deliveries", [])]
+    for zip_path in zip_paths:
+        if zip_path and os.path.exists(zip_path):
+            os.remove(zip_path)
+
+    if not result.get("success"):
+        return {"layout": layout, "success": False, "error": result.get("error"), "wall_seconds": wall}
+
+    return {
+        "layout": layout,
+        "success": True,
+        "wall_seconds": wall,
+        "chapters": result["chapters_processed"],
+        "images": result["images_downloaded"],
+        "bytes": result["bytes_downloaded"] + result["bytes_captured"],
+        "bytes_captured": result["bytes_captured"],
+        "zip_bytes": result["zip_bytes"],
+        "deliveries": len(result.get("deliveries", [])),
+        "first_delivery_seconds": result.get("first_delivery_seconds", wall),
+        "images_skipped": result["images_skipped"],
+        "browser_transfer_bytes": result["browser_transfer_bytes"],
+        "requests_blocked": result["requests_blocked"],
+        "chapters_per_minute": result["chapters_processed"] / wall * 60,
+        "images_per_second": result["images_downloaded"] / wall,
+        "bytes_per_second": (result["bytes_downloaded"] + result["bytes_captured"]) / wall,
+        "stages": result["timings"],
+    }
+
+
+def latest_previous_run():
+    runs = sorted(glob.glob(os.path.join(RESULTS_DIR, "manga_*.json")))
+    if not runs:
+        return None
+    with open(runs[-1], "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def print_report(report, previous):
+    previous_by_layout = {}
+    if previous:
+        previous_by_layout = {r["layout"]: r for r in previous["runs"] if r.get("success")}
+
+    for run in report["runs"]:
+        if not run["success"]:
+            print(f"{run['layout']:>15}: FAILED - {run['error']}")
+            continue
+        line = [f"{run['layout']:>15}:"]
+        before = previous_by_layout.get(run["layout"])
+        for metric in HEADLINE_METRICS:
+            value = run[metric]
+            text = f"{metric}={value:,.2f}"
+            if before and before.get(metric):
+                change = (value - before[metric]) / before[metric] * 100
+                text += f" ({change:+.1f}%)"
+            line.append(text)
+        print(" ".join(line))
+        stages = ", ".join(f"{k}={v:.2f}s" for k, v in sorted(run["stages"].items(), key=lambda kv: -kv[1]))
+        print(f"{'':>17}{stages}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the manga /download pipeline")
+    parser.add_argument("--layouts", nargs="+", default=list(LAYOUTS), choices=list(LAYOUTS))
+    parser.add_argument("--chapters", type=int, default=2)
+    parser.add_argument("--merge", action="store_true", help="تفعيل دمج الصور")
+    parser.add_argument("--no-blocking", action="store_true", help="تعطيل حظر الموارد في المتصفح (للمقارنة)")
+    parser.add_argument("--skip-banners", action="store_true", help="تخطي الصور المتكررة عبر الفصول")
+    parser.add_argument("--deliver-every", type=int, default=0, help="تسليم كل N فصول في ZIP مستقل (0 = ملف واحد)")
+    parser.add_argument("--image-format", default="jpg", choices=main.VALID_FORMATS)
+    parser.add_argument("--no-save", action="store_true", help="عدم حفظ النتائج")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    if args.no_blocking:
+        browser.BLOCK_CATEGORIES.clear()
+
+    stand_in = MangaStandIn(config_from_args(args))
+    runs = []
+    with BackgroundServer(stand_in.build_app()) as server:
+        for layout in args.layouts:
+            print(f"[BENCH] {layout} ...")
+            runs.append(run_layout(server.base_url, layout, args))
+
+    report = {
+        "benchmark": "manga_download",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "server": {"bytes_served": stand_in.bytes_served, "requests_failed": stand_in.requests_failed},
+        "runs": runs,
+    }
+    print_report(report, latest_previous_run())
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out_path = os.path.join(RESULTS_DIR, f"manga_{time.strftime('%Y%m%d_%H%M%S')}.json")
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"[BENCH] Results saved to {out_path}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,253 @@
+"""
+عارض محلي يحاكي عارض PDF في جوجل درايف لاختبار extract_pdf_via_canvas بدون درايف الحقيقي.
+
+كل صفحة تُرسم عند اقترابها من الشاشة (بعد تأخير قابل للضبط) كصورة blob:، ويمكن
+إعادة توليد رابط الـ blob لبعض الصفحات أو إزالة الصفحات البعيدة كما يفعل العارض الحقيقي.
+مثل العارض الحقيقي يعلن عدد الصفحات (window.viewerMetadata ونص "Page 1 of N") ويرقّم حاويات الصفحات؛
+--no-viewer-metadata يخفي ذلك لاختبار مسار التمرير الأعمى.
+
+يحاكي أيضاً مسارات التنزيل بدون متصفح: uc?export=download (مسموح، أو بصفحة تأكيد، أو معطل)،
+وviewerng/meta وviewerng/img لصور الصفحات الجاهزة.
+لون خلفية كل صفحة يرمّز رقمها حتى يمكن كشف الصفحات المفقودة أو المكررة في ملف PDF الناتج.
+
+    python benchmarks/drive_viewer.py --port 8766 --pages 40 --render-delay-ms 300 --regenerate-rate 0.05
+    # ثم افتح: http://127.0.0.1:8766/file/d/fake/view
+"""
+import argparse
+import json
+from dataclasses import asdict, dataclass
+from io import BytesIO
+
+from aiohttp import web
+
+VIEWER_TEMPLATE = """<!doctype html>
+<html><head><meta charset="utf-8"><title>{title} - Google Drive</title>
+<style>
+body {{ margin: 0; background: #525659; }}
+.toolbar {{ position: fixed; top: 0; height: 40px; width: 100%; background: #323639; z-index: 2; }}
+#pages {{ padding-top: 48px; }}
+.page {{ width: {css_width}px; height: {css_height}px; margin: 12px auto; background: #fff; }}
+.page img {{ width: 100%; height: 100%; display: block; }}
+</style></head><body>
+<div class="toolbar"><img alt="logo" src="data:image/gif;base64,R0lGODlhAQABAIAAAP///wAAACH5BAEAAAAALAAAAAABAAEAAAICRAEAOw=="><span id="page-counter"></span></div>
+<div id="pages"></div>
+<script>
+var CONFIG = {config};
+var seed = CONFIG.seed;
+function rand() {{ seed = (seed * 1103515245 + 12345) % 2147483648; return seed / 2147483648; }}
+function colorFor(i) {{ return [32 * (i % 8) + 16, 32 * (Math.floor(i / 8) % 8) + 16, 32 * (Math.floor(i / 64) % 8) + 16]; }}
+
+var root = document.getElementById('pages');
+for (var i = 0; i < CONFIG.pages; i++) {{
+  var page = document.createElement('div');
+  page.className = 'page';
+  page.pageIndex = i;
+  if (CONFIG.viewer_metadata) page.setAttribute('data-page-index', i);
+  root.appendChild(page);
+}}
+if (CONFIG.viewer_metadata) {{
+  window.viewerMetadata = {{ numPages: CONFIG.pages, pageWidth: CONFIG.width, pageHeight: CONFIG.height }};
+  document.getElementById('page-counter').setAttribute('aria-label', 'Page 1 of ' + CONFIG.pages);
+}}
+
+function regenerate(page, blob) {{
+  var img = page.querySelector('img');
+  if (!img) return;
+  var old = img.src;
+  img.src = URL.createObjectURL(blob);
+  URL.revokeObjectURL(old);
+}}
+
+function renderPage(page) {{
+  if (page.dataset.state) return;
+  page.dataset.state = 'rendering';
+  setTimeout(function () {{
+    var i = page.pageIndex;
+    var canvas = document.createElement('canvas');
+    canvas.width = CONFIG.width;
+    canvas.height = CONFIG.height;
+    var ctx = canvas.getContext('2d');
+    ctx.fillStyle = 'rgb(' + colorFor(i).join(',') + ')';
+    ctx.fillRect(0, 0, canvas.width, canvas.height);
+    ctx.fillStyle = '#000';
+    ctx.font = Math.floor(canvas.height / 10) + 'px sans-serif';
+    ctx.fillText('Page ' + (i + 1), canvas.width / 4, canvas.height / 2);
+    canvas.toBlob(function (blob) {{
+      if (page.dataset.state !== 'rendering') return;
+      var img = document.createElement('img');
+      img.src = URL.createObjectURL(blob);
+      page.innerHTML = '';
+      page.appendChild(img);
+      page.dataset.state = 'rendered';
+      if (rand() < CONFIG.regenerate_rate) setTimeout(function () {{ regenerate(page, blob); }}, CONFIG.regenerate_after_ms);
+    }}, 'image/jpeg', 0.92);
+  }}, CONFIG.render_delay_ms);
+}}
+
+function unrender(page) {{
+  var img = page.querySelector('img');
+  if (img) URL.revokeObjectURL(img.src);
+  page.innerHTML = '';
+  delete page.dataset.state;
+}}
+
+var observer = new IntersectionObserver(function (entries) {{
+  entries.forEach(function (entry) {{ if (entry.isIntersecting) renderPage(entry.target); }});
+}}, {{ rootMargin: '50% 0px' }});
+document.querySelectorAll('.page').forEach(function (page) {{ observer.observe(page); }});
+
+if (CONFIG.keep_screens > 0) {{
+  window.addEventListener('scroll', function () {{
+    var limit = window.innerHeight * CONFIG.keep_screens;
+    document.querySelectorAll('.page[data-state]').forEach(function (page) {{
+      var r = page.getBoundingClientRect();
+      if (r.bottom < -limit || r.top > window.innerHeight + limit) unrender(page);
+    }});
+  }});
+}}
+</script>
+</body></html>"""
+
+
+@dataclass
+class ViewerConfig:
+    pages: int = 30
+    width: int = 1240
+    height: int = 1754
+    render_delay_ms: int = 250
+    regenerate_rate: float = 0.0
+    regenerate_after_ms: int = 1500
+    keep_screens: int = 3
+    seed: int = 1234
+    title: str = "benchmark_document.pdf"
+    viewer_metadata: bool = True
+    download: str = "allowed"      # allowed / confirm / disabled
+    viewer_images: bool = True     # إتاحة viewerng/img
+
+
+def page_color(index):
+    """نفس ترميز اللون المستخدم في العارض (لفك رقم الصفحة من الصورة الناتجة)."""
+    return (32 * (index % 8) + 16, 32 * ((index // 8) % 8) + 16, 32 * ((index // 64) % 8) + 16)
+
+
+def page_index_from_color(rgb):
+    r, g, b = (max(0, min(7, round((c - 16) / 32))) for c in rgb[:3])
+    return r + 8 * g + 64 * b
+
+
+class DriveViewerStandIn:
+    def __init__(self, config: ViewerConfig):
+        self.config = config
+        self._pdf = None
+        self.requests = {"export": 0, "meta": 0, "img": 0}
+
+    def build_app(self):
+        app = web.Application()
+        app.router.add_get('/file/d/{file_id}/view', self.viewer_handler)
+        app.router.add_get('/uc', self.export_handler)
+        app.router.add_get('/viewerng/meta', self.meta_handler)
+        app.router.add_get('/viewerng/img', self.page_image_handler)
+        return app
+
+    def pdf_bytes(self):
+        """ملف PDF "أصلي" بنفس ألوان الصفحات (يُولد مرة واحدة)."""
+        if self._pdf is None:
+            from reportlab.pdfgen import canvas
+
+            buffer = BytesIO()
+            c = canvas.Canvas(buffer, pagesize=(self.config.width, self.config.height))
+            for i in range(self.config.pages):
+                c.setFillColorRGB(*(v / 255 for v in page_color(i)))
+                c.rect(0, 0, self.config.width, self.config.height, stroke=0, fill=1)
+                c.showPage()
+            c.save()
+            self._pdf = buffer.getvalue()
+        return self._pdf
+
+    async def export_handler(self, request):
+        self.requests["export"] += 1
+        if self.config.download == "disabled":
+            return web.Response(text="<html><body>Download is disabled by the owner.</body></html>", content_type="text/html")
+        if self.config.download == "confirm" and request.query.get("confirm") != "t":
+            file_id = request.query.get("id", "")
+            html = (
+                '<html><body><p>Google Drive can\'t scan this file for viruses.</p>'
+                '<form id="download-form" action="/uc" method="get">'
+                '<input type="hidden" name="id" value="' + file_id + '">'
+                '<input type="hidden" name="export" value="download">'
+                '<input type="hidden" name="confirm" value="t">'
+                '</form></body></html>'
+            )
+            return web.Response(text=html, content_type="text/html")
+        return web.Response(
+            body=self.pdf_bytes(),
+            content_type="application/pdf",
+            headers={"Content-Disposition": f'attachment; filename="{self.config.title}"'},
+        )
+
+    async def meta_handler(self, request):
+        self.requests["meta"] += 1
+        if not self.config.viewer_images:
+            return web.Response(status=403)
+        meta = {"pages": self.config.pages, "maxPageWidth": self.config.width, "title": self.config.title}
+        return web.Response(text=")]}'\n" + json.dumps(meta), content_type="application/json")
+
+    async def page_image_handler(self, request):
+        from PIL import Image
+
+        self.requests["img"] += 1
+        page = int(request.query.get("page", 0))
+        if not self.config.viewer_images or not 0 <= page < self.config.pages:
+            return web.Response(status=404)
+        width = min(int(request.query.get("w", self.config.width)), self.config.width)
+        height = int(width * self.config.height / self.config.width)
+        buffer = BytesIO()
+        Image.new("RGB", (width, height), page_color(page)).save(buffer, "png")
+        return web.Response(body=buffer.getvalue(), content_type="image/png")
+
+    async def viewer_handler(self, request):
+        css_width = 800
+        css_height = int(css_width * self.config.height / self.config.width)
+        html = VIEWER_TEMPLATE.format(
+            title=self.config.title,
+            css_width=css_width,
+            css_height=css_height,
+            config=json.dumps(asdict(self.config)),
+        )
+        return web.Response(text=html, content_type="text/html")
+
+
+def add_config_arguments(parser):
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--width", type=int, default=1240, help="عرض الصفحة المرسومة بالبكسل")
+    parser.add_argument("--height", type=int, default=1754, help="ارتفاع الصفحة المرسومة بالبكسل")
+    parser.add_argument("--render-delay-ms", type=int, default=250)
+    parser.add_argument("--regenerate-rate", type=float, default=0.0, help="نسبة الصفحات التي يُعاد توليد رابط الـ blob لها")
+    parser.add_argument("--keep-screens", type=int, default=3, help="إزالة الصفحات الأبعد من هذا العدد من الشاشات (0 لتعطيلها)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--no-viewer-metadata", action="store_true", help="إخفاء عدد الصفحات وترقيم الحاويات")
+    parser.add_argument("--download", choices=["allowed", "confirm", "disabled"], default="allowed", help="سلوك uc?export=download")
+    parser.add_argument("--no-viewer-images", action="store_true", help="تعطيل viewerng/meta وviewerng/img")
+
+
+def config_from_args(args):
+    return ViewerConfig(
+        pages=args.pages,
+        width=args.width,
+        height=args.height,
+        render_delay_ms=args.render_delay_ms,
+        regenerate_rate=args.regenerate_rate,
+        keep_screens=args.keep_screens,
+        seed=args.seed,
+        viewer_metadata=not args.no_viewer_metadata,
+        download=args.download,
+        viewer_images=not args.no_viewer_images,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Google Drive PDF viewer stand-in")
+    parser.add_argument("--port", type=int, default=8766)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(DriveViewerStandIn(config_from_args(args)).build_app(), host="127.0.0.1", port=args.port)
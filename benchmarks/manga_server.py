@@ -0,0 +1,233 @@
+"""
+خادم محلي يحاكي مواقع المانجا لقياس أداء مسار /download بدون الاتصال بالمواقع الحقيقية.
+
+يخدم صفحات فصول اصطناعية بعدة تخطيطات قارئ مدعومة في main.py، مع صور Lazy-Load
+عبر data-src تُضاف للصفحة على دفعات عند التمرير، ويمكن حقن تأخير ونسبة فشل.
+
+    python benchmarks/manga_server.py --port 8765 --images 40 --latency-ms 50 --failure-rate 0.02
+    # ثم افتح: http://127.0.0.1:8765/series/madara/chapter-1
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+from dataclasses import dataclass
+from io import BytesIO
+
+from aiohttp import web
+from PIL import Image
+
+PLACEHOLDER_GIF = "data:image/gif;base64,R0lGODlhAQABAIAAAP///wAAACH5BAEAAAAALAAAAAABAAEAAAICRAEAOw=="
+
+# تخطيطات القراء: (محدد الحاوية، الحاوية، قالب الصورة). {src} رابط الصورة الحقيقي و {i} رقم الصورة.
+LAYOUTS = {
+    "madara": (
+        '.reading-content',
+        '<div class="reading-content">{images}</div>',
+        '<div class="page-break"><img id="image-{i}" class="wp-manga-chapter-img" src="{placeholder}" data-src="{src}"></div>'
+    ),
+    "mangastream": (
+        '#readerarea',
+        '<div id="readerarea">{images}</div>',
+        '<img class="ts-main-image" src="{placeholder}" data-src="{src}">'
+    ),
+    "chapter-reader": (
+        '#chapter-reader',
+        '<div id="chapter-reader">{images}</div>',
+        '<img src="{placeholder}" data-src="{src}">'
+    ),
+    "reader-item": (
+        '.reader',
+        '<div class="reader">{images}</div>',
+        '<div class="reader__item"><img src="{placeholder}" data-src="{src}"></div>'
+    ),
+    "toon": (
+        '.viewer',
+        '<div class="viewer">{images}</div>',
+        '<img class="toon_image" src="{placeholder}" data-original="{src}" data-src="{src}">'
+    ),
+}
+
+PAGE_TEMPLATE = """<!doctype html>
+<html><head><meta charset="utf-8"><title>Chapter {chapter}</title>
+<style>body{{margin:0;background:#111}} img{{display:block;width:800px;min-height:{placeholder_height}px}}</style>
+</head><body>
+{container}
+<script>
+var pending = {pending};
+var batch = {batch};
+var template = {template};
+function appendBatch() {{
+  var root = document.querySelector('{root_selector}');
+  for (var n = 0; n < batch && pending.length; n++) {{
+    var wrap = document.createElement('div');
+    wrap.innerHTML = template.split('{{src}}').join(pending[0].src).split('{{i}}').join(pending[0].i);
+    pending.shift();
+    while (wrap.firstChild) root.appendChild(wrap.firstChild);
+  }}
+  lazy();
+}}
+function lazy() {{
+  document.querySelectorAll('img[data-src]').forEach(function (img) {{
+    var r = img.getBoundingClientRect();
+    if (r.top < window.innerHeight * 2 && img.src.indexOf('data:') === 0) img.src = img.dataset.src;
+  }});
+}}
+window.addEventListener('scroll', function () {{
+  lazy();
+  if (window.innerHeight + window.scrollY >= document.body.scrollHeight - 50) setTimeout(appendBatch, {append_delay});
+}});
+lazy();
+</script>
+</body></html>"""
+
+
+@dataclass
+class ServerConfig:
+    images: int = 30
+    width: int = 800
+    height: int = 1200
+    batch: int = 10
+    latency_ms: float = 0.0
+    page_latency_ms: float = 0.0
+    failure_rate: float = 0.0
+    append_delay_ms: int = 200
+    seed: int = 1234
+
+
+class MangaStandIn:
+    def __init__(self, config: ServerConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self._image_cache = {}
+        self.bytes_served = 0
+        self.requests_failed = 0
+
+    def build_app(self):
+        app = web.Application()
+        app.router.add_get('/series/{layout}/chapter-{chapter:\\d+}', self.chapter_handler)
+        app.router.add_get('/img/{layout}/{chapter}/{index}.jpg', self.image_handler)
+        return app
+
+    def _image_bytes(self, index):
+        # صور بضوضاء حقيقية حتى يكون حجم الـ JPEG قريباً من صفحات المانجا الفعلية
+        key = (self.config.width, self.config.height, index % 8)
+        if key not in self._image_cache:
+            noise = Image.effect_noise((self.config.width, self.config.height), 40 + 10 * (index % 8))
+            img = Image.merge("RGB", (noise, noise.rotate(90, expand=False), noise.transpose(Image.FLIP_LEFT_RIGHT)))
+            buf = BytesIO()
+            img.save(buf, "jpeg", quality=85)
+            self._image_cache[key] = buf.getvalue()
+        return self._image_cache[key]
+
+    async def chapter_handler(self, request):
+        layout = request.match_info['layout']
+        chapter = request.match_info['chapter']
+        if layout not in LAYOUTS:
+            return web.Response(status=404, text="unknown layout")
+        if self.config.page_latency_ms:
+            await asyncio.sleep(self.config.page_latency_ms / 1000)
+
+        root_selector, container, image_template = LAYOUTS[layout]
+        base = f"{request.scheme}://{request.host}"
+        sources = [
+            {"i": i, "src": f"{base}/img/{layout}/{chapter}/{i:03d}.jpg?v={chapter}"}
+            for i in range(1, self.config.images + 1)
+        ]
+        first, rest = sources[:self.config.batch], sources[self.config.batch:]
+        images_html = "".join(
+            image_template.format(i=s["i"], src=s["src"], placeholder=PLACEHOLDER_GIF) for s in first
+        )
+        html = PAGE_TEMPLATE.format(
+            chapter=chapter,
+            container=container.format(images=images_html),
+            pending=json.dumps(rest),
+            batch=self.config.batch,
+            template=json.dumps(image_template.replace("{placeholder}", PLACEHOLDER_GIF)),
+            root_selector=root_selector,
+            placeholder_height=self.config.height // 2,
+            append_delay=self.config.append_delay_ms,
+        )
+        return web.Response(text=html, content_type="text/html")
+
+    async def image_handler(self, request):
+        if self.config.latency_ms:
+            await asyncio.sleep(self.config.latency_ms / 1000)
+        if self.config.failure_rate and self.random.random() < self.config.failure_rate:
+            self.requests_failed += 1
+            return web.Response(status=503, text="injected failure")
+        body = self._image_bytes(int(request.match_info['index']))
+        self.bytes_served += len(body)
+        return web.Response(body=body, content_type="image/jpeg")
+
+
+class BackgroundServer:
+    """يشغل الخادم في خيط مستقل حتى يمكن استدعاء المسار المتزامن من نفس العملية."""
+
+    def __init__(self, app, host="127.0.0.1", port=0):
+        self.app = app
+        self.host = host
+        self.port = port
+        self._loop = asyncio.new_event_loop()
+        self._runner = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def _serve(self):
+        asyncio.set_event_loop(self._loop)
+        self._runner = web.AppRunner(self.app)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port)
+        self._loop.run_until_complete(site.start())
+        self.port = self._runner.addresses[0][1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    def __enter__(self):
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def __exit__(self, *exc):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+
+def add_config_arguments(parser):
+    parser.add_argument("--images", type=int, default=30, help="عدد الصور في كل فصل")
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--batch", type=int, default=10, help="عدد الصور المضافة مع كل تمرير")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="تأخير كل طلب صورة")
+    parser.add_argument("--page-latency-ms", type=float, default=0.0, help="تأخير كل صفحة فصل")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="نسبة طلبات الصور الفاشلة (0-1)")
+    parser.add_argument("--append-delay-ms", type=int, default=200, help="تأخير إضافة دفعة الصور التالية بعد التمرير")
+    parser.add_argument("--seed", type=int, default=1234)
+
+
+def config_from_args(args):
+    return ServerConfig(
+        images=args.images,
+        width=args.width,
+        height=args.height,
+        batch=args.batch,
+        latency_ms=args.latency_ms,
+        page_latency_ms=args.page_latency_ms,
+        failure_rate=args.failure_rate,
+        append_delay_ms=args.append_delay_ms,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local manga reader stand-in")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(MangaStandIn(config_from_args(args)).build_app(), host="127.0.0.1", port=args.port)
@@ -1,36 +1,38 @@
+import time
+BOOT_STARTED = time.perf_counter()
+
 import discord
 from discord.ext import commands
 from discord import app_commands, ui
 import asyncio
 import os
-import time
 import base64
 import re
-import shutil
 import gc
 import urllib.parse
 import json
+import heapq
 from typing import Literal
-from PIL import Image
 
-# مكتبة تجميع الـ PDF
-from reportlab.pdfgen import canvas
+import browser
+import cdp_driver
+import delivery_router
+import drive_direct
+import encoder
+import jobs
+import looplag
+import metrics
+import profiling
+import singleflight
+import workspace
+from progress import ProgressState, create_progress_bar, publisher
 
-# مكتبات قاعدة البيانات وجوجل
+# مكتبات قاعدة البيانات
 import asyncpg
 from aiohttp import web
-from google_auth_oauthlib.flow import Flow
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-
-# استيرادات Selenium
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import WebDriverException, StaleElementReferenceException
+
+# المكتبات الثقيلة (Selenium، مكتبات جوجل، reportlab، PIL) تُستورد عند أول استخدام
+# داخل الدوال نفسها حتى لا تؤخر اتصال البوت بديسكورد عند التشغيل.
 
 # --- الإعدادات ---
 DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
@@ -62,8 +64,12 @@ else:
 DOWNLOADS_DIR = "downloads"
 os.makedirs(DOWNLOADS_DIR, exist_ok=True)
 
+# إعدادات الحذف التلقائي ومساحة التخزين
+EXPIRY_STATE_FILE = os.path.join(DOWNLOADS_DIR, ".expiry_schedule.json")
+DOWNLOADS_QUOTA_BYTES = int(os.getenv("DOWNLOADS_QUOTA_BYTES", str(2 * 1024 ** 3)))
+ORPHAN_GRACE_SECONDS = 900
+
 # قواميس التتبع السحابية
-expiration_times = {}
 auth_sessions = {}
 pending_logins = {} # لحفظ رسالة الديسكورد وتحديثها لاحقاً
 
@@ -72,51 +78,89 @@ intents.message_content = True
 bot = commands.Bot(command_prefix='!', intents=intents)
 
 db_pool = None
+db_init_task = None
+
+# --- قياس زمن الإقلاع ---
+boot_timings = {}
+boot_reported = False
+
+def mark_boot(phase):
+    boot_timings[phase] = time.perf_counter() - BOOT_STARTED
+
+def report_boot():
+    global boot_reported
+    if boot_reported:
+        return
+    boot_reported = True
+    breakdown = ", ".join(f"{phase}={seconds:.2f}s" for phase, seconds in sorted(boot_timings.items(), key=lambda kv: kv[1]))
+    print(f"[INFO] Startup breakdown (seconds since process start): {breakdown}")
 
 # --- إعدادات قاعدة البيانات ---
+# كل تعديل على الجداول يُضاف هنا برقم إصدار جديد ولا يُعدل ما سبقه.
+MIGRATIONS = [
+    (1, """
+        CREATE TABLE IF NOT EXISTS user_tokens (
+            discord_id BIGINT PRIMARY KEY,
+            token TEXT,
+            refresh_token TEXT,
+            token_uri TEXT,
+            client_id TEXT,
+            client_secret TEXT,
+            scopes TEXT
+        )
+    """),
+    (2, "ALTER TABLE user_tokens ADD COLUMN IF NOT EXISTS google_email TEXT"),
+    (3, "ALTER TABLE user_tokens ADD COLUMN IF NOT EXISTS files_extracted INTEGER DEFAULT 0"),
+    (4, "ALTER TABLE user_tokens ADD COLUMN IF NOT EXISTS files_uploaded INTEGER DEFAULT 0"),
+]
+
+async def apply_migrations(conn):
+    await conn.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, applied_at TIMESTAMPTZ DEFAULT now())")
+    current = await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    pending = [(version, sql) for version, sql in MIGRATIONS if version > current]
+    if not pending:
+        return 0
+    async with conn.transaction():
+        # قفل حتى لا تطبق نسختان من البوت نفس التعديلات في نفس الوقت
+        await conn.execute("SELECT pg_advisory_xact_lock(874201)")
+        current = await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+        applied = 0
+        for version, sql in pending:
+            if version <= current:
+                continue
+            await conn.execute(sql)
+            await conn.execute("INSERT INTO schema_migrations (version) VALUES ($1)", version)
+            applied += 1
+    return applied
+
 async def init_db():
     global db_pool
     if not DATABASE_URL:
         print("[WARNING] DATABASE_URL not found. Database features will be disabled.")
         return
     try:
-        db_pool = await asyncpg.create_pool(DATABASE_URL, ssl="require")
-        async with db_pool.acquire() as conn:
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS user_tokens (
-                    discord_id BIGINT PRIMARY KEY,
-                    token TEXT,
-                    refresh_token TEXT,
-                    token_uri TEXT,
-                    client_id TEXT,
-                    client_secret TEXT,
-                    scopes TEXT,
-                    google_email TEXT,
-                    files_extracted INTEGER DEFAULT 0,
-                    files_uploaded INTEGER DEFAULT 0
-                )
-            """)
-            
-            # تحديث الجدول إذا كان قديماً
-            try:
-                await conn.execute("ALTER TABLE user_tokens ADD COLUMN google_email TEXT")
-            except Exception:
-                pass
-            try:
-                await conn.execute("ALTER TABLE user_tokens ADD COLUMN files_extracted INTEGER DEFAULT 0")
-            except Exception:
-                pass
-            try:
-                await conn.execute("ALTER TABLE user_tokens ADD COLUMN files_uploaded INTEGER DEFAULT 0")
-            except Exception:
-                pass
-            
-        print("[INFO] Database connected and table verified.")
+        # اتصال واحد عند الإقلاع بدلاً من عشرة، والبقية تُفتح عند الحاجة
+        pool = await asyncpg.create_pool(DATABASE_URL, ssl="require", min_size=1, max_size=10)
+        async with pool.acquire() as conn:
+            applied = await apply_migrations(conn)
+        db_pool = pool
+        mark_boot("database")
+        print(f"[INFO] Database connected ({applied} migration(s) applied).")
     except Exception as e:
         print(f"[ERROR] Database connection failed: {e}")
 
+async def wait_for_db(timeout=2.0):
+    """الأوامر التي تصل أثناء الإقلاع تنتظر قليلاً حتى يجهز الاتصال بقاعدة البيانات."""
+    if db_pool or not db_init_task or db_init_task.done():
+        return
+    try:
+        await asyncio.wait_for(asyncio.shield(db_init_task), timeout)
+    except asyncio.TimeoutError:
+        pass
+
 # --- دوال جوجل درايف ---
 def get_user_credentials(token_data):
+    from google.oauth2.credentials import Credentials
     return Credentials(
         token=token_data['token'],
         refresh_token=token_data['refresh_token'],
@@ -126,12 +170,18 @@ def get_user_credentials(token_data):
         scopes=json.loads(token_data['scopes'])
     )
 
-def upload_to_drive_sync(creds, file_path, filename):
+def upload_to_drive_sync(creds, file_path, filename, job=None):
+    from googleapiclient.discovery import build
+    from googleapiclient.http import MediaFileUpload
+
+    job = job or jobs.Job("drive_upload")
     try:
-        service = build('drive', 'v3', credentials=creds)
-        file_metadata = {'name': filename}
-        media = MediaFileUpload(file_path, mimetype='application/pdf', resumable=True)
-        file = service.files().create(body=file_metadata, media_body=media, fields='id, webViewLink').execute()
+        with job.span("drive_upload", bytes=os.path.getsize(file_path)):
+            service = build('drive', 'v3', credentials=creds)
+            file_metadata = {'name': filename}
+            media = MediaFileUpload(file_path, mimetype='application/pdf', resumable=True)
+            file = service.files().create(body=file_metadata, media_body=media, fields='id, webViewLink').execute()
+        metrics.BYTES_MOVED.inc(os.path.getsize(file_path), direction="drive_upload")
         return {"success": True, "link": file.get('webViewLink')}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -154,6 +204,7 @@ async def auth_login_handler(request):
     if not client_config:
         return web.Response(text="❌ Google OAuth is not configured on the server.")
     
+    from google_auth_oauthlib.flow import Flow
     flow = Flow.from_client_config(client_config, scopes=SCOPES)
     flow.redirect_uri = f"{HEROKU_BASE_URL}/auth/google/callback"
     
@@ -172,17 +223,24 @@ async def auth_callback_handler(request):
         return web.Response(text="❌ فشل تسجيل الدخول: بيانات مفقودة.", status=400)
     
     try:
+        from google_auth_oauthlib.flow import Flow
+        from googleapiclient.discovery import build
+
+        await wait_for_db()
         flow = Flow.from_client_config(client_config, scopes=SCOPES)
         flow.redirect_uri = f"{HEROKU_BASE_URL}/auth/google/callback"
         
         if state in auth_sessions:
             flow.code_verifier = auth_sessions.pop(state)
             
-        flow.fetch_token(code=code)
+        # طلبات HTTP متزامنة: تُنفذ في خيط منفصل حتى لا توقف حلقة الأحداث
+        def fetch_google_identity():
+            flow.fetch_token(code=code)
+            oauth2_service = build('oauth2', 'v2', credentials=flow.credentials)
+            return oauth2_service.userinfo().get().execute()
+
+        user_info = await asyncio.to_thread(fetch_google_identity)
         creds = flow.credentials
-        
-        oauth2_service = build('oauth2', 'v2', credentials=creds)
-        user_info = oauth2_service.userinfo().get().execute()
         google_email = user_info.get('email', 'غير معروف')
         
         discord_id = int(state)
@@ -240,6 +298,8 @@ async def start_web_server():
     app.router.add_get(f'/{DOWNLOADS_DIR}/{{folder_id}}/{{filename}}', download_file_handler)
     app.router.add_get('/auth/login/{discord_id}', auth_login_handler)
     app.router.add_get('/auth/google/callback', auth_callback_handler)
+    app.router.add_get('/metrics', metrics.metrics_handler)
+    jobs.add_routes(app)
     
     runner = web.AppRunner(app)
     await runner.setup()
@@ -249,40 +309,233 @@ async def start_web_server():
     await site.start()
     print(f"[INFO] Web server started on port {port}")
 
-# --- دالة الحذف الذكية ---
-async def background_cleanup_task(file_path):
-    while file_path in expiration_times:
-        current_time = time.time()
-        if current_time >= expiration_times[file_path]:
+# --- مجدول الحذف الذكي ---
+def remove_download_file(file_path):
+    """يحذف الملف ومجلده إذا أصبح فارغاً. يعيد True إذا تم الحذف."""
+    if not os.path.exists(file_path):
+        return False
+    try:
+        os.remove(file_path)
+        folder_path = os.path.dirname(file_path)
+        if os.path.exists(folder_path) and not os.listdir(folder_path):
+            os.rmdir(folder_path)
+        return True
+    except Exception as e:
+        print(f"[WARNING] Could not delete {file_path}: {e}")
+        return False
+
+class ExpiryScheduler:
+    """
+    مهمة واحدة لحذف الملفات المنتهية: Min-Heap لمواعيد الانتهاء، تنام حتى أقرب موعد بالضبط،
+    وتحفظ الجدول على القرص حتى يتم استرجاع الملفات المنتهية بعد إعادة التشغيل.
+    الملف المشترك بين عدة مستخدمين (مهمة مدموجة) له موعد لكل مستخدم، ويُحذف بعد آخرها
+    أو عندما يطلب كل المستخدمين حذفه.
+    """
+
+    def __init__(self, root_dir, state_file, quota_bytes):
+        self.root_dir = root_dir
+        self.state_file = state_file
+        self.quota_bytes = quota_bytes
+        self._deadlines = {}  # file_path -> موعد الحذف
+        self._heap = []       # (موعد الحذف, file_path) - المدخلات القديمة تُتجاهل عند السحب
+        self._holders = {}    # file_path -> {holder: موعده أو None إذا لم يُجدول بعد}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __contains__(self, file_path):
+        return file_path in self._deadlines
+
+    def expires_at(self, file_path):
+        return self._deadlines.get(file_path)
+
+    def hold(self, file_path, holder):
+        """يسجل مستخدماً للملف المشترك: لا يُحذف الملف قبل أن يجدول كل المستخدمين مواعيدهم."""
+        self._holders.setdefault(file_path, {}).setdefault(holder, None)
+        self._apply_holders(file_path)
+
+    def release(self, file_path, holder):
+        """يزيل مستخدماً لم يعد يحتاج الملف. يعيد عدد المستخدمين المتبقين."""
+        holders = self._holders.get(file_path, {})
+        holders.pop(holder, None)
+        if not holders:
+            self._holders.pop(file_path, None)
+            if file_path not in self._deadlines:
+                # لا أحد يحتاجه ولا موعد له
+                self._set(file_path, time.time())
+            return 0
+        self._apply_holders(file_path)
+        return len(holders)
+
+    def schedule(self, file_path, delay_seconds, holder=None):
+        deadline = time.time() + delay_seconds
+        holders = self._holders.get(file_path)
+        if holder is not None and holders is not None:
+            holders[holder] = deadline
+            self._apply_holders(file_path)
+        else:
+            self._set(file_path, deadline)
+        self._enforce_quota(protect=file_path)
+        return self._deadlines.get(file_path)
+
+    def extend(self, file_path, seconds, holder=None):
+        if file_path not in self._deadlines:
+            return None
+        holders = self._holders.get(file_path)
+        if holder is not None and holders and holders.get(holder) is not None:
+            holders[holder] += seconds
+            self._apply_holders(file_path)
+            return holders[holder]
+        self._set(file_path, self._deadlines[file_path] + seconds)
+        return self._deadlines[file_path]
+
+    def delete_now(self, file_path, holder=None):
+        # ملف مشترك: نحذف طلب هذا المستخدم فقط ونبقيه للباقين
+        if holder is not None and self.release(file_path, holder):
+            return False
+        self._holders.pop(file_path, None)
+        self._deadlines.pop(file_path, None)
+        removed = remove_download_file(file_path)
+        self._save()
+        self._wakeup.set()
+        return removed
+
+    def _apply_holders(self, file_path):
+        deadlines = self._holders[file_path].values()
+        if any(d is None for d in deadlines):
+            # أحد المستخدمين لم يستلم الملف بعد
+            if self._deadlines.pop(file_path, None) is not None:
+                self._save()
+            return
+        self._set(file_path, max(deadlines))
+
+    def start(self):
+        if self._task and not self._task.done():
+            return
+        self._load()
+        self._adopt_orphans()
+        self._enforce_quota()
+        self._task = asyncio.create_task(self._run())
+
+    def _set(self, file_path, deadline):
+        self._deadlines[file_path] = deadline
+        heapq.heappush(self._heap, (deadline, file_path))
+        self._save()
+        self._wakeup.set()
+
+    def _is_current(self, entry):
+        deadline, file_path = entry
+        return self._deadlines.get(file_path) == deadline
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            changed = False
+            while self._heap and (self._heap[0][0] <= now or not self._is_current(self._heap[0])):
+                entry = heapq.heappop(self._heap)
+                if not self._is_current(entry):
+                    continue
+                file_path = entry[1]
+                del self._deadlines[file_path]
+                self._holders.pop(file_path, None)
+                if remove_download_file(file_path):
+                    print(f"[INFO] 🗑️ تم حذف الملف تلقائياً: {file_path}")
+                changed = True
+            if changed:
+                self._save()
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _load(self):
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"[WARNING] Could not read expiry schedule: {e}")
+            return
+        for file_path, deadline in saved.items():
             if os.path.exists(file_path):
+                self._deadlines[file_path] = deadline
+                heapq.heappush(self._heap, (deadline, file_path))
+
+    def _adopt_orphans(self):
+        # الملفات الموجودة بدون موعد حذف (مثلاً من إصدار سابق) تأخذ مهلة من تاريخ تعديلها
+        for file_path, stat in self._iter_files():
+            if file_path not in self._deadlines:
+                deadline = stat.st_mtime + ORPHAN_GRACE_SECONDS
+                self._deadlines[file_path] = deadline
+                heapq.heappush(self._heap, (deadline, file_path))
+        self._save()
+
+    def _iter_files(self):
+        for root, dirs, files in os.walk(self.root_dir):
+            for name in files:
+                file_path = os.path.join(root, name)
+                if file_path == self.state_file or file_path.startswith(self.state_file):
+                    continue
                 try:
-                    os.remove(file_path)
-                    print(f"[INFO] 🗑️ تم حذف الملف تلقائياً: {file_path}")
-                    
-                    folder_path = os.path.dirname(file_path)
-                    if os.path.exists(folder_path) and not os.listdir(folder_path):
-                        os.rmdir(folder_path)
-                except Exception:
-                    pass
-            expiration_times.pop(file_path, None)
-            break
-        await asyncio.sleep(30)
+                    yield file_path, os.stat(file_path)
+                except OSError:
+                    continue
+
+    def _enforce_quota(self, protect=None):
+        if not self.quota_bytes or self.quota_bytes <= 0:
+            return
+        files = list(self._iter_files())
+        usage = sum(stat.st_size for _, stat in files)
+        if usage <= self.quota_bytes:
+            return
+        # فقط الملفات المكتملة (المجدولة) قابلة للحذف المبكر، الأقدم أولاً
+        candidates = sorted(
+            (stat.st_mtime, file_path, stat.st_size)
+            for file_path, stat in files
+            if file_path in self._deadlines and file_path != protect
+        )
+        for _, file_path, size in candidates:
+            if usage <= self.quota_bytes:
+                break
+            self._deadlines.pop(file_path, None)
+            self._holders.pop(file_path, None)
+            if remove_download_file(file_path):
+                usage -= size
+                print(f"[INFO] 🗑️ تم حذف {file_path} مبكراً لتجاوز حد التخزين ({self.quota_bytes} bytes).")
+        self._save()
+        self._wakeup.set()
+
+    def _save(self):
+        tmp_path = f"{self.state_file}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._deadlines, f)
+            os.replace(tmp_path, self.state_file)
+        except Exception as e:
+            print(f"[WARNING] Could not persist expiry schedule: {e}")
+
+expiry_scheduler = ExpiryScheduler(DOWNLOADS_DIR, EXPIRY_STATE_FILE, DOWNLOADS_QUOTA_BYTES)
+pdf_flights = singleflight.SingleFlight("fetchpdf")
 
 # --- كلاس الأزرار ---
 class FileManagementView(ui.View):
-    def __init__(self, file_path, download_url, display_name):
+    def __init__(self, file_path, download_url, display_name, holder=None):
         super().__init__(timeout=None)
         self.file_path = file_path
         self.download_url = download_url
         self.display_name = display_name
+        self.holder = holder
         
         self.add_item(ui.Button(label="تحميل الملف", url=self.download_url, style=discord.ButtonStyle.link, emoji="📥", row=0))
 
     @ui.button(label="تمديد الوقت (+10د)", style=discord.ButtonStyle.primary, emoji="⏳", row=0)
     async def extend_timer(self, interaction: discord.Interaction, button: ui.Button):
-        if self.file_path in expiration_times:
-            expiration_times[self.file_path] += 600
-            new_expire_time = int(expiration_times[self.file_path])
+        new_expire_time = expiry_scheduler.extend(self.file_path, 600, self.holder)
+        if new_expire_time is not None:
+            new_expire_time = int(new_expire_time)
             
             embed = interaction.message.embeds[0]
             embed.set_footer(text=f"⏳ تم التمديد بنجاح! سيتم الحذف عند: {time.strftime('%H:%M:%S', time.localtime(new_expire_time))}")
@@ -294,19 +547,14 @@ class FileManagementView(ui.View):
     @ui.button(label="حذف الآن", style=discord.ButtonStyle.danger, emoji="🗑️", row=0)
     async def delete_now(self, interaction: discord.Interaction, button: ui.Button):
         if os.path.exists(self.file_path):
-            try: 
-                os.remove(self.file_path)
-                folder_path = os.path.dirname(self.file_path)
-                if os.path.exists(folder_path) and not os.listdir(folder_path):
-                    os.rmdir(folder_path)
-            except Exception: 
-                pass
-            
-            expiration_times.pop(self.file_path, None)
+            if expiry_scheduler.delete_now(self.file_path, self.holder):
+                description = f"تم حذف الملف `{self.display_name}` بناءً على طلبك لتوفير المساحة."
+            else:
+                description = f"تمت إزالة الملف `{self.display_name}` من طلبك، وسيبقى على السيرفر حتى ينتهي منه باقي من طلبوه."
             
             final_embed = discord.Embed(
                 title="🗑️ تم حذف الملف", 
-                description=f"تم حذف الملف `{self.display_name}` بناءً على طلبك لتوفير المساحة.", 
+                description=description, 
                 color=discord.Color.light_grey()
             )
             await interaction.response.edit_message(embed=final_embed, view=None)
@@ -314,7 +562,32 @@ class FileManagementView(ui.View):
             await interaction.response.send_message("❌ الملف غير موجود بالفعل.", ephemeral=True)
 
 # --- إعدادات سيلينيوم والاستخراج ---
+
+# إعدادات الجودة والتحجيم لكل خيار في أمر /fetchpdf
+QUALITY_PRESETS = {
+    "عالية": {"img_format": "image/jpeg", "img_quality": 1.0, "img_ext": "jpg", "scale_factor": 2.0, "window_size": "1920,1080", "max_dim": 3500},
+    "متوسطة": {"img_format": "image/jpeg", "img_quality": 0.8, "img_ext": "jpg", "scale_factor": 1.5, "window_size": "1280,720", "max_dim": 2500},
+    "منخفضة": {"img_format": "image/jpeg", "img_quality": 0.5, "img_ext": "jpg", "scale_factor": 1.0, "window_size": "800,600", "max_dim": 1500},
+}
+
+# إعدادات السرعة والتمرير
+SPEED_PRESETS = {
+    "بطيئة": {"img_sleep": 1.2, "scroll_sleep": 1.5},
+    "متوسطة": {"img_sleep": 0.8, "scroll_sleep": 1.2},
+    "سريعة": {"img_sleep": 0.3, "scroll_sleep": 0.8},
+}
+
+def resolve_preset(presets, choice, default="متوسطة"):
+    for key, preset in presets.items():
+        if key in choice:
+            return preset
+    return presets[default]
+
 def init_driver(scale_factor: float, window_size: str):
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.common.exceptions import WebDriverException
+
     chrome_options = Options()
     chrome_options.add_argument("--headless=new")
     chrome_options.add_argument("--no-sandbox")
@@ -328,9 +601,16 @@ def init_driver(scale_factor: float, window_size: str):
     chrome_options.add_argument("--disable-site-isolation-trials") 
     chrome_options.add_argument("--disable-application-cache")
     chrome_options.add_argument("--js-flags=--expose-gc")
+    browser.enable_performance_log(chrome_options)
     
     chrome_options.binary_location = os.environ.get("GOOGLE_CHROME_BIN")
 
+    if cdp_driver.BROWSER_BACKEND == "cdp":
+        driver = cdp_driver.launch(chrome_options.binary_location or "google-chrome", chrome_options.arguments)
+        if driver:
+            driver.set_page_load_timeout(60)
+        return driver
+
     try:
         driver = webdriver.Chrome(options=chrome_options)
         driver.set_page_load_timeout(60)
@@ -339,159 +619,434 @@ def init_driver(scale_factor: float, window_size: str):
         print(f"[CRITICAL ERROR] Failed to initialize Chrome Driver: {e}")
         return None
 
-def extract_pdf_via_canvas(url: str, output_id: str, progress_state: dict, img_format: str, img_quality: float, img_ext: str, scale_factor: float, window_size: str, max_dim: int, img_sleep: float, scroll_sleep: float):
-    driver = init_driver(scale_factor, window_size)
+# يرسم صورة الصفحة على canvas بنفس أبعادها (بحد أقصى max_dim) ويعيدها كـ data URL
+CANVAS_CAPTURE_JS = """
+    var img = arguments[0];
+    var format = arguments[1];
+    var quality = arguments[2];
+    var max_limit = arguments[3];
+
+    if (img.naturalWidth === 0) return null;
+
+    var w = img.naturalWidth;
+    var h = img.naturalHeight;
+
+    if (w > max_limit || h > max_limit) {
+        var ratio = Math.min(max_limit / w, max_limit / h);
+        w = Math.round(w * ratio);
+        h = Math.round(h * ratio);
+    }
+
+    var canvasElement = document.createElement("canvas");
+    var con = canvasElement.getContext("2d");
+    canvasElement.width = w;
+    canvasElement.height = h;
+
+    con.fillStyle = "#FFFFFF";
+    con.fillRect(0, 0, w, h);
+    con.drawImage(img, 0, 0, w, h);
+
+    var data = canvasElement.toDataURL(format, quality);
+
+    con.clearRect(0, 0, w, h);
+    canvasElement.width = 0;
+    canvasElement.height = 0;
+    canvasElement = null;
+
+    return data;
+"""
+
+# ترقيم حاويات الصفحات في العارض (data-page-number / data-page-index) ومؤشرات عدد الصفحات كلٌّ على حدة:
+# window.viewerMetadata، ونص مطابق بالكامل لـ "Page 3 of 120" / "صفحة 3 من 120"، وعدد الحاويات.
+# العدد لا يُعتمد إلا إذا اتفق عليه مصدران (viewer_page_count).
+VIEWER_METADATA_JS = """
+    var attr = null, base = 0, nodes = [];
+    var attrs = [['data-page-number', 1], ['data-page-index', 0]];
+    for (var i = 0; i < attrs.length; i++) {
+        nodes = document.querySelectorAll('[' + attrs[i][0] + ']');
+        if (nodes.length) { attr = attrs[i][0]; base = attrs[i][1]; break; }
+    }
+    if (!attr) return null;
+    var meta = window.viewerMetadata;
+    var metaTotal = (meta && meta.numPages) ? meta.numPages : null;
+    var labelTotal = null;
+    var labelled = document.querySelectorAll('[aria-label]');
+    for (var j = 0; j < labelled.length && !labelTotal; j++) {
+        var m = /^\\s*(?:page|صفحة)?\\s*(\\d+)\\s*(?:of|من|\\/)\\s*(\\d+)\\s*$/i.exec(labelled[j].getAttribute('aria-label'));
+        if (m && parseInt(m[1], 10) <= parseInt(m[2], 10)) labelTotal = parseInt(m[2], 10);
+    }
+    var rect = nodes[0].getBoundingClientRect();
+    return {attr: attr, base: base, meta_total: metaTotal, label_total: labelTotal, node_count: nodes.length,
+            page_width: rect.width, page_height: rect.height};
+"""
+PAGE_COUNT_SIGNALS = ("meta_total", "label_total", "node_count")
+PAGE_RENDER_ATTEMPTS = 8  # محاولات انتظار رسم صفحة قبل اعتبارها مفقودة
+EMPTY_SCROLL_LIMIT = 6    # تمريرات متتالية بدون صفحة جديدة قبل اعتبار الملف منتهياً
+
+
+def viewer_page_count(viewer):
+    """
+    عدد الصفحات فقط إذا اتفق عليه مصدران مستقلان على الأقل: عدد خاطئ يوقف السحب مبكراً.
+    يعيد (العدد أو None, أسماء المصادر المتفقة).
+    """
+    signals = {name: int(viewer[name]) for name in PAGE_COUNT_SIGNALS if viewer and viewer.get(name)}
+    for value in sorted(set(signals.values()), reverse=True):
+        sources = [name for name, signal in signals.items() if signal == value]
+        if len(sources) >= 2:
+            return value, sources
+    return None, []
+
+
+def clean_pdf_title(raw_title, output_id):
+    clean_title = re.sub(r'[\\/*?:"<>|]', "", (raw_title or "").strip())
+    
+    if not clean_title:
+        clean_title = f"drive_doc_{output_id}"
+        
+    if not clean_title.lower().endswith(".pdf"):
+        clean_title += ".pdf"
+    return clean_title
+
+def build_pdf(image_paths, pdf_path, job, progress_state, target_size_mb=None, min_psnr=None):
+    """يضغط صور الصفحات (إذا طُلب حجم أو جودة) ثم يجمعها في ملف PDF صفحة بصفحة. يعيد تقرير الضغط."""
+    from PIL import Image
+    from reportlab.pdfgen import canvas
+
+    encoder_report = None
+    if target_size_mb or min_psnr:
+        progress_state["status"] = "جاري ضغط الصفحات..."
+        with job.span("size_encode", files=len(image_paths)):
+            encoder_report = encoder.encode_files(
+                image_paths,
+                target_bytes=int(target_size_mb * 1024 * 1024) if target_size_mb else None,
+                min_psnr=min_psnr,
+                command="fetchpdf"
+            )
+
+    progress_state["status"] = "جاري تجميع الملف وتحويله لـ PDF (بدون استهلاك للذاكرة)..."
+    
+    with job.span("pdf_assembly"):
+        c = canvas.Canvas(pdf_path)
+        for img_path in image_paths:
+            try:
+                with Image.open(img_path) as img:
+                    w, h = img.size
+            
+                c.setPageSize((w, h))
+                c.drawImage(img_path, 0, 0, width=w, height=h)
+                c.showPage()
+                gc.collect()
+            except Exception as e:
+                print(f"[WARNING] Skipping image: {e}")
+            
+        c.save() 
+    return encoder_report
+
+async def fetch_pdf_over_http(url, output_id, progress_state, max_dim, job, target_size_mb=None, min_psnr=None):
+    """
+    المسار السريع لملفات درايف العامة: تنزيل الملف الأصلي مباشرة، وإذا كان التنزيل معطلاً
+    فصور الصفحات الجاهزة من العارض بالتوازي. يعيد None إذا كان الملف يحتاج المتصفح فعلاً.
+    """
+    file_id = drive_direct.parse_file_id(url)
+    if not drive_direct.DRIVE_FAST_PATH or not file_id:
+        return None
+
+    user_dir = os.path.join(DOWNLOADS_DIR, output_id)
+    part_path = os.path.join(user_dir, f"{file_id}.part")
+    await asyncio.to_thread(os.makedirs, user_dir, exist_ok=True)
+    ws = workspace.Workspace(job.trace_id, spill_dir=user_dir)
+    progress_state["status"] = "جاري محاولة التنزيل المباشر..."
+    progress_state["start_time"] = time.time()
+
+    # بيانات العارض (عدد الصفحات والاسم) تُطلب بالتوازي مع محاولة التنزيل
+    meta_task = asyncio.create_task(drive_direct.viewer_metadata(file_id))
+    try:
+        # الملف الأصلي لا يمر بالضاغط (encoder.py): مع حد أدنى للجودة نحتاج صور الصفحات،
+        # ومع حجم مستهدف يُقبل الأصلي فقط إذا كان ضمن الحجم (وإلا العارض أو المتصفح)
+        filename = None
+        if min_psnr:
+            job.event("export_skipped", reason="quality_floor")
+        else:
+            export_max_bytes = drive_direct.DRIVE_EXPORT_MAX_BYTES
+            if target_size_mb:
+                export_max_bytes = min(export_max_bytes, int(target_size_mb * 1024 * 1024))
+            with job.span("http_export"):
+                filename = await drive_direct.download_export(file_id, part_path, job, export_max_bytes)
+        try:
+            meta = await meta_task
+        except Exception:
+            meta = None
+
+        if filename:
+            clean_title = clean_pdf_title(filename, output_id)
+            pdf_path = os.path.join(user_dir, clean_title)
+            await asyncio.to_thread(os.replace, part_path, pdf_path)
+            progress_state["title"] = clean_title
+            if meta:
+                progress_state["total_pages"] = int(meta["pages"])
+                progress_state["pages"] = int(meta["pages"])
+            metrics.DRIVE_FAST_PATH.inc(outcome="export")
+            job.event("fast_path", source="export")
+            return {
+                "success": True,
+                "file_path": pdf_path,
+                "filename": clean_title,
+                "folder_id": output_id,
+                "display_name": clean_title,
+                "pages": progress_state["pages"],
+                "total_pages": progress_state.get("total_pages"),
+                "missing_pages": [],
+                "encoder": None,
+                "source": "export",
+                "timings": job.timings
+            }
+
+        if not meta:
+            metrics.DRIVE_FAST_PATH.inc(outcome="fallback")
+            return None
+
+        total_pages = int(meta["pages"])
+        clean_title = clean_pdf_title(meta.get("title") or await drive_direct.viewer_title(file_id), output_id)
+        progress_state["title"] = clean_title
+        progress_state["total_pages"] = total_pages
+        progress_state["status"] = "جاري تحميل الصفحات مباشرة من العارض..."
+        with job.span("http_pages", pages=total_pages):
+            page_paths = await drive_direct.download_pages(file_id, total_pages, max_dim, ws, progress_state, job)
+        if not page_paths:
+            progress_state["pages"] = 0
+            metrics.DRIVE_FAST_PATH.inc(outcome="fallback")
+            return None
+
+        progress_state["extracting"] = False
+        pdf_path = os.path.join(user_dir, clean_title)
+        encoder_report = await asyncio.to_thread(build_pdf, page_paths, pdf_path, job, progress_state, target_size_mb, min_psnr)
+        metrics.DRIVE_FAST_PATH.inc(outcome="viewer_images")
+        job.event("fast_path", source="viewer_images")
+        return {
+            "success": True,
+            "file_path": pdf_path,
+            "filename": clean_title,
+            "folder_id": output_id,
+            "display_name": clean_title,
+            "pages": len(page_paths),
+            "total_pages": total_pages,
+            "missing_pages": [],
+            "encoder": encoder_report,
+            "source": "viewer_images",
+            "timings": job.timings
+        }
+    except Exception as e:
+        print(f"[WARNING] Drive fast path failed, falling back to the browser: {type(e).__name__} - {e}")
+        metrics.DRIVE_FAST_PATH.inc(outcome="fallback")
+        progress_state["pages"] = 0
+        return None
+    finally:
+        if not meta_task.done():
+            meta_task.cancel()
+        job.count("workspace_spills", ws.spills)
+        await asyncio.to_thread(ws.close)
+        if os.path.exists(part_path):
+            await asyncio.to_thread(os.remove, part_path)
+
+def extract_pdf_via_canvas(url: str, output_id: str, progress_state: dict, img_format: str, img_quality: float, img_ext: str, scale_factor: float, window_size: str, max_dim: int, img_sleep: float, scroll_sleep: float, job=None, target_size_mb=None, min_psnr=None):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import StaleElementReferenceException
+
+    job = job or jobs.Job("fetchpdf", url=url)
+    with job.span("driver_launch"):
+        driver = init_driver(scale_factor, window_size)
     if not driver:
         progress_state["error"] = "فشل في تشغيل المتصفح."
         return {"success": False, "error": progress_state["error"]}
     
-    processed_urls = set()
-    saved_images_paths = []
+    captured_pages = {}   # رقم الصفحة (من 0) -> مسار الصورة
     
     user_dir = os.path.join(DOWNLOADS_DIR, output_id)
     os.makedirs(user_dir, exist_ok=True)
     
-    temp_dir = os.path.join(user_dir, "temp_images")
-    os.makedirs(temp_dir, exist_ok=True)
+    # الصفحات في tmpfs ضمن ميزانية الذاكرة المشتركة، وما يتجاوزها على القرص داخل user_dir
+    ws = workspace.Workspace(job.trace_id, spill_dir=user_dir)
     
     try:
         progress_state["status"] = "جاري فتح الصفحة وجلب المعلومات..."
-        driver.get(url)
-        
-        WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.TAG_NAME, 'img')))
-        time.sleep(2) 
+        network_log = browser.NetworkLog(driver)
+        blocked_categories = browser.configure_tab(driver, url)
+        with job.span("page_load"):
+            driver.get(url)
+            
+            WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.TAG_NAME, 'img')))
+            time.sleep(2) 
+        browser.report_page(driver, network_log, job, "fetchpdf", url, blocked_categories)
         
-        raw_title = driver.title.replace(" - Google Drive", "").strip()
-        clean_title = re.sub(r'[\\/*?:"<>|]', "", raw_title)
+        # صفحات العارض تُعرض كروابط blob من أصل الصفحة بعد التحويل (http:// و docs.google.com تنتهي
+        # على https://drive.google.com)، لذا الأصل من driver.current_url لا من الرابط المُدخل
+        parsed_url = urllib.parse.urlparse(driver.current_url)
+        check_url_string = f"blob:{parsed_url.scheme}://{parsed_url.netloc}/"
         
-        if not clean_title:
-            clean_title = f"drive_doc_{output_id}"
-            
-        if not clean_title.lower().endswith(".pdf"):
-            clean_title += ".pdf"
-            
+        clean_title = clean_pdf_title(driver.title.replace(" - Google Drive", ""), output_id)
         progress_state["title"] = clean_title
         progress_state["status"] = "جاري سحب الصفحات..."
         
-        scroll_attempts = 0
-        max_attempts = 2000
-        empty_scrolls = 0
         progress_state["start_time"] = time.time()
+
+        def capture_image(img):
+            """يرسم صورة الصفحة على canvas داخل المتصفح ويعيد البايتات (أو None إذا لم تُرسم بعد)."""
+            with job.span("lazy_load", trace=False):
+                driver.execute_script("arguments[0].scrollIntoView(true);", img)
+                time.sleep(img_sleep) 
+            with job.span("encode", trace=False):
+                b64_data = driver.execute_script(CANVAS_CAPTURE_JS, img, img_format, img_quality, max_dim)
+            if not b64_data:
+                metrics.IMAGES_REJECTED.inc(reason="not_rendered")
+                return None
+            with job.span("decode", trace=False):
+                b64_string = b64_data.split(",")[1] if "," in b64_data else b64_data
+                img_bytes = base64.b64decode(b64_string)
+            metrics.BYTES_MOVED.inc(len(img_bytes), direction="browser_capture")
+            return img_bytes
+
+        def store_page(page_index, img_bytes):
+            page_name = f"page_{page_index:04d}.{img_ext}"
+            ws.put(page_name, img_bytes, as_file=True)
+            captured_pages[page_index] = ws.path(page_name)
+            progress_state["pages"] = len(captured_pages)
+            job.event("page_captured", page=page_index + 1, bytes=len(img_bytes))
+            gc.collect() 
+
+        # ترقيم صفحات العارض: نطلب كل صفحة باسمها. إذا اتفق مصدران على العدد نتوقف عنده مباشرة،
+        # وإلا نستمر حتى تتوقف الصفحات عن الظهور (EMPTY_SCROLL_LIMIT تمريرات فارغة)
+        viewer = driver.execute_script(VIEWER_METADATA_JS)
+        expected_total, count_sources = viewer_page_count(viewer)
+        total_pages = None
+        missing_pages = []
         
-        while scroll_attempts < max_attempts:
-            img_elements = driver.find_elements(By.TAG_NAME, 'img')
-            extracted_in_this_pass = False
-            
-            for img in img_elements:
-                try:
-                    src = img.get_attribute('src')
-                    check_url_string = "blob:https://drive.google.com/"
-                    
-                    if src and src.startswith(check_url_string) and src not in processed_urls:
-                        driver.execute_script("arguments[0].scrollIntoView(true);", img)
-                        time.sleep(img_sleep) 
-                        
-                        b64_data = driver.execute_script("""
-                            var img = arguments[0];
-                            var format = arguments[1];
-                            var quality = arguments[2];
-                            var max_limit = arguments[3];
-                            
-                            if (img.naturalWidth === 0) return null;
-                            
-                            var w = img.naturalWidth;
-                            var h = img.naturalHeight;
-                            
-                            if (w > max_limit || h > max_limit) {
-                                var ratio = Math.min(max_limit / w, max_limit / h);
-                                w = Math.round(w * ratio);
-                                h = Math.round(h * ratio);
-                            }
-                            
-                            var canvasElement = document.createElement("canvas");
-                            var con = canvasElement.getContext("2d");
-                            canvasElement.width = w;
-                            canvasElement.height = h;
-                            
-                            con.fillStyle = "#FFFFFF";
-                            con.fillRect(0, 0, w, h);
-                            con.drawImage(img, 0, 0, w, h);
-                            
-                            var data = canvasElement.toDataURL(format, quality);
-                            
-                            con.clearRect(0, 0, w, h);
-                            canvasElement.width = 0;
-                            canvasElement.height = 0;
-                            canvasElement = null;
-                            
-                            return data;
-                        """, img, img_format, img_quality, max_dim)
-                        
-                        if b64_data:
-                            b64_string = b64_data.split(",")[1] if "," in b64_data else b64_data
-                            img_bytes = base64.b64decode(b64_string)
-                            
-                            page_path = os.path.join(temp_dir, f"page_{len(saved_images_paths):04d}.{img_ext}")
-                            with open(page_path, "wb") as f:
-                                f.write(img_bytes)
-                                
-                            saved_images_paths.append(page_path)
-                            processed_urls.add(src)
-                            
-                            progress_state["pages"] = len(saved_images_paths)
-                            extracted_in_this_pass = True
-                            empty_scrolls = 0
-                            
-                            del b64_data, b64_string, img_bytes
-                            gc.collect() 
-                            break 
-                            
-                except StaleElementReferenceException:
-                    break
-            
-            if not extracted_in_this_pass:
-                driver.execute_script("window.scrollBy(0, window.innerHeight);")
-                time.sleep(scroll_sleep)
-                empty_scrolls += 1
-                driver.execute_script("window.gc && window.gc();") 
+        with job.span("capture"):
+            if viewer and viewer.get("attr"):
+                job.event("viewer_metadata", expected_total=expected_total, count_sources=count_sources, **viewer)
+                if expected_total:
+                    progress_state["total_pages"] = expected_total
+                page_index = 0
+                attempts = 0
+                consecutive_missing = 0
+                
+                while expected_total is None or page_index < expected_total:
+                    selector = f'[{viewer["attr"]}="{page_index + viewer["base"]}"]'
+                    img = None
+                    try:
+                        with job.span("url_harvest", trace=False):
+                            for candidate in driver.find_elements(By.CSS_SELECTOR, f"{selector} img"):
+                                src = candidate.get_attribute('src')
+                                if src and src.startswith(check_url_string):
+                                    img = candidate
+                                    break
+                        img_bytes = capture_image(img) if img else None
+                    except StaleElementReferenceException:
+                        img_bytes = None
+
+                    if img_bytes:
+                        store_page(page_index, img_bytes)
+                        del img_bytes
+                        page_index += 1
+                        attempts = 0
+                        consecutive_missing = 0
+                        continue
+
+                    attempts += 1
+                    if expected_total is None and attempts > EMPTY_SCROLL_LIMIT:
+                        # عدد غير معروف ولا صفحة جديدة بعد عدة تمريرات: نهاية الملف
+                        break
+                    if expected_total is not None and attempts > PAGE_RENDER_ATTEMPTS:
+                        print(f"[WARNING] Page {page_index + 1} did not render, skipping it.")
+                        missing_pages.append(page_index + 1)
+                        page_index += 1
+                        attempts = 0
+                        consecutive_missing += 1
+                        if consecutive_missing >= EMPTY_SCROLL_LIMIT and page_index < expected_total:
+                            # العارض توقف عن الرسم: باقي الصفحات تُسجَّل ناقصة (تظهر للمستخدم) بدل انتظارها واحدة واحدة
+                            print(f"[WARNING] Viewer stopped rendering at page {page_index}, marking the remaining pages as missing.")
+                            missing_pages.extend(range(page_index + 1, expected_total + 1))
+                            job.event("capture_stopped", reason="pages_not_rendering", page=page_index, expected_total=expected_total)
+                            page_index = expected_total
+                        continue
+
+                    # الصفحة لم تُرسم بعد: ننتقل إليها مباشرة (أو للأسفل إذا لم تُضف للصفحة بعد) وننتظر الرسم
+                    with job.span("scroll"):
+                        driver.execute_script(
+                            "var page = document.querySelector(arguments[0]);"
+                            "if (page) page.scrollIntoView(true); else window.scrollBy(0, window.innerHeight);", selector
+                        )
+                        time.sleep(scroll_sleep)
+                    network_log.drain()
+                    driver.execute_script("window.gc && window.gc();") 
+
+                total_pages = page_index
+                progress_state["total_pages"] = total_pages
+                job.event("page_count", total=total_pages, source="viewer_count" if expected_total else "empty_scroll", missing=len(missing_pages))
             else:
+                # عارض بدون بيانات وصفية: التمرير حتى تتوقف الصفحات الجديدة عن الظهور
+                processed_urls = set()
+                scroll_attempts = 0
+                max_attempts = 2000
                 empty_scrolls = 0
-            
-            if empty_scrolls >= 6:
-                break
+                while scroll_attempts < max_attempts:
+                    with job.span("url_harvest", trace=False):
+                        img_elements = driver.find_elements(By.TAG_NAME, 'img')
+                    extracted_in_this_pass = False
                 
-            scroll_attempts += 1
+                    for img in img_elements:
+                        try:
+                            src = img.get_attribute('src')
+                        
+                            if src and src.startswith(check_url_string) and src not in processed_urls:
+                                img_bytes = capture_image(img)
+                                if img_bytes:
+                                    store_page(len(captured_pages), img_bytes)
+                                    processed_urls.add(src)
+                                    extracted_in_this_pass = True
+                                    del img_bytes
+                                    break 
+                                
+                        except StaleElementReferenceException:
+                            break
+                
+                    if not extracted_in_this_pass:
+                        with job.span("scroll"):
+                            driver.execute_script("window.scrollBy(0, window.innerHeight);")
+                            time.sleep(scroll_sleep)
+                        # تفريغ سجل الشبكة أولاً بأول حتى لا يتراكم في ChromeDriver
+                        network_log.drain()
+                        empty_scrolls += 1
+                        driver.execute_script("window.gc && window.gc();") 
+                    else:
+                        empty_scrolls = 0
+                
+                    if empty_scrolls >= EMPTY_SCROLL_LIMIT:
+                        break
+                    
+                    scroll_attempts += 1
 
+        saved_images_paths = [captured_pages[i] for i in sorted(captured_pages)]
         if not saved_images_paths:
             progress_state["error"] = "لم يتم العثور على أي محتوى مطابق."
             return {"success": False, "error": progress_state["error"]}
         
         progress_state["extracting"] = False 
-        progress_state["status"] = "جاري تجميع الملف وتحويله لـ PDF (بدون استهلاك للذاكرة)..."
-        
         pdf_path = os.path.join(user_dir, clean_title)
-        
-        c = canvas.Canvas(pdf_path)
-        for img_path in saved_images_paths:
-            try:
-                with Image.open(img_path) as img:
-                    w, h = img.size
-                
-                c.setPageSize((w, h))
-                c.drawImage(img_path, 0, 0, width=w, height=h)
-                c.showPage()
-                gc.collect()
-            except Exception as e:
-                print(f"[WARNING] Skipping image: {e}")
-                
-        c.save() 
+        encoder_report = build_pdf(saved_images_paths, pdf_path, job, progress_state, target_size_mb, min_psnr)
         
         return {
             "success": True, 
             "file_path": pdf_path, 
             "filename": clean_title, 
             "folder_id": output_id, 
-            "display_name": clean_title
+            "display_name": clean_title,
+            "pages": len(saved_images_paths),
+            "total_pages": total_pages,
+            "missing_pages": missing_pages,
+            "encoder": encoder_report,
+            "timings": job.timings
         }
 
     except Exception as e:
@@ -500,27 +1055,34 @@ def extract_pdf_via_canvas(url: str, output_id: str, progress_state: dict, img_f
         progress_state["done"] = True
         if driver:
             driver.quit()
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir, ignore_errors=True)
+        job.count("workspace_spills", ws.spills)
+        ws.close()
+
+@bot.event
+async def setup_hook():
+    # يعمل قبل الاتصال بالـ Gateway: نبدأ خادم الويب وقاعدة البيانات بالتوازي مع الاتصال
+    global db_init_task
+    mark_boot("imports")
+    looplag.monitor.start()
+    await start_web_server()
+    mark_boot("web_server")
+    db_init_task = asyncio.create_task(init_db())
 
 @bot.event
 async def on_ready():
     print(f'Bot is ready. Logged in as {bot.user}')
-    await init_db()
-    bot.loop.create_task(start_web_server())
+    mark_boot("gateway_ready")
+    expiry_scheduler.start()
+    if boot_reported:
+        return
     try:
         await bot.tree.sync()
+        mark_boot("command_sync")
     except Exception as e:
         print(f"Sync error: {e}")
-
-def create_progress_bar(current, total, length=15):
-    if total is None or total <= 0:
-        return "[▓▓▓▓▓▓▓▓▓▓▓▓▓▓▓] (غير محدد)"
-    
-    percent = min(int((current / total) * 100), 100)
-    filled_length = int(length * current // total)
-    bar = '█' * filled_length + '░' * (length - filled_length)
-    return f"[{bar}] {percent}%"
+    if db_init_task:
+        await db_init_task
+    report_boot()
 
 # --- أوامر تسجيل الدخول، الخروج، والملف الشخصي ---
 
@@ -548,6 +1110,7 @@ async def login_command(interaction: discord.Interaction):
 
 @bot.tree.command(name="logout", description="تسجيل الخروج وحذف بيانات ربط جوجل من البوت")
 async def logout_command(interaction: discord.Interaction):
+    await wait_for_db()
     if not db_pool:
         await interaction.response.send_message("❌ قاعدة البيانات غير متصلة.", ephemeral=True)
         return
@@ -562,6 +1125,7 @@ async def logout_command(interaction: discord.Interaction):
 
 @bot.tree.command(name="profile", description="عرض الملف الشخصي وإحصائيات الاستخدام الخاصة بك")
 async def profile_command(interaction: discord.Interaction):
+    await wait_for_db()
     if not db_pool:
         await interaction.response.send_message("❌ قاعدة البيانات غير متصلة.", ephemeral=True)
         return
@@ -589,6 +1153,16 @@ async def profile_command(interaction: discord.Interaction):
     
     await interaction.response.send_message(embed=embed)
 
+def add_profile_links(embed, profile_files, holder):
+    """روابط ملفات الأداء (profile) في رسالة النتيجة، بنفس مدة بقاء الملف في السيرفر."""
+    links = []
+    for path in profile_files or []:
+        expiry_scheduler.schedule(path, 900, holder)
+        folder_id, filename = os.path.basename(os.path.dirname(path)), os.path.basename(path)
+        links.append(f"[{filename}]({HEROKU_BASE_URL}/{DOWNLOADS_DIR}/{folder_id}/{urllib.parse.quote(filename)})")
+    if links:
+        embed.add_field(name="🔬 ملفات الأداء:", value=" | ".join(links), inline=False)
+
 # --- أمر السلاش الرئيسي ---
 @bot.tree.command(name="fetchpdf", description="استخراج ملف من جوجل درايف")
 @app_commands.describe(
@@ -596,7 +1170,10 @@ async def profile_command(interaction: discord.Interaction):
     expected_pages="عدد الصفحات (اختياري)",
     quality="اختر جودة الصور المستخرجة",
     speed="اختر سرعة عملية السحب",
-    save_to_drive="هل ترغب برفع الملف مباشرة لحسابك في درايف؟ (يجب استخدام أمر /login أولاً)"
+    save_to_drive="هل ترغب برفع الملف مباشرة لحسابك في درايف؟ (يجب استخدام أمر /login أولاً)",
+    target_size_mb="الحجم المستهدف لملف الـ PDF بالميجابايت (اختياري)",
+    quality_floor="أقل جودة مقبولة عند ضغط الصفحات (اختياري)",
+    profile="(للمشرفين) حفظ ملف أداء CPU والذاكرة لهذه المهمة"
 )
 async def fetch_pdf(
     interaction: discord.Interaction, 
@@ -604,12 +1181,20 @@ async def fetch_pdf(
     expected_pages: int = None,
     quality: Literal["عالية (دقة ممتازة - حجم كبير)", "متوسطة (موصى به - متوازن)", "منخفضة (سريعة - حجم صغير)"] = "متوسطة (موصى به - متوازن)",
     speed: Literal["ممتازة/بطيئة (تضمن عدم ضياع الصفحات)", "متوسطة (توازن بين الأمان والوقت)", "سريعة جداً (قد تفقد بعض الصفحات وتكون مشوشة)"] = "ممتازة/بطيئة (تضمن عدم ضياع الصفحات)",
-    save_to_drive: bool = False
+    save_to_drive: bool = False,
+    target_size_mb: int = None,
+    quality_floor: Literal["ممتازة", "جيدة", "مقبولة"] = None,
+    profile: bool = False
 ):
     await interaction.response.defer(ephemeral=False)
+
+    if profile and not profiling.is_admin(interaction.user):
+        await interaction.edit_original_response(content="❌ خيار `profile` متاح للمشرفين فقط.")
+        return
     
     user_creds_data = None
     if save_to_drive:
+        await wait_for_db()
         if not db_pool:
             await interaction.edit_original_response(content="❌ عذراً، ميزة الرفع السحابي معطلة حالياً.")
             return
@@ -621,82 +1206,85 @@ async def fetch_pdf(
             await interaction.edit_original_response(content="❌ **يجب عليك تسجيل الدخول أولاً!** استخدم أمر `/login`.")
             return
 
-    # إعدادات الجودة والتحجيم
-    if "عالية" in quality:
-        img_format = "image/jpeg"
-        img_quality = 1.0
-        img_ext = "jpg"
-        scale_factor = 2.0
-        window_size = "1920,1080"
-        max_dim = 3500
-    elif "منخفضة" in quality:
-        img_format = "image/jpeg"
-        img_quality = 0.5
-        img_ext = "jpg"
-        scale_factor = 1.0
-        window_size = "800,600"
-        max_dim = 1500
-    else:
-        img_format = "image/jpeg"
-        img_quality = 0.8
-        img_ext = "jpg"
-        scale_factor = 1.5
-        window_size = "1280,720"
-        max_dim = 2500
-        
-    # إعدادات السرعة والتمرير
-    if "بطيئة" in speed:
-        img_sleep = 1.2
-        scroll_sleep = 1.5
-    elif "سريعة" in speed:
-        img_sleep = 0.3
-        scroll_sleep = 0.8
-    else:
-        img_sleep = 0.8
-        scroll_sleep = 1.2
-
-    progress_state = {
-        "status": "تهيئة...",
-        "pages": 0,
-        "title": "جاري التعرف...",
-        "start_time": None,
-        "extracting": True,
-        "done": False,
-        "error": None
-    }
-    
-    task = asyncio.create_task(
-        asyncio.to_thread(extract_pdf_via_canvas, url, str(interaction.id), progress_state, img_format, img_quality, img_ext, scale_factor, window_size, max_dim, img_sleep, scroll_sleep)
+    quality_preset = resolve_preset(QUALITY_PRESETS, quality)
+    speed_preset = resolve_preset(SPEED_PRESETS, speed)
+    min_psnr = encoder.QUALITY_FLOORS.get(quality_floor)
+    job = jobs.registry.start("fetchpdf", user_id=interaction.user.id, url=url, quality=quality, speed=speed, save_to_drive=save_to_drive, target_size_mb=target_size_mb, quality_floor=quality_floor, profile=profile)
+
+    async def extract(flight):
+        # ملفات الأداء تُكتب في مجلد المهمة نفسه وتُخدم عبر download_file_handler
+        profiler = profiling.JobProfiler(os.path.join(DOWNLOADS_DIR, str(interaction.id)), flight.job) if profile else None
+        if profiler:
+            profiler.start()
+        try:
+            # ملف عام؟ تنزيل مباشر بدون متصفح، وإلا العارض الحقيقي في كروم
+            result = await fetch_pdf_over_http(
+                url, str(interaction.id), flight.progress_state, quality_preset["max_dim"], flight.job,
+                target_size_mb=target_size_mb, min_psnr=min_psnr
+            )
+            if result is None:
+                result = await asyncio.to_thread(
+                    extract_pdf_via_canvas, url, str(interaction.id), flight.progress_state, **quality_preset, **speed_preset,
+                    job=flight.job, target_size_mb=target_size_mb, min_psnr=min_psnr
+                )
+        finally:
+            profile_files = await asyncio.to_thread(profiler.stop) if profiler else []
+        result["profile_files"] = profile_files
+        if result.get("success"):
+            # الملف مشترك بين كل من انضم للمهمة: لا يُحذف قبل أن يستلمه الجميع
+            for member in flight.members:
+                expiry_scheduler.hold(result["file_path"], member)
+        return result
+
+    # نفس الملف بنفس الإعدادات قيد الاستخراج لمستخدم آخر؟ ننضم لمهمته بدلاً من متصفح جديد
+    flight, leader = pdf_flights.join(
+        # مهمة عليها ملف أداء لا تُشارك مع غيرها (المطلوب قياس هذه المهمة بالذات)
+        singleflight.flight_key(url, **quality_preset, **speed_preset, target_size_mb=target_size_mb, min_psnr=min_psnr, **({"profile": job.trace_id} if profile else {})),
+        ProgressState({
+            "status": "تهيئة...",
+            "pages": 0,
+            "title": "جاري التعرف...",
+            "start_time": None,
+            "extracting": True,
+            "done": False,
+            "error": None
+        }),
+        job,
+        extract,
+        member=interaction.id
     )
+    progress_state = flight.progress_state
+    if not leader:
+        job.event("coalesced", leader=flight.job.trace_id)
     
     original_response = await interaction.original_response()
     try:
         current_message = await interaction.channel.fetch_message(original_response.id)
     except Exception:
         current_message = original_response
-        
-    message_creation_time = time.time()
-    
-    while not task.done():
+
+    def render_progress():
         status_msg = progress_state["status"]
         current_pages = progress_state["pages"]
         title = progress_state["title"]
         start_time = progress_state["start_time"]
+        # العدد الذي أدخله المستخدم، أو العدد الذي يعلنه العارض نفسه
+        total_pages = expected_pages or progress_state.get("total_pages")
         
-        p_bar = create_progress_bar(current_pages, expected_pages)
-        pages_text = f"{current_pages} / {expected_pages}" if expected_pages else f"{current_pages} (لم يتم إدخال الإجمالي)"
+        p_bar = create_progress_bar(current_pages, total_pages)
+        pages_text = f"{current_pages} / {total_pages}" if total_pages else f"{current_pages} (لم يتم إدخال الإجمالي)"
         
         if progress_state.get("extracting", True):
             eta_text = "جاري الحساب..."
-            if start_time and current_pages > 0 and expected_pages:
-                eta_seconds = int(((time.time() - start_time) / current_pages) * max(0, expected_pages - current_pages))
+            if start_time and current_pages > 0 and total_pages:
+                eta_seconds = int(((time.time() - start_time) / current_pages) * max(0, total_pages - current_pages))
                 mins, secs = divmod(eta_seconds, 60)
                 
                 if mins > 0:
                     eta_text = f"حوالي {mins} دقيقة و {secs} ثانية"
                 else:
                     eta_text = f"حوالي {secs} ثانية"
-            elif not expected_pages:
+            elif not total_pages:
                 eta_text = "غير معروف"
         else:
             eta_text = "يرجى الانتظار، جاري تجهيز الملف للتحميل ⏳"
@@ -707,97 +1295,122 @@ async def fetch_pdf(
         embed.add_field(name="التقدم:", value=f"`{p_bar}`", inline=False)
         embed.add_field(name="الصفحات المسحوبة:", value=f"`{pages_text}`", inline=True)
         embed.add_field(name="الوقت المقدر (ETA):", value=f"`{eta_text}`", inline=True)
-        embed.set_footer(text=f"⚙️ الجودة: {quality.split(' ')[0]} | السرعة: {speed.split(' ')[0]}")
-        
-        time_elapsed_since_creation = time.time() - message_creation_time
-        if time_elapsed_since_creation >= 840: 
-            try:
-                new_message = await interaction.channel.send(embed=embed)
-                await current_message.delete()
-                current_message = new_message
-                message_creation_time = time.time()
-            except Exception:
-                pass
-        else:
-            try:
-                await current_message.edit(embed=embed)
-            except Exception:
-                pass 
-                
-        await asyncio.sleep(5) 
-    
-    result = await task
+        shared_text = "" if leader else f" | 🔗 مشترك مع {flight.job.trace_id}"
+        embed.set_footer(text=f"⚙️ الجودة: {quality.split(' ')[0]} | السرعة: {speed.split(' ')[0]} | 🔎 {job.trace_id}{shared_text}")
+        return embed
+
+    progress_handle = publisher.attach(progress_state, current_message, render_progress)
+    file_scheduled = False
+    try:
+        result = await pdf_flights.wait(flight)
+    except Exception as e:
+        print(f"[CRITICAL ERROR] Extraction task failed: {type(e).__name__} - {e}")
+        result = {"success": False, "error": f"فشل غير متوقع في الخادم: {e}"}
+    finally:
+        current_message = await progress_handle.close()
     
-    if result.get("success"):
-        file_path = result["file_path"]
-        filename = result["filename"]
-        folder_id = result["folder_id"]
-        display_name = result["display_name"]
+    try:
+        if result.get("success"):
+            file_path = result["file_path"]
+            filename = result["filename"]
+            folder_id = result["folder_id"]
+            display_name = result["display_name"]
         
-        file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
+            file_size = await asyncio.to_thread(os.path.getsize, file_path)
+            file_size_mb = file_size / (1024 * 1024)
         
-        if db_pool:
-            try:
-                async with db_pool.acquire() as conn:
-                    await conn.execute("UPDATE user_tokens SET files_extracted = files_extracted + 1 WHERE discord_id = $1", interaction.user.id)
-            except Exception:
-                pass
+            if db_pool:
+                try:
+                    async with db_pool.acquire() as conn:
+                        await conn.execute("UPDATE user_tokens SET files_extracted = files_extracted + 1 WHERE discord_id = $1", interaction.user.id)
+                except Exception:
+                    pass
 
-        final_embed = discord.Embed(
-            title="✅ اكتملت المعالجة!", 
-            description=f"تم استخراج جميع الصفحات لملف **{display_name}**.",
-            color=discord.Color.green()
-        )
-        final_embed.add_field(name="حجم الملف:", value=f"`{file_size_mb:.2f} MB`", inline=True)
-        final_embed.add_field(name="عدد الصفحات:", value=f"`{progress_state['pages']}`", inline=True)
-        final_embed.add_field(name="\u200B", value="\u200B", inline=True)
+            final_embed = discord.Embed(
+                title="✅ اكتملت المعالجة!", 
+                description=f"تم استخراج جميع الصفحات لملف **{display_name}**.",
+                color=discord.Color.green()
+            )
+            final_embed.add_field(name="حجم الملف:", value=f"`{file_size_mb:.2f} MB`", inline=True)
+            final_embed.add_field(name="عدد الصفحات:", value=f"`{progress_state['pages']}`", inline=True)
+            if result.get("missing_pages"):
+                final_embed.add_field(name="⚠️ صفحات لم تُرسم:", value=f"`{', '.join(map(str, result['missing_pages'][:30]))}`", inline=False)
+            if result.get("encoder"):
+                final_embed.add_field(name="الحجم الموفر:", value=f"`{encoder.format_savings(result['encoder'])}`", inline=True)
+            else:
+                final_embed.add_field(name="\u200B", value="\u200B", inline=True)
         
-        upload_result = {}
+            add_profile_links(final_embed, result.get("profile_files"), interaction.id)
+            upload_result = {}
         
-        if save_to_drive and user_creds_data:
-            uploading_embed = discord.Embed(title="☁️ جاري الرفع لجوجل درايف...", color=discord.Color.gold())
-            await current_message.edit(embed=uploading_embed)
+            if save_to_drive and user_creds_data:
+                uploading_embed = discord.Embed(title="☁️ جاري الرفع لجوجل درايف...", color=discord.Color.gold())
+                await current_message.edit(embed=uploading_embed)
             
-            try:
-                creds = get_user_credentials(user_creds_data)
-                upload_result = await asyncio.to_thread(upload_to_drive_sync, creds, file_path, display_name)
+                try:
+                    drive_started = time.perf_counter()
+                    creds = get_user_credentials(user_creds_data)
+                    upload_result = await asyncio.to_thread(upload_to_drive_sync, creds, file_path, display_name, job)
                 
-                if upload_result.get("success"):
-                    final_embed.add_field(name="☁️ تم الرفع لحسابك بنجاح!", value=f"[اضغط هنا لفتح الملف في جوجل درايف الخاص بك]({upload_result['link']})", inline=False)
-                    final_embed.set_footer(text="تم الحفظ بنجاح في حساب جوجل درايف المربوط.")
+                    if upload_result.get("success"):
+                        final_embed.add_field(name="☁️ تم الرفع لحسابك بنجاح!", value=f"[اضغط هنا لفتح الملف في جوجل درايف الخاص بك]({upload_result['link']})", inline=False)
+                        final_embed.set_footer(text="تم الحفظ بنجاح في حساب جوجل درايف المربوط.")
                     
-                    if db_pool:
-                        try:
-                            async with db_pool.acquire() as conn:
-                                await conn.execute("UPDATE user_tokens SET files_uploaded = files_uploaded + 1 WHERE discord_id = $1", interaction.user.id)
-                        except Exception:
-                            pass
+                        if db_pool:
+                            try:
+                                async with db_pool.acquire() as conn:
+                                    await conn.execute("UPDATE user_tokens SET files_uploaded = files_uploaded + 1 WHERE discord_id = $1", interaction.user.id)
+                            except Exception:
+                                pass
                     
-                    expiration_times[file_path] = time.time() + 5 
-                    asyncio.create_task(background_cleanup_task(file_path))
-                    await current_message.edit(embed=final_embed, view=None)
-                else:
-                    final_embed.add_field(name="⚠️ فشل الرفع للدرايف:", value=f"```\n{upload_result['error']}\n```", inline=False)
-            except Exception as e:
-                final_embed.add_field(name="⚠️ حدث خطأ غير متوقع أثناء الرفع:", value=str(e), inline=False)
+                        expiry_scheduler.schedule(file_path, 5, interaction.id)
+                        file_scheduled = True
+                        await current_message.edit(embed=final_embed, view=None)
+                        delivery_router.record("fetchpdf", delivery_router.DRIVE, time.perf_counter() - drive_started, job)
+                    else:
+                        delivery_router.record("fetchpdf", delivery_router.DRIVE, time.perf_counter() - drive_started, job, success=False)
+                        final_embed.add_field(name="⚠️ فشل الرفع للدرايف:", value=f"```\n{upload_result['error']}\n```", inline=False)
+                except Exception as e:
+                    delivery_router.record("fetchpdf", delivery_router.DRIVE, time.perf_counter() - drive_started, job, success=False)
+                    final_embed.add_field(name="⚠️ حدث خطأ غير متوقع أثناء الرفع:", value=str(e), inline=False)
 
-        if not save_to_drive or not upload_result.get("success"):
-            encoded_filename = urllib.parse.quote(filename)
-            direct_link = f"{HEROKU_BASE_URL}/{DOWNLOADS_DIR}/{folder_id}/{encoded_filename}"
-            expiration_times[file_path] = time.time() + 900 
+            # ملف ضمن حد المرفقات يُرسل مع الرسالة نفسها بدلاً من رابط خادم الملفات
+            sent_as_attachment = False
+            backend = delivery_router.choose(file_size, delivery_router.attachment_limit(interaction), delivery_router.FILE_SERVER)
+            if not upload_result.get("success") and backend == delivery_router.DISCORD:
+                final_embed.set_footer(text="📎 الملف مرفق بهذه الرسالة.")
+                try:
+                    with delivery_router.timed("fetchpdf", delivery_router.DISCORD, job):
+                        await current_message.edit(embed=final_embed, view=None, attachments=[discord.File(file_path, filename=filename)])
+                    sent_as_attachment = True
+                except discord.HTTPException as e:
+                    print(f"[WARNING] Attachment delivery failed, using the file server instead: {type(e).__name__} - {e}")
+
+            if not upload_result.get("success") and not sent_as_attachment:
+                file_server_started = time.perf_counter()
+                encoded_filename = urllib.parse.quote(filename)
+                direct_link = f"{HEROKU_BASE_URL}/{DOWNLOADS_DIR}/{folder_id}/{encoded_filename}"
+                expiry_scheduler.schedule(file_path, 900, interaction.id)
+                file_scheduled = True
             
-            final_embed.add_field(name="💡 معلومة مفيدة:", value="يتيح لك زر **(تمديد الوقت)** زيادة وقت بقاء الملف في السيرفر لمدة 10 دقائق إضافية.", inline=False)
-            final_embed.set_footer(text="⚠️ سيتم حذف الملف تلقائياً من السيرفر بعد 15 دقيقة.")
+                final_embed.add_field(name="💡 معلومة مفيدة:", value="يتيح لك زر **(تمديد الوقت)** زيادة وقت بقاء الملف في السيرفر لمدة 10 دقائق إضافية.", inline=False)
+                final_embed.set_footer(text="⚠️ سيتم حذف الملف تلقائياً من السيرفر بعد 15 دقيقة.")
             
-            view = FileManagementView(file_path, direct_link, display_name)
-            await current_message.edit(embed=final_embed, view=view)
-            asyncio.create_task(background_cleanup_task(file_path))
+                view = FileManagementView(file_path, direct_link, display_name, interaction.id)
+                await current_message.edit(embed=final_embed, view=view)
+                delivery_router.record("fetchpdf", delivery_router.FILE_SERVER, time.perf_counter() - file_server_started, job)
             
-    else:
-        err_embed = discord.Embed(title="❌ فشل العملية", description=result.get('error'), color=discord.Color.red())
-        await current_message.edit(embed=err_embed)
+        else:
+            err_embed = discord.Embed(title="❌ فشل العملية", description=result.get('error'), color=discord.Color.red())
+            add_profile_links(err_embed, result.get("profile_files"), interaction.id)
+            await current_message.edit(embed=err_embed)
+    finally:
+        if result.get("success") and not file_scheduled:
+            expiry_scheduler.release(result["file_path"], interaction.id)
+        job.finish(result.get("success", False), result.get("error"))
 
-if DISCORD_BOT_TOKEN:
-    bot.run(DISCORD_BOT_TOKEN)
-else:
-    print("[CRITICAL ERROR] Token not found in environment variables.")
+if __name__ == "__main__":
+    if DISCORD_BOT_TOKEN:
+        bot.run(DISCORD_BOT_TOKEN)
+    else:
+        print("[CRITICAL ERROR] Token not found in environment variables.")
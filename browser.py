@@ -0,0 +1,224 @@
+import base64
+import fnmatch
+import json
+import os
+import threading
+from urllib.parse import urlsplit
+
+import metrics
+
+# --- حظر الموارد غير المطلوبة في المتصفح عبر DevTools (Network.setBlockedURLs) ---
+
+# أنماط الحظر لكل فئة (بصيغة أنماط DevTools: * تطابق أي نص)
+BLOCK_PATTERNS = {
+    "ads": (
+        "*doubleclick.net*", "*googlesyndication.com*", "*googleadservices.com*", "*adservice.google.*",
+        "*google-analytics.com*", "*googletagmanager.com*", "*googletagservices.com*",
+        "*amazon-adsystem.com*", "*adnxs.com*", "*taboola.com*", "*outbrain.com*", "*criteo.*",
+        "*scorecardresearch.com*", "*quantserve.com*", "*histats.com*", "*yandex.ru/metrika*", "*mc.yandex.ru*",
+        "*popads.net*", "*popcash.net*", "*propellerads*", "*adsterra*", "*exoclick.com*", "*juicyads.com*",
+        "*facebook.net*", "*connect.facebook.com*",
+    ),
+    "fonts": (
+        "*fonts.googleapis.com*", "*fonts.gstatic.com*", "*use.typekit.net*", "*fontawesome*",
+        "*.woff", "*.woff?*", "*.woff2", "*.woff2?*", "*.ttf", "*.ttf?*", "*.otf", "*.otf?*", "*.eot", "*.eot?*",
+    ),
+    "media": (
+        "*.mp4", "*.mp4?*", "*.webm", "*.webm?*", "*.m3u8*", "*.mp3", "*.mp3?*", "*.ogg", "*.ogg?*",
+        "*youtube.com/embed*", "*player.vimeo.com*",
+    ),
+    "third_party": (
+        "*disqus.com*", "*disquscdn.com*", "*addthis.com*", "*sharethis.com*", "*onesignal.com*",
+        "*pushengage.com*", "*hotjar.com*", "*clarity.ms*", "*cloudflareinsights.com*", "*tawk.to*",
+        "*platform.twitter.com*", "*widgets.wp.com*", "*gravatar.com*",
+    ),
+}
+
+# الفئات المحظورة افتراضياً (BROWSER_BLOCK="" يعطل الحظر)
+BLOCK_CATEGORIES = [c.strip() for c in os.getenv("BROWSER_BLOCK", ",".join(BLOCK_PATTERNS)).split(",") if c.strip() in BLOCK_PATTERNS]
+
+# حجم مخزن الاستجابات في كل تبويب عند التقاط الصور من المتصفح
+RESPONSE_BUFFER_BYTES = int(os.getenv("BROWSER_RESPONSE_BUFFER_MB", "200")) * 1024 * 1024
+MAX_CAPTURED_IMAGE_BYTES = 25 * 1024 * 1024
+
+# فئات مسموحة لمواقع معينة (النطاق أو أي نطاق فرعي منه).
+# BROWSER_BLOCK_ALLOW="example.com=fonts|media;other.org=third_party" يضيف مواقع أخرى.
+SITE_ALLOWLISTS = {
+    # العارض يرسم شريط الأدوات وطبقة النص بخطوط جوجل وينتظرها قبل ترتيب الصفحات
+    "drive.google.com": {"fonts"},
+}
+
+for _entry in os.getenv("BROWSER_BLOCK_ALLOW", "").split(";"):
+    if "=" in _entry:
+        _host, _categories = _entry.split("=", 1)
+        SITE_ALLOWLISTS.setdefault(_host.strip().lower(), set()).update(c.strip() for c in _categories.split("|") if c.strip())
+
+
+def categories_for(url):
+    """الفئات المحظورة لصفحة معينة بعد تطبيق قائمة السماح الخاصة بموقعها."""
+    host = (urlsplit(url).hostname or "").lower()
+    allowed = set()
+    for site, categories in SITE_ALLOWLISTS.items():
+        if host == site or host.endswith("." + site):
+            allowed |= categories
+    return [c for c in BLOCK_CATEGORIES if c not in allowed]
+
+
+def category_of(request_url, categories=None):
+    for category in categories or BLOCK_PATTERNS:
+        if any(fnmatch.fnmatchcase(request_url, pattern) for pattern in BLOCK_PATTERNS[category]):
+            return category
+    return None
+
+
+def configure_tab(driver, url, buffer_bodies=False):
+    """
+    يفعّل الحظر في التبويب الحالي قبل فتح الرابط. الإعداد يخص التبويب (الـ target) فقط،
+    لذلك يجب استدعاؤه لكل تبويب جديد. يعيد الفئات المحظورة.
+    buffer_bodies يكبّر مخزن الاستجابات حتى يمكن قراءة محتوى الصور لاحقاً (NetworkLog.capture_images).
+    """
+    categories = categories_for(url)
+    patterns = [p for c in categories for p in BLOCK_PATTERNS[c]]
+    network_params = {}
+    if buffer_bodies:
+        network_params = {"maxTotalBufferSize": RESPONSE_BUFFER_BYTES, "maxResourceBufferSize": MAX_CAPTURED_IMAGE_BYTES}
+    try:
+        driver.execute_cdp_cmd("Network.enable", network_params)
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+    except Exception as e:
+        print(f"[WARNING] Could not configure request blocking: {type(e).__name__} - {e}")
+        return []
+    return categories
+
+
+def enable_performance_log(chrome_options):
+    """سجل أحداث الشبكة من ChromeDriver (يُقرأ عبر NetworkLog)."""
+    chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    chrome_options.set_capability("goog:perfLoggingPrefs", {"enableNetwork": True, "enablePage": False})
+
+
+def disable_images(chrome_options):
+    """إيقاف تحميل وفك الصور داخل المتصفح (عندما تُنزّل الصور بشكل منفصل)."""
+    chrome_options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+    # نفس الإعداد كوسيط تشغيل، لأن مشغل DevTools (cdp_driver) لا يقرأ تفضيلات ChromeDriver
+    chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+
+
+class NetworkLog:
+    """
+    يقرأ سجل الأداء (performance log) ويجمع لكل تبويب: البايتات المنقولة والطلبات المحظورة حسب الفئة.
+    القراءة تفرغ السجل، لذلك يجب أن تتم من نفس الخيط الذي يستخدم المتصفح.
+    مع مشغل DevTools (cdp_driver) الأحداث تصل فور حدوثها عبر subscribe بدلاً من قراءة السجل.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self._urls = {}
+        self._image_requests = {}
+        self._lock = threading.Lock()
+        self.tabs = {}
+        self.images = {}   # لكل تبويب: الصور التي اكتمل تحميلها [(requestId, url)]
+        if hasattr(driver, "subscribe"):
+            driver.subscribe("Network.", self._on_event)
+
+    def _on_event(self, webview, method, params):
+        with self._lock:
+            self.handle(webview, method, params)
+
+    def _tab(self, webview):
+        return self.tabs.setdefault(webview, {"transfer_bytes": 0, "requests": 0, "blocked": {}})
+
+    def handle(self, webview, method, params):
+        if method == "Network.requestWillBeSent":
+            self._urls[params["requestId"]] = params["request"]["url"]
+            self._tab(webview)["requests"] += 1
+        elif method == "Network.responseReceived":
+            if params.get("type") == "Image" and 200 <= params["response"].get("status", 0) < 300:
+                self._image_requests[params["requestId"]] = params["response"]["url"]
+        elif method == "Network.loadingFinished":
+            self._urls.pop(params["requestId"], None)
+            self._tab(webview)["transfer_bytes"] += int(params.get("encodedDataLength", 0))
+            image_url = self._image_requests.pop(params["requestId"], None)
+            if image_url:
+                self.images.setdefault(webview, []).append((params["requestId"], image_url))
+        elif method == "Network.loadingFailed":
+            request_url = self._urls.pop(params["requestId"], "")
+            self._image_requests.pop(params["requestId"], None)
+            if params.get("blockedReason"):
+                category = category_of(request_url) or "other"
+                blocked = self._tab(webview)["blocked"]
+                blocked[category] = blocked.get(category, 0) + 1
+                metrics.REQUESTS_BLOCKED.inc(category=category)
+
+    def drain(self):
+        try:
+            entries = self.driver.get_log("performance")
+        except Exception:
+            return
+        for entry in entries:
+            try:
+                message = json.loads(entry["message"])
+            except (KeyError, ValueError):
+                continue
+            inner = message.get("message", {})
+            self.handle(message.get("webview"), inner.get("method"), inner.get("params", {}))
+
+    def pop_tab(self, window_handle):
+        """إحصائيات تبويب واحد (معرّف النافذة في Selenium هو معرّف الـ target في DevTools)."""
+        self.drain()
+        webview = window_handle.replace("CDwindow-", "")
+        with self._lock:
+            self.images.pop(webview, None)
+            return self.tabs.pop(webview, {"transfer_bytes": 0, "requests": 0, "blocked": {}})
+
+    def capture_images(self, window_handle, wanted, key=lambda url: url):
+        """
+        يقرأ محتوى الصور التي حمّلها التبويب الحالي من ذاكرة المتصفح (Network.getResponseBody)
+        بدلاً من تنزيلها مرة ثانية. wanted مجموعة مفاتيح (key(url)) للصور المطلوبة فقط.
+        يجب أن يكون التبويب هو التبويب الحالي في المتصفح. يعيد {key: bytes}.
+        """
+        self.drain()
+        webview = window_handle.replace("CDwindow-", "")
+        captured = {}
+        with self._lock:
+            loaded = self.images.pop(webview, [])
+        for request_id, image_url in loaded:
+            image_key = key(image_url)
+            if image_key not in wanted or image_key in captured:
+                continue
+            try:
+                response = self.driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
+            except Exception:
+                # أُخرج من المخزن أو لم يعد متاحاً: سيُنزّل عبر HTTP
+                continue
+            body = response.get("body", "")
+            captured[image_key] = base64.b64decode(body) if response.get("base64Encoded") else body.encode("latin-1")
+        return captured
+
+
+def page_timing(driver):
+    """أزمنة تحميل الصفحة الحالية من Navigation Timing (بالمللي ثانية)."""
+    try:
+        return driver.execute_script("""
+            var nav = performance.getEntriesByType('navigation')[0];
+            if (!nav) return null;
+            return {dom_content_loaded_ms: nav.domContentLoadedEventEnd, load_ms: nav.loadEventEnd || null};
+        """) or {}
+    except Exception:
+        return {}
+
+
+def report_page(driver, network_log, job, command, url, blocked_categories):
+    """يسجل إحصائيات الصفحة الحالية (الحجم المنقول، المحظور، زمن التحميل) في المهمة والمقاييس."""
+    stats = network_log.pop_tab(driver.current_window_handle) if network_log else {}
+    stats.update(page_timing(driver))
+    blocking = "on" if blocked_categories else "off"
+    if stats.get("dom_content_loaded_ms"):
+        metrics.PAGE_LOAD_SECONDS.observe(stats["dom_content_loaded_ms"] / 1000, command=command, blocking=blocking)
+    if stats.get("transfer_bytes"):
+        metrics.BYTES_MOVED.inc(stats["transfer_bytes"], direction="browser_page")
+    job.event("page_stats", url=url, blocking=blocking, **stats)
+    for category, count in stats.get("blocked", {}).items():
+        job.count(f"blocked_{category}", count)
+    job.count("browser_transfer_bytes", stats.get("transfer_bytes", 0))
+    return stats
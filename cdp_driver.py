@@ -0,0 +1,428 @@
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+
+# --- التحكم في كروم مباشرة عبر DevTools (websocket) بدلاً من ChromeDriver ---
+#
+# كل أمر في Selenium طلب HTTP إلى ChromeDriver الذي ينقله لكروم. هنا نتحدث مع كروم مباشرة
+# عبر websocket واحد: الأوامر تُرسل بمعرّف وتُطابق ردودها، والأحداث (الشبكة، DOM، الـ console)
+# تصل فور حدوثها لمن اشترك فيها بدلاً من قراءة سجل الأداء دورياً.
+#
+# CDPDriver واجهة متزامنة بنفس دوال WebDriver التي يستخدمها البوتان (get، execute_script،
+# find_elements، switch_to، execute_cdp_cmd...) فيعمل الكود الحالي عليها كما هو.
+
+BROWSER_BACKEND = os.getenv("BROWSER_BACKEND", "selenium").lower()   # selenium / cdp
+LAUNCH_TIMEOUT = 30
+COMMAND_TIMEOUT = 60
+ELEMENT_GROUPS_KEPT = 4   # مجموعات العناصر (من find_elements) التي تبقى صالحة قبل تحريرها من ذاكرة كروم
+
+# نفس أسماء محددات Selenium (By.CSS_SELECTOR / By.TAG_NAME)
+CSS_SELECTOR = "css selector"
+TAG_NAME = "tag name"
+
+
+class CDPError(Exception):
+    """خطأ أعاده كروم لأمر DevTools."""
+
+
+class DevToolsConnection:
+    """اتصال websocket غير متزامن مع كروم (على مستوى المتصفح، والتبويبات عبر sessionId)."""
+
+    def __init__(self, ws):
+        self._ws = ws
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._listeners = []   # (بادئة اسم الحدث, callback)
+        self._waiters = []     # (اسم الحدث, sessionId, predicate, future)
+        self._reader = None
+
+    @classmethod
+    async def connect(cls, ws_url, session=None):
+        import aiohttp
+
+        session = session or aiohttp.ClientSession()
+        # max_msg_size=0: نتائج الـ canvas (data URL) قد تتجاوز عدة ميجابايت
+        ws = await session.ws_connect(ws_url, max_msg_size=0)
+        connection = cls(ws)
+        connection._http = session
+        connection._reader = asyncio.create_task(connection._read())
+        return connection
+
+    async def send(self, method, params=None, session_id=None, timeout=COMMAND_TIMEOUT):
+        message_id = next(self._ids)
+        message = {"id": message_id, "method": method, "params": params or {}}
+        if session_id:
+            message["sessionId"] = session_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = future
+        try:
+            await self._ws.send_str(json.dumps(message))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(message_id, None)
+
+    def on(self, prefix, callback):
+        """callback(session_id, method, params) لكل حدث يبدأ اسمه بالبادئة (مثل "Network.")."""
+        self._listeners.append((prefix, callback))
+
+    def off(self, prefix, callback):
+        if (prefix, callback) in self._listeners:
+            self._listeners.remove((prefix, callback))
+
+    def expect(self, method, session_id=None, predicate=None):
+        """يسجل انتظار حدث قبل إرسال الأمر الذي يسببه (حتى لا يفوتنا). يعيد future."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((method, session_id, predicate, future))
+        return future
+
+    async def _read(self):
+        import aiohttp
+
+        try:
+            async for msg in self._ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                data = json.loads(msg.data)
+                if "id" in data:
+                    future = self._pending.get(data["id"])
+                    if future and not future.done():
+                        if "error" in data:
+                            future.set_exception(CDPError(data["error"].get("message", str(data["error"]))))
+                        else:
+                            future.set_result(data.get("result", {}))
+                    continue
+                self._dispatch(data.get("sessionId"), data.get("method", ""), data.get("params", {}))
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(CDPError("DevTools connection closed"))
+
+    def _dispatch(self, session_id, method, params):
+        for prefix, callback in list(self._listeners):
+            if method.startswith(prefix):
+                try:
+                    callback(session_id, method, params)
+                except Exception as e:
+                    print(f"[WARNING] DevTools event handler failed for {method}: {type(e).__name__} - {e}")
+        for waiter in list(self._waiters):
+            wanted, wanted_session, predicate, future = waiter
+            if future.done():
+                self._waiters.remove(waiter)
+            elif wanted == method and wanted_session in (None, session_id) and (predicate is None or predicate(params)):
+                future.set_result(params)
+                self._waiters.remove(waiter)
+
+    async def close(self):
+        await self._ws.close()
+        if self._reader:
+            self._reader.cancel()
+        await self._http.close()
+
+
+def _launch_chrome(chrome_bin, arguments):
+    """يشغل كروم مع منفذ DevTools عشوائي ويعيد (العملية، مجلد البيانات، رابط websocket المتصفح)."""
+    user_data_dir = tempfile.mkdtemp(prefix="cdp_chrome_")
+    args = [a for a in arguments if not a.startswith(("--remote-debugging-port", "--user-data-dir"))]
+    if not any(a.startswith("--headless") for a in args):
+        args.append("--headless=new")
+    process = subprocess.Popen(
+        [chrome_bin, "--remote-debugging-port=0", f"--user-data-dir={user_data_dir}", *args, "about:blank"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    # كروم يكتب المنفذ ومسار الـ websocket في هذا الملف عند الجاهزية
+    port_file = os.path.join(user_data_dir, "DevToolsActivePort")
+    deadline = time.monotonic() + LAUNCH_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            with open(port_file, "r") as f:
+                lines = f.read().split()
+            if len(lines) >= 2:
+                return process, user_data_dir, f"ws://127.0.0.1:{lines[0]}{lines[1]}"
+        except FileNotFoundError:
+            pass
+        time.sleep(0.05)
+    process.kill()
+    shutil.rmtree(user_data_dir, ignore_errors=True)
+    raise CDPError("Chrome did not expose a DevTools endpoint")
+
+
+class CDPElement:
+    """مرجع لعنصر DOM داخل كروم (objectId)، بنفس استخدام WebElement في الكود."""
+
+    def __init__(self, driver, session_id, object_id):
+        self._driver = driver
+        self._session_id = session_id
+        self.object_id = object_id
+
+    def get_attribute(self, name):
+        # مثل Selenium: الخاصية (property) إن وُجدت كقيمة بسيطة، وإلا السمة (attribute)
+        from selenium.common.exceptions import StaleElementReferenceException
+
+        try:
+            result = self._driver._call(self._driver._connection.send("Runtime.callFunctionOn", {
+                "objectId": self.object_id,
+                "functionDeclaration": (
+                    "function(name) { var v = this[name];"
+                    " if (v === undefined || v === null || typeof v === 'object' || typeof v === 'function') return this.getAttribute(name);"
+                    " return String(v); }"
+                ),
+                "arguments": [{"value": name}],
+                "returnByValue": True,
+            }, session_id=self._session_id))
+        except CDPError as e:
+            # المرجع حُرر (انتقال الصفحة أو مجموعة عناصر قديمة): نفس معنى العنصر القديم في Selenium
+            raise StaleElementReferenceException(str(e)) from e
+        return result.get("result", {}).get("value")
+
+
+class _SwitchTo:
+    def __init__(self, driver):
+        self._driver = driver
+
+    def new_window(self, type_hint="tab"):
+        self._driver._new_target(new_window=type_hint == "window")
+
+    def window(self, handle):
+        from selenium.common.exceptions import NoSuchWindowException
+
+        if handle not in self._driver._sessions:
+            raise NoSuchWindowException(f"no such window: {handle}")
+        self._driver._current = handle
+
+
+class CDPDriver:
+    """
+    واجهة متزامنة لاستخدامها من خيوط المعالجة: حلقة asyncio خاصة في خيط منفصل تدير الاتصال،
+    وكل دالة هنا ترسل الأمر وتنتظر رده. الأخطاء تُحوّل لاستثناءات Selenium المعتادة
+    حتى يبقى التعامل معها في البوتين كما هو.
+    """
+
+    def __init__(self, process, user_data_dir, page_load_strategy="normal"):
+        self._process = process
+        self._user_data_dir = user_data_dir
+        self._page_load_event = "Page.domContentEventFired" if page_load_strategy == "eager" else "Page.loadEventFired"
+        self._page_load_timeout = COMMAND_TIMEOUT
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="cdp-driver", daemon=True)
+        self._thread.start()
+        self._connection = None
+        self._sessions = {}       # targetId (= window handle) -> sessionId
+        self._targets = {}        # sessionId -> targetId
+        self._current = None
+        self._element_groups = deque()
+        self._group_ids = itertools.count(1)
+        self.switch_to = _SwitchTo(self)
+
+    @classmethod
+    def launch(cls, chrome_bin, arguments=(), page_load_strategy="normal"):
+        process, user_data_dir, ws_url = _launch_chrome(chrome_bin, list(arguments))
+        driver = cls(process, user_data_dir, page_load_strategy)
+        try:
+            driver._connection = driver._call(DevToolsConnection.connect(ws_url))
+            targets = driver._call(driver._connection.send("Target.getTargets"))["targetInfos"]
+            page = next((t for t in targets if t["type"] == "page"), None)
+            if page:
+                driver._attach(page["targetId"])
+            else:
+                driver._new_target()
+        except Exception:
+            driver.quit()
+            raise
+        return driver
+
+    # --- تشغيل الأوامر على حلقة الاتصال ---
+    def _call(self, coroutine, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(timeout)
+
+    def _send(self, method, params=None, session_id=None):
+        from selenium.common.exceptions import WebDriverException
+
+        try:
+            return self._call(self._connection.send(method, params, session_id=session_id or self._sessions.get(self._current)))
+        except CDPError as e:
+            raise WebDriverException(f"{method}: {e}") from e
+
+    def _attach(self, target_id):
+        session_id = self._call(self._connection.send("Target.attachToTarget", {"targetId": target_id, "flatten": True}))["sessionId"]
+        self._sessions[target_id] = session_id
+        self._targets[session_id] = target_id
+        self._current = target_id
+        self._send("Page.enable", session_id=session_id)
+        return target_id
+
+    def _new_target(self, new_window=False):
+        target_id = self._call(self._connection.send("Target.createTarget", {"url": "about:blank", "newWindow": new_window}))["targetId"]
+        return self._attach(target_id)
+
+    # --- الأحداث ---
+    def subscribe(self, prefix, callback):
+        """
+        callback(window_handle, method, params) لكل حدث يبدأ بالبادئة ("Network."، "DOM."، "Runtime.consoleAPICalled"...).
+        يُستدعى من خيط الاتصال. تفعيل المجال نفسه (Network.enable، DOM.enable، Runtime.enable) مسؤولية المستدعي.
+        """
+        def relay(session_id, method, params):
+            callback(self._targets.get(session_id), method, params)
+
+        self._loop.call_soon_threadsafe(self._connection.on, prefix, relay)
+        return relay
+
+    # --- نفس دوال WebDriver المستخدمة في البوتين ---
+    @property
+    def current_window_handle(self):
+        return self._current
+
+    @property
+    def window_handles(self):
+        return list(self._sessions)
+
+    @property
+    def title(self):
+        return self.execute_script("return document.title;") or ""
+
+    def set_page_load_timeout(self, seconds):
+        self._page_load_timeout = seconds
+
+    def get(self, url):
+        from selenium.common.exceptions import TimeoutException, WebDriverException
+
+        session_id = self._sessions[self._current]
+
+        async def navigate():
+            loaded = self._connection.expect(self._page_load_event, session_id)
+            try:
+                result = await self._connection.send("Page.navigate", {"url": url}, session_id=session_id)
+                if result.get("errorText"):
+                    raise WebDriverException(f"navigation failed: {result['errorText']}")
+                await asyncio.wait_for(loaded, self._page_load_timeout)
+            finally:
+                loaded.cancel()
+
+        try:
+            self._call(navigate())
+        except asyncio.TimeoutError as e:
+            raise TimeoutException(f"page load timed out after {self._page_load_timeout}s: {url}") from e
+        except CDPError as e:
+            raise WebDriverException(str(e)) from e
+
+    def execute_script(self, script, *args):
+        from selenium.common.exceptions import JavascriptException
+
+        body = f"function() {{ {script}\n}}"
+        element = next((a for a in args if isinstance(a, CDPElement)), None)
+        if element is None:
+            params = {
+                "expression": f"({body}).apply(window, {json.dumps(list(args))})",
+                "returnByValue": True,
+            }
+            response = self._send("Runtime.evaluate", params)
+        else:
+            # العناصر تُمرر بمعرّفها، والدالة تُنفذ في سياق الصفحة نفسها
+            params = {
+                "objectId": element.object_id,
+                "functionDeclaration": f"function() {{ return ({body}).apply(window, arguments); }}",
+                "arguments": [{"objectId": a.object_id} if isinstance(a, CDPElement) else {"value": a} for a in args],
+                "returnByValue": True,
+            }
+            response = self._send("Runtime.callFunctionOn", params)
+        if response.get("exceptionDetails"):
+            details = response["exceptionDetails"]
+            description = details.get("exception", {}).get("description") or details.get("text")
+            raise JavascriptException(f"javascript error: {description}")
+        return response.get("result", {}).get("value")
+
+    def find_elements(self, by, value):
+        if by == TAG_NAME:
+            selector = value
+        elif by == CSS_SELECTOR:
+            selector = value
+        else:
+            raise ValueError(f"unsupported locator strategy for the DevTools driver: {by}")
+        session_id = self._sessions[self._current]
+        group = f"find-{next(self._group_ids)}"
+        found = self._send("Runtime.evaluate", {
+            "expression": f"Array.from(document.querySelectorAll({json.dumps(selector)}))",
+            "objectGroup": group,
+        })
+        array_id = found.get("result", {}).get("objectId")
+        if not array_id:
+            return []
+        properties = self._send("Runtime.getProperties", {"objectId": array_id, "ownProperties": True})["result"]
+        elements = [
+            CDPElement(self, session_id, p["value"]["objectId"])
+            for p in sorted((p for p in properties if p["name"].isdigit()), key=lambda p: int(p["name"]))
+            if p.get("value", {}).get("objectId")
+        ]
+        self._track_group(session_id, group)
+        return elements
+
+    def find_element(self, by, value):
+        from selenium.common.exceptions import NoSuchElementException
+
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(f"no such element: {value}")
+        return elements[0]
+
+    def _track_group(self, session_id, group):
+        # نحرر مراجع العناصر القديمة حتى لا تتراكم في كروم مع آلاف الاستدعاءات
+        self._element_groups.append((session_id, group))
+        while len(self._element_groups) > ELEMENT_GROUPS_KEPT:
+            old_session, old_group = self._element_groups.popleft()
+            if old_session in self._targets:
+                try:
+                    self._send("Runtime.releaseObjectGroup", {"objectGroup": old_group}, session_id=old_session)
+                except Exception:
+                    pass
+
+    def execute_cdp_cmd(self, cmd, cmd_args):
+        return self._send(cmd, cmd_args)
+
+    def get_log(self, log_type):
+        # أحداث الشبكة تصل عبر subscribe() مباشرة، لا يوجد سجل لقراءته
+        return []
+
+    def close(self):
+        target_id = self._current
+        session_id = self._sessions.pop(target_id, None)
+        self._targets.pop(session_id, None)
+        self._current = None
+        self._send("Target.closeTarget", {"targetId": target_id}, session_id="")
+
+    def quit(self):
+        try:
+            if self._connection:
+                try:
+                    self._call(self._connection.send("Browser.close"), timeout=5)
+                except Exception:
+                    pass
+                self._call(self._connection.close(), timeout=5)
+        except Exception:
+            pass
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            if self._process.poll() is None:
+                self._process.kill()
+            self._process.wait()
+            shutil.rmtree(self._user_data_dir, ignore_errors=True)
+
+
+def launch(chrome_bin, arguments=(), page_load_strategy="normal"):
+    """يشغل كروم ويعيد CDPDriver، أو None مع رسالة خطأ (مثل init_driver في البوتين)."""
+    try:
+        driver = CDPDriver.launch(chrome_bin, arguments, page_load_strategy)
+        print("[INFO] Chrome started with the DevTools driver (no ChromeDriver).")
+        return driver
+    except Exception as e:
+        print(f"[CRITICAL ERROR] Failed to start Chrome over DevTools: {type(e).__name__} - {e}")
+        return None
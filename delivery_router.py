@@ -0,0 +1,51 @@
+import os
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# --- اختيار طريقة تسليم الملف الناتج للمستخدم ---
+#
+# الملف الأصغر من حد المرفقات في مكان الأمر يُرسل مرفقاً برسالة ديسكورد نفسها: بدون رفع لخدمة
+# خارجية وبدون طلب رابط مشاركة. الأكبر منه يذهب لـ Dropbox (main.py)، أو لجوجل درايف إذا طلبه
+# المستخدم، أو لخادم الملفات المحلي (bot.py). زمن كل طريقة يُسجل في scraper_delivery_seconds.
+
+ATTACHMENT_DELIVERY = os.getenv("ATTACHMENT_DELIVERY", "1") == "1"
+DM_ATTACHMENT_LIMIT = 8 * 1024 * 1024    # خارج السيرفرات (رسائل خاصة) لا يوجد guild.filesize_limit
+ATTACHMENT_HEADROOM = 64 * 1024          # هامش لباقي طلب الرفع (الـ embed وحدود multipart)
+
+DISCORD, DROPBOX, DRIVE, FILE_SERVER = "discord", "dropbox", "drive", "file_server"
+
+
+def attachment_limit(interaction):
+    """أكبر حجم ملف يمكن إرفاقه في مكان الأمر، أو 0 إذا كان الإرفاق معطلاً."""
+    if not ATTACHMENT_DELIVERY:
+        return 0
+    guild = interaction.guild
+    limit = guild.filesize_limit if guild else DM_ATTACHMENT_LIMIT
+    return max(0, limit - ATTACHMENT_HEADROOM)
+
+
+def choose(size, limit, fallback):
+    """مرفق ديسكورد إذا كان الحجم ضمن الحد، وإلا الطريقة البديلة."""
+    return DISCORD if 0 < size <= limit else fallback
+
+
+def record(command, backend, seconds, job=None, success=True):
+    if success:
+        metrics.DELIVERY_SECONDS.observe(seconds, command=command, backend=backend)
+    metrics.DELIVERIES.inc(command=command, backend=backend, outcome="success" if success else "failure")
+    if job:
+        job.event("delivered" if success else "delivery_failed", backend=backend, seconds=round(seconds, 3))
+
+
+@contextmanager
+def timed(command, backend, job=None):
+    """يقيس التسليم من بدايته حتى يصبح الملف (أو رابطه) عند المستخدم. الاستثناء يُسجل كفشل."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        record(command, backend, time.perf_counter() - started, job, success=False)
+        raise
+    record(command, backend, time.perf_counter() - started, job)
@@ -0,0 +1,213 @@
+import asyncio
+import json
+import os
+import re
+import urllib.parse
+
+import metrics
+
+# --- المسار السريع لملفات درايف العامة: HTTP مباشر بدون متصفح ---
+
+DRIVE_BASE_URL = os.getenv("DRIVE_BASE_URL", "https://drive.google.com").rstrip("/")
+DRIVE_FAST_PATH = os.getenv("DRIVE_FAST_PATH", "1") == "1"
+DRIVE_HTTP_CONCURRENCY = int(os.getenv("DRIVE_HTTP_CONCURRENCY", "6"))   # صور الصفحات المحملة بالتوازي
+DRIVE_HTTP_TIMEOUT = 120
+PAGE_RETRIES = 2
+CHUNK_SIZE = 256 * 1024
+DRIVE_EXPORT_MAX_BYTES = int(os.getenv("DRIVE_EXPORT_MAX_MB", "200")) * 1024 * 1024   # أكبر ملف أصلي يُقبل من التنزيل المباشر
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+
+FILE_ID_PATTERNS = (
+    re.compile(r"/file/d/([a-zA-Z0-9_-]{10,})"),
+    re.compile(r"/document/d/([a-zA-Z0-9_-]{10,})"),
+    re.compile(r"[?&]id=([a-zA-Z0-9_-]{10,})"),
+)
+
+_session = None
+_session_loop = None
+
+
+def parse_file_id(url):
+    for pattern in FILE_ID_PATTERNS:
+        match = pattern.search(url)
+        if match:
+            return match.group(1)
+    return None
+
+
+def _get_session():
+    """جلسة aiohttp واحدة مشتركة (اتصالات مُعاد استخدامها) تُنشأ عند أول استخدام."""
+    global _session, _session_loop
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        _session_loop = loop
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=DRIVE_HTTP_CONCURRENCY * 2, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=DRIVE_HTTP_TIMEOUT),
+            headers={"User-Agent": USER_AGENT},
+        )
+    return _session
+
+
+def _filename_from_disposition(header):
+    if not header:
+        return None
+    match = re.search(r"filename\*=UTF-8''([^;]+)", header, re.IGNORECASE)
+    if match:
+        return urllib.parse.unquote(match.group(1))
+    match = re.search(r'filename="([^"]+)"', header)
+    return match.group(1) if match else None
+
+
+def _confirm_url(html, response):
+    """
+    صفحة "لا يمكن فحص الملف من الفيروسات" للملفات الكبيرة: نستخرج رابط التأكيد من النموذج،
+    أو من رابط confirm=، أو من كوكي download_warning في الإصدارات الأقدم.
+    """
+    form = re.search(r'<form[^>]+id="download-form"[^>]+action="([^"]+)"(.*?)</form>', html, re.DOTALL)
+    if form:
+        fields = dict(re.findall(r'<input[^>]+type="hidden"[^>]+name="([^"]+)"[^>]+value="([^"]*)"', form.group(2)))
+        action = urllib.parse.urljoin(str(response.url), form.group(1).replace("&amp;", "&"))
+        return f"{action}?{urllib.parse.urlencode(fields)}"
+    link = re.search(r'href="(/uc\?export=download[^"]*confirm=[^"]+)"', html)
+    if link:
+        return urllib.parse.urljoin(str(response.url), link.group(1).replace("&amp;", "&"))
+    for name, cookie in response.cookies.items():
+        if name.startswith("download_warning"):
+            return f"{str(response.url)}&confirm={cookie.value}"
+    return None
+
+
+async def _stream_pdf(response, pdf_path, job, max_bytes):
+    """
+    يحفظ الـ PDF ويعيد حجمه، أو None إذا لم يكن PDF أو تجاوز max_bytes (يتوقف التنزيل فوراً).
+    الكتابة على القرص في خيط حتى لا تعطل حلقة أحداث البوت.
+    """
+    if (response.content_length or 0) > max_bytes:
+        job.event("export_too_large", bytes=response.content_length, max_bytes=max_bytes)
+        return None
+    size = 0
+    f = await asyncio.to_thread(open, pdf_path, "wb")
+    try:
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            if size == 0 and not chunk.startswith(b"%PDF"):
+                return None
+            if size + len(chunk) > max_bytes:
+                job.event("export_too_large", bytes=size + len(chunk), max_bytes=max_bytes)
+                return None
+            await asyncio.to_thread(f.write, chunk)
+            size += len(chunk)
+    finally:
+        await asyncio.to_thread(f.close)
+    metrics.BYTES_MOVED.inc(size, direction="drive_http")
+    job.count("bytes_http", size)
+    return size
+
+
+async def download_export(file_id, pdf_path, job, max_bytes=DRIVE_EXPORT_MAX_BYTES):
+    """
+    تنزيل الملف الأصلي عبر uc?export=download (مع صفحة التأكيد للملفات الكبيرة).
+    يعيد اسم الملف إذا كان PDF وتم تنزيله، أو None إذا كان التنزيل معطلاً أو الملف خاصاً
+    أو أكبر من max_bytes.
+    """
+    session = _get_session()
+    url = f"{DRIVE_BASE_URL}/uc?export=download&id={file_id}"
+    for _ in range(2):
+        async with session.get(url) as response:
+            if response.status != 200:
+                return None
+            content_type = response.headers.get("Content-Type", "")
+            if "text/html" in content_type:
+                url = _confirm_url(await response.text(), response)
+                if not url:
+                    # صفحة تسجيل دخول أو "التنزيل معطل": نحتاج العارض
+                    return None
+                continue
+            filename = _filename_from_disposition(response.headers.get("Content-Disposition"))
+            size = await _stream_pdf(response, pdf_path, job, max_bytes)
+            if not size:
+                if os.path.exists(pdf_path):
+                    os.remove(pdf_path)
+                return None
+            return filename or f"{file_id}.pdf"
+    return None
+
+
+def _parse_json(text):
+    # ردود جوجل تبدأ بـ )]}' لمنع تنفيذها كسكربت
+    return json.loads(text[text.index("{"):]) if "{" in text else None
+
+
+async def viewer_metadata(file_id):
+    """عدد الصفحات وأقصى عرض من خدمة العارض (viewerng/meta)."""
+    session = _get_session()
+    async with session.get(f"{DRIVE_BASE_URL}/viewerng/meta", params={"id": file_id}) as response:
+        if response.status != 200:
+            return None
+        meta = _parse_json(await response.text())
+    if not meta or not meta.get("pages"):
+        return None
+    return meta
+
+
+async def viewer_title(file_id):
+    session = _get_session()
+    try:
+        async with session.get(f"{DRIVE_BASE_URL}/file/d/{file_id}/view") as response:
+            html = await response.text()
+    except Exception:
+        return None
+    match = re.search(r"<title>(.*?)</title>", html, re.DOTALL)
+    return match.group(1).replace(" - Google Drive", "").strip() if match else None
+
+
+async def download_pages(file_id, page_count, width, ws, progress_state, job):
+    """
+    يحمّل صور الصفحات الجاهزة من العارض (viewerng/img) بالتوازي إلى مساحة عمل المهمة ws.
+    يعيد مسارات الصفحات بالترتيب، أو None إذا فشلت صفحة حتى بعد إعادة المحاولة.
+    """
+    import aiohttp
+
+    session = _get_session()
+    semaphore = asyncio.Semaphore(DRIVE_HTTP_CONCURRENCY)
+
+    def store(page_name, data):
+        # reportlab يقرأ الصفحات كملفات: tmpfs ضمن ميزانية الذاكرة، والقرص عند تجاوزها
+        ws.put(page_name, data, as_file=True)
+        return ws.path(page_name)
+
+    async def fetch(page):
+        async with semaphore:
+            for attempt in range(PAGE_RETRIES + 1):
+                try:
+                    params = {"id": file_id, "page": page, "w": width}
+                    async with session.get(f"{DRIVE_BASE_URL}/viewerng/img", params=params) as response:
+                        content_type = response.headers.get("Content-Type", "")
+                        if response.status == 200 and content_type.startswith("image/"):
+                            data = await response.read()
+                            break
+                except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                    # انقطاع اتصال واحد لا يستحق تحويل المهمة كلها للمتصفح
+                    job.event("page_retry", page=page + 1, error=type(e).__name__)
+                await asyncio.sleep(0.5 * (attempt + 1))
+            else:
+                return None
+        ext = "png" if "png" in content_type else "jpg"
+        page_path = await asyncio.to_thread(store, f"page_{page:04d}.{ext}", data)
+        metrics.BYTES_MOVED.inc(len(data), direction="drive_http")
+        job.count("bytes_http", len(data))
+        progress_state["pages"] = progress_state.get("pages", 0) + 1
+        job.event("page_captured", page=page + 1, bytes=len(data), source="viewer_http")
+        return page_path
+
+    paths = await asyncio.gather(*(fetch(page) for page in range(page_count)))
+    if any(path is None for path in paths):
+        return None
+    return paths
+
+
+async def close():
+    if _session and not _session.closed:
+        await _session.close()
@@ -0,0 +1,204 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import metrics
+
+# --- ضغط الصور النهائية حسب حجم مستهدف أو حد أدنى للجودة ---
+
+ENCODER_WORKERS = int(os.getenv("ENCODER_WORKERS", "2"))   # كل خيط يحمل صورة مفكوكة كاملة في الذاكرة
+QUALITY_STEPS = (95, 90, 85, 80, 75, 70, 65, 60, 55, 50, 45, 40, 35, 30)
+JPEG_VARIANTS = ("optimized", "progressive")
+WEBP_METHODS = (4, 6)
+
+# الحد الأدنى لـ PSNR (ديسيبل) لكل خيار جودة يظهر للمستخدم
+QUALITY_FLOORS = {
+    "ممتازة": 42.0,
+    "جيدة": 38.0,
+    "مقبولة": 34.0,
+}
+
+
+def psnr(reference, data):
+    """نسبة الإشارة للضجيج بين الصورة الأصلية والنسخة المضغوطة (كلما زادت كان الفرق أقل وضوحاً)."""
+    from PIL import Image, ImageChops, ImageStat
+
+    with Image.open(BytesIO(data)) as decoded:
+        decoded = decoded.convert(reference.mode)
+        stat = ImageStat.Stat(ImageChops.difference(reference, decoded))
+    pixels = reference.width * reference.height * len(stat.sum2)
+    mse = sum(stat.sum2) / pixels if pixels else 0
+    if mse == 0:
+        return float("inf")
+    return 10 * math.log10(255 ** 2 / mse)
+
+
+def _encode(img, save_format, quality, variant):
+    buffer = BytesIO()
+    if save_format == "jpeg":
+        img.save(buffer, "jpeg", quality=quality, optimize=True, progressive=variant == "progressive")
+    else:
+        img.save(buffer, "webp", quality=quality, method=variant)
+    return buffer.getvalue()
+
+
+def _cheapest_at(img, save_format, quality):
+    """أصغر ترميز عند جودة معينة (baseline/progressive لـ JPEG، وطريقة الضغط لـ WebP)."""
+    variants = JPEG_VARIANTS if save_format == "jpeg" else WEBP_METHODS
+    best = None
+    for variant in variants:
+        data = _encode(img, save_format, quality, variant)
+        if best is None or len(data) < len(best[0]):
+            best = (data, variant)
+    return best
+
+
+def search_encoding(img, save_format, max_bytes=None, min_psnr=None):
+    """
+    بحث ثنائي على درجات الجودة: أرخص ترميز يحقق الحد الأدنى للجودة، وأعلى جودة تدخل في الميزانية.
+    إذا تعارض الشرطان يُقدَّم حد الجودة.
+    """
+    cache = {}
+
+    def candidate(index):
+        if index not in cache:
+            quality = QUALITY_STEPS[index]
+            data, variant = _cheapest_at(img, save_format, quality)
+            score = psnr(img, data) if min_psnr is not None else None
+            cache[index] = {"data": data, "quality": quality, "variant": variant, "psnr": score}
+        return cache[index]
+
+    # آخر درجة (الأقل جودة) ما زالت فوق الحد الأدنى
+    last_ok = len(QUALITY_STEPS) - 1
+    if min_psnr is not None:
+        lo, hi, last_ok = 0, len(QUALITY_STEPS) - 1, 0
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if candidate(mid)["psnr"] >= min_psnr:
+                last_ok, lo = mid, mid + 1
+            else:
+                hi = mid - 1
+
+    chosen = last_ok
+    if max_bytes is not None:
+        lo, hi = 0, last_ok
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if len(candidate(mid)["data"]) <= max_bytes:
+                chosen, hi = mid, mid - 1
+            else:
+                lo = mid + 1
+    return candidate(chosen)
+
+
+def encode_file(path, max_bytes=None, min_psnr=None, store=None):
+    """
+    يعيد ترميز صورة واحدة في مكانها إذا كانت النتيجة أصغر من الملف الحالي.
+    store: مساحة عمل (workspace.Workspace) ويكون path اسم الصورة فيها بدلاً من مسار على القرص.
+    """
+    from PIL import Image
+
+    before = store.size(path) if store else os.path.getsize(path)
+    with Image.open(store.open(path) if store else path) as src:
+        save_format = (src.format or "").lower()
+        if save_format == "png":
+            img = src.copy()
+        else:
+            img = src.convert("RGB")
+
+    if save_format == "png":
+        # PNG بدون فقد: لا توجد درجات جودة، فقط ضغط أفضل
+        buffer = BytesIO()
+        img.save(buffer, "png", optimize=True)
+        choice = {"data": buffer.getvalue(), "quality": None, "variant": "optimized", "psnr": None}
+    elif save_format in ("jpeg", "webp"):
+        choice = search_encoding(img, save_format, max_bytes, min_psnr)
+    else:
+        return {"path": path, "before": before, "after": before, "changed": False}
+    img.close()
+
+    data = choice.pop("data")
+    if len(data) >= before:
+        return {"path": path, "before": before, "after": before, "changed": False}
+
+    if store:
+        store.put(path, data)
+        return {"path": path, "before": before, "after": len(data), "changed": True, **choice}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return {"path": path, "before": before, "after": len(data), "changed": True, **choice}
+
+
+def _pixel_area(path, store=None):
+    from PIL import Image
+    try:
+        with Image.open(store.open(path) if store else path) as img:
+            return img.width * img.height
+    except Exception:
+        return 0
+
+
+def encode_files(paths, target_bytes=None, min_psnr=None, workers=ENCODER_WORKERS, command="encoder", store=None):
+    """
+    يضغط مجموعة صور بالتوازي. target_bytes يوزع على الصور حسب مساحتها بالبكسل.
+    مع store تكون paths أسماء صور في مساحة العمل.
+    يعيد ملخصاً بالحجم قبل وبعد والبايتات الموفرة.
+    """
+    paths = list(paths)
+    budgets = [None] * len(paths)
+    if target_bytes:
+        areas = [_pixel_area(p, store) for p in paths]
+        total_area = sum(areas) or 1
+        budgets = [int(target_bytes * area / total_area) for area in areas]
+
+    def run(args):
+        path, budget = args
+        try:
+            return encode_file(path, budget, min_psnr, store)
+        except Exception as e:
+            print(f"[ERROR LOG] Failed to re-encode {path}: {type(e).__name__} - {e}")
+            if store:
+                size = store.size(path) if path in store else 0
+            else:
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+            return {"path": path, "before": size, "after": size, "changed": False}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        files = list(executor.map(run, zip(paths, budgets)))
+
+    bytes_before = sum(f["before"] for f in files)
+    bytes_after = sum(f["after"] for f in files)
+    metrics.BYTES_SAVED.inc(bytes_before - bytes_after, command=command)
+    return {
+        "files": len(files),
+        "files_changed": sum(1 for f in files if f["changed"]),
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "bytes_saved": bytes_before - bytes_after,
+        "target_bytes": target_bytes,
+        "target_met": target_bytes is None or bytes_after <= target_bytes,
+        "min_psnr": min_psnr,
+    }
+
+
+def merge_reports(reports):
+    """يجمع تقارير عدة دفعات (تسليم الفصول على دفعات) في تقرير واحد."""
+    reports = [r for r in reports if r]
+    if not reports:
+        return None
+    merged = {key: sum(r[key] for r in reports) for key in ("files", "files_changed", "bytes_before", "bytes_after", "bytes_saved")}
+    targets = [r["target_bytes"] for r in reports if r["target_bytes"]]
+    merged["target_bytes"] = sum(targets) if targets else None
+    merged["target_met"] = all(r["target_met"] for r in reports)
+    merged["min_psnr"] = reports[0]["min_psnr"]
+    return merged
+
+
+def format_savings(report):
+    """سطر قصير للعرض في رسالة ديسكورد."""
+    saved_mb = report["bytes_saved"] / (1024 * 1024)
+    before = report["bytes_before"] or 1
+    return f"{saved_mb:.2f} MB ({report['bytes_saved'] / before * 100:.0f}%)"
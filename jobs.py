@@ -0,0 +1,194 @@
+import hmac
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+# --- سجل المهام الجارية والمكتملة مع خط زمني لكل مهمة ---
+
+JOB_HISTORY_SIZE = 100      # عدد المهام المكتملة المحفوظة للمراجعة لاحقاً
+MAX_EVENTS_PER_JOB = 5000   # حد أعلى لأحداث المهمة الواحدة حتى لا تتضخم الذاكرة
+JOBS_ADMIN_TOKEN = os.getenv("JOBS_ADMIN_TOKEN", "")   # بدونه مسارات /jobs معطلة (404)
+PRIVATE_INFO_KEYS = ("user_id", "url")                 # لا تظهر في قائمة المهام، فقط في تفاصيل المهمة
+
+
+class Job:
+    """
+    مهمة واحدة (/fetchpdf أو /download) بمعرّف تتبع وخط زمني من الأحداث والفترات (spans).
+    كل span يُسجل أيضاً في مقاييس المراحل ويُجمع في job.timings.
+    """
+
+    def __init__(self, command, registry=None, **info):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.command = command
+        self.info = info
+        self.registry = registry
+        self.status = "running"
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self.timings = {}
+        self.counters = {}
+        self.events = []
+        self.dropped_events = 0
+        self._started_monotonic = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _offset(self):
+        return round(time.monotonic() - self._started_monotonic, 4)
+
+    def _append(self, entry):
+        with self._lock:
+            if len(self.events) >= MAX_EVENTS_PER_JOB:
+                self.dropped_events += 1
+                return
+            self.events.append(entry)
+
+    def count(self, name, amount=1):
+        """عدادات خاصة بالمهمة (صور، بايتات...) تظهر في /jobs وفي نتائج القياس."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def event(self, name, **attrs):
+        """حدث لحظي في الخط الزمني (مثلاً: تم التقاط صفحة)."""
+        entry = {"t": self._offset(), "event": name}
+        if attrs:
+            entry["attrs"] = attrs
+        self._append(entry)
+
+    @contextmanager
+    def span(self, name, trace=True, **attrs):
+        """
+        فترة زمنية لمرحلة. trace=False للمراحل المتكررة جداً: تُقاس في المقاييس والـ timings فقط.
+        """
+        started = self._offset()
+        error = None
+        try:
+            with metrics.stage(name, self.timings):
+                yield attrs
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if trace:
+                entry = {"t": started, "span": name, "duration": round(self._offset() - started, 4)}
+                if attrs:
+                    entry["attrs"] = attrs
+                if error:
+                    entry["error"] = error
+                self._append(entry)
+
+    def finish(self, success, error=None):
+        if self.finished_at is not None:
+            return
+        self.status = "success" if success else "failure"
+        self.error = error
+        self.finished_at = time.time()
+        self.event("finished", status=self.status)
+        if self.registry:
+            self.registry._finish(self)
+
+    def to_dict(self, detail=False):
+        """detail=False للقائمة: بدون الخط الزمني وبدون هوية صاحب الطلب ورابطه."""
+        info = self.info if detail else {k: v for k, v in self.info.items() if k not in PRIVATE_INFO_KEYS}
+        data = {
+            "trace_id": self.trace_id,
+            "command": self.command,
+            "status": self.status,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed": round((self.finished_at or time.time()) - self.started_at, 3),
+            "info": info,
+            "timings": {k: round(v, 4) for k, v in dict(self.timings).items()},
+            "counters": dict(self.counters),
+        }
+        if self.error:
+            data["error"] = self.error
+        if detail:
+            with self._lock:
+                data["events"] = list(self.events)
+            data["dropped_events"] = self.dropped_events
+        return data
+
+
+class JobRegistry:
+    def __init__(self, history_size=JOB_HISTORY_SIZE):
+        self._active = {}
+        self._completed = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+
+    def start(self, command, **info):
+        job = Job(command, registry=self, **info)
+        with self._lock:
+            self._active[job.trace_id] = job
+        metrics.QUEUE_DEPTH.inc(command=command)
+        return job
+
+    def _finish(self, job):
+        with self._lock:
+            self._active.pop(job.trace_id, None)
+            self._completed.append(job)
+        metrics.QUEUE_DEPTH.dec(command=job.command)
+        metrics.JOBS_TOTAL.inc(command=job.command, outcome=job.status)
+
+    def get(self, trace_id):
+        with self._lock:
+            job = self._active.get(trace_id)
+            if job:
+                return job
+            for job in self._completed:
+                if job.trace_id == trace_id:
+                    return job
+        return None
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._active.values()), list(self._completed)
+
+
+registry = JobRegistry()
+
+
+# --- مسارات خادم الويب (للمشرفين فقط: Authorization: Bearer <JOBS_ADMIN_TOKEN>) ---
+def _denied(request):
+    """يعيد رد الرفض، أو None إذا كان الطلب يحمل رمز المشرف الصحيح."""
+    from aiohttp import web
+    if not JOBS_ADMIN_TOKEN:
+        return web.json_response({"error": "not found"}, status=404)
+    header = request.headers.get("Authorization", "")
+    token = header[len("Bearer "):] if header.startswith("Bearer ") else ""
+    if not hmac.compare_digest(token.encode(), JOBS_ADMIN_TOKEN.encode()):
+        return web.json_response({"error": "unauthorized"}, status=401)
+    return None
+
+
+async def jobs_handler(request):
+    from aiohttp import web
+    denied = _denied(request)
+    if denied:
+        return denied
+    active, completed = registry.snapshot()
+    return web.json_response({
+        "active": [job.to_dict() for job in active],
+        "completed": [job.to_dict() for job in reversed(completed)],
+    })
+
+
+async def job_detail_handler(request):
+    from aiohttp import web
+    denied = _denied(request)
+    if denied:
+        return denied
+    job = registry.get(request.match_info.get('trace_id'))
+    if not job:
+        return web.json_response({"error": "job not found"}, status=404)
+    return web.json_response(job.to_dict(detail=True))
+
+
+def add_routes(app):
+    app.router.add_get('/jobs', jobs_handler)
+    app.router.add_get('/jobs/{trace_id}', job_detail_handler)
@@ -0,0 +1,194 @@
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+
+import metrics
+
+# --- دمج صور JPEG عمودياً بدون فك وإعادة ضغط (jpegtran -crop/-drop) ---
+#
+# الصور في فصل واحد غالباً من نفس الخادم: نفس العرض وتقسيم الألوان (sampling) وجداول التكميم.
+# في هذه الحالة يمكن وضعها فوق بعض على مستوى معاملات DCT: لوحة بطول المجموعة من الصورة الأولى
+# (crop مع التوسيع) ثم "إسقاط" كل صورة تالية في موضعها (-drop). لا يوجد فك للبكسلات
+# ولا فقدان جودة. أي اختلاف يعني الرجوع لطريقة البكسلات المعتادة في main.py.
+#
+# -drop يضع الصورة على حدود الـ iMCU، وأطوال الصفحات المسحوبة نادراً ما تكون من مضاعفاته (16 في 4:2:0):
+# أغلب المجموعات تُسجَّل reason="mcu_alignment" في scraper_merge_groups_total. لذلك تُضم البداية المحاذية
+# من المجموعة (aligned_prefix) بدون فقدان ويُعاد ترميز ما بعد أول صورة غير محاذية فقط.
+
+JPEGTRAN_BIN = os.getenv("JPEGTRAN_BIN") or shutil.which("jpegtran")
+LOSSLESS_MERGE = os.getenv("LOSSLESS_MERGE", "1") == "1"
+JPEGTRAN_TIMEOUT = 120
+
+SOF_MARKERS = {0xC0: "baseline", 0xC1: "extended", 0xC2: "progressive"}
+UNSUPPORTED_SOF = {0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}   # lossless/hierarchical/arithmetic
+
+
+def read_header(source):
+    """
+    يقرأ ترويسة JPEG حتى أول SOS: الأبعاد، المكونات (المعرّف، التقسيم الأفقي والعمودي، جدول التكميم)،
+    محتوى جداول التكميم، وعلامة Adobe إن وُجدت. يعيد None إذا لم يكن الملف JPEG مدعوماً.
+    source مسار أو ملف مفتوح للقراءة (ws.open) حتى تُفحص الصور قبل كتابتها كملفات.
+    """
+    if isinstance(source, (str, bytes, os.PathLike)):
+        with open(source, "rb") as f:
+            return _read_header(f)
+    return _read_header(source)
+
+
+def _read_header(f):
+    header = {"tables": {}, "adobe_transform": None}
+    if f.read(2) != b"\xff\xd8":
+        return None
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b"\xff":
+            continue
+        marker = f.read(1)
+        while marker == b"\xff":
+            marker = f.read(1)
+        if not marker:
+            return None
+        code = marker[0]
+        if code in (0x01, *range(0xD0, 0xD8)):
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        segment = f.read(struct.unpack(">H", length_bytes)[0] - 2)
+
+        if code == 0xDB:
+            # DQT: قد يحتوي أكثر من جدول؛ الدقة 8 أو 16 بت
+            offset = 0
+            while offset < len(segment):
+                precision, table_id = segment[offset] >> 4, segment[offset] & 0x0F
+                size = 128 if precision else 64
+                header["tables"][table_id] = segment[offset:offset + 1 + size]
+                offset += 1 + size
+        elif code in SOF_MARKERS:
+            precision, height, width, count = struct.unpack(">BHHB", segment[:6])
+            components = []
+            for i in range(count):
+                component_id, sampling, table_id = segment[6 + i * 3:9 + i * 3]
+                components.append((component_id, sampling >> 4, sampling & 0x0F, table_id))
+            header.update(precision=precision, width=width, height=height, components=tuple(components), mode=SOF_MARKERS[code])
+        elif code in UNSUPPORTED_SOF:
+            return None
+        elif code == 0xEE and segment[:5] == b"Adobe" and len(segment) >= 12:
+            header["adobe_transform"] = segment[11]
+        elif code == 0xDA:
+            return header if "components" in header else None
+        elif code == 0xD9:
+            return None
+
+
+def _quant_signature(header):
+    # محتوى الجدول لكل مكوّن (وليس رقمه فقط): صورتان قد تستخدمان أرقام جداول مختلفة لنفس القيم
+    return tuple(bytes(header["tables"].get(table_id, b"")) for _, _, _, table_id in header["components"])
+
+
+def imcu_height(header):
+    return 8 * max(v for _, _, v, _ in header["components"])
+
+
+def unavailable():
+    """سبب تعطل الدمج بدون فقدان في هذه البيئة كلها، أو None."""
+    if not LOSSLESS_MERGE:
+        return "disabled"
+    if not JPEGTRAN_BIN:
+        return "no_jpegtran"
+    return None
+
+
+def incompatibility(headers):
+    """
+    سبب عدم إمكان الدمج بدون فقدان، أو None إذا كانت المجموعة متوافقة.
+    كل الصور عدا الأخيرة يجب أن يكون طولها من مضاعفات ارتفاع الـ iMCU لأن -drop يضع الصورة على حدودها.
+    """
+    reason = unavailable()
+    if reason:
+        return reason
+    if any(h is None for h in headers):
+        return "unsupported"
+    first = headers[0]
+    if first["precision"] != 8 or len(first["components"]) not in (1, 3) or first["adobe_transform"] == 0:
+        return "unsupported"
+    for header in headers[1:]:
+        if header["width"] != first["width"]:
+            return "width"
+        if [c[:3] for c in header["components"]] != [c[:3] for c in first["components"]]:
+            return "sampling"
+        if header["adobe_transform"] != first["adobe_transform"]:
+            return "color_transform"
+        if _quant_signature(header) != _quant_signature(first):
+            return "quant_tables"
+    block = imcu_height(first)
+    if any(h["height"] % block for h in headers[:-1]):
+        return "mcu_alignment"
+    return None
+
+
+def aligned_prefix(headers):
+    """
+    عدد الصور من بداية مجموعة سببها "mcu_alignment" التي يمكن ضمها بدون فقدان: حتى أول صورة
+    طولها ليس من مضاعفات الـ iMCU (تدخل كآخر صورة في الضم). باقي المجموعة يُعاد ترميزه.
+    """
+    block = imcu_height(headers[0])
+    for index, header in enumerate(headers[:-1]):
+        if header["height"] % block:
+            return index + 1
+    return len(headers)
+
+
+def _jpegtran(args):
+    subprocess.run([JPEGTRAN_BIN, *args], check=True, capture_output=True, timeout=JPEGTRAN_TIMEOUT)
+
+
+def concatenate(paths, headers, output_path):
+    """يضع الصور فوق بعض في output_path على مستوى معاملات DCT. يرفع استثناء عند الفشل."""
+    width = headers[0]["width"]
+    total_height = sum(h["height"] for h in headers)
+    fd, canvas_path = tempfile.mkstemp(suffix=".jpg", dir=os.path.dirname(output_path) or None)
+    os.close(fd)
+    work_path = f"{canvas_path}.drop"
+    try:
+        # اللوحة: الصورة الأولى بعد توسيعها (f = فرض الأبعاد الأكبر من الصورة) لطول المجموعة كاملاً
+        _jpegtran(["-copy", "none", "-crop", f"{width}x{total_height}f+0+0", "-outfile", canvas_path, paths[0]])
+        y_offset = headers[0]["height"]
+        for index, (path, header) in enumerate(zip(paths[1:], headers[1:]), start=1):
+            extra = ["-optimize"] if index == len(paths) - 1 else []
+            _jpegtran(["-copy", "none", *extra, "-drop", f"+0+{y_offset}", path, "-outfile", work_path, canvas_path])
+            os.replace(work_path, canvas_path)
+            y_offset += header["height"]
+
+        result = read_header(canvas_path)
+        if not result or result["width"] != width or result["height"] != total_height:
+            raise RuntimeError("jpegtran produced unexpected dimensions")
+        os.replace(canvas_path, output_path)
+    finally:
+        for leftover in (canvas_path, work_path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def merge_group(paths, output_path, headers=None):
+    """
+    يحاول الدمج بدون فقدان. يعيد None عند النجاح، أو سبب الرجوع لطريقة البكسلات.
+    headers إن مُررت (مقروءة مسبقاً) لا تُقرأ الملفات مرة ثانية.
+    العداد scraper_merge_groups_total يسجل المسار الذي أخذته كل مجموعة.
+    """
+    headers = headers or [read_header(path) for path in paths]
+    reason = incompatibility(headers)
+    if reason is None:
+        try:
+            concatenate(paths, headers, output_path)
+            metrics.MERGE_GROUPS.inc(path="lossless", reason="compatible")
+            return None
+        except Exception as e:
+            print(f"[WARNING] Lossless merge failed, using the pixel path: {type(e).__name__} - {e}")
+            reason = "jpegtran_failed"
+    metrics.MERGE_GROUPS.inc(path="pixel", reason=reason)
+    return reason
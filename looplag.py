@@ -0,0 +1,88 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+import metrics
+
+# --- مراقبة تأخر حلقة الأحداث (event loop) ---
+
+LOOP_PROBE_INTERVAL = 0.25                                             # كل كم ثانية نقيس التأخر
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", "0.5"))  # تأخر أطول من هذا يُسجل مع الـ stack
+LAG_SAMPLES = 2400                                                     # آخر ~10 دقائق من القياسات
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class LoopLagMonitor:
+    """
+    مهمة صغيرة تنام فترة ثابتة وتقيس كم تأخرت في الاستيقاظ (= زمن أطول callback حجز الحلقة).
+    خيط مراقبة منفصل يلاحظ إذا توقفت المهمة عن الاستيقاظ ويطبع الـ stack الحالي لخيط الحلقة،
+    أي الكود الذي يحجزها فعلاً، بدلاً من معرفة ذلك بعد انتهائه فقط.
+    """
+
+    def __init__(self, interval=LOOP_PROBE_INTERVAL, threshold=LOOP_BLOCK_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.samples = deque(maxlen=LAG_SAMPLES)
+        self.blocks = 0
+        self._heartbeat = time.monotonic()
+        self._reported_heartbeat = None
+        self._loop_thread_id = None
+        self._task = None
+
+    def start(self):
+        """يُستدعى من داخل الحلقة. الاستدعاء المتكرر لا يفعل شيئاً."""
+        if self._task:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._probe())
+        threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True).start()
+
+    async def _probe(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self._heartbeat = time.monotonic()
+            self.samples.append(lag)
+            metrics.LOOP_LAG_SECONDS.observe(lag)
+            if len(self.samples) % 20 == 0:
+                for quantile, value in self.percentiles().items():
+                    metrics.LOOP_LAG_QUANTILES.set(value, quantile=quantile)
+
+    def _watchdog(self):
+        while True:
+            time.sleep(self.threshold / 2)
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled < self.threshold or heartbeat == self._reported_heartbeat:
+                continue
+            # نسجل كل توقف مرة واحدة فقط
+            self._reported_heartbeat = heartbeat
+            self.blocks += 1
+            metrics.LOOP_BLOCKS.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(stack unavailable)\n"
+            print(f"[WARNING] Event loop blocked for {stalled:.2f}s+, current stack of the loop thread:\n{stack}", end="")
+
+    def percentiles(self):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {str(q): 0.0 for q in QUANTILES}
+        return {str(q): ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in QUANTILES}
+
+    def snapshot(self):
+        return {
+            "samples": len(self.samples),
+            "max": max(self.samples, default=0.0),
+            "percentiles": self.percentiles(),
+            "blocks": self.blocks,
+        }
+
+
+monitor = LoopLagMonitor()
@@ -9,6 +9,10 @@ import asyncio
 import uuid
 import zipfile
 import shutil
+import hashlib
+import heapq
+import json
+import threading
 # استيرادات Selenium
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
@@ -19,6 +23,25 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, WebDriverException, NoSuchElementException
 import requests
 import time 
+from collections import deque
+from datetime import timezone
+from concurrent.futures import ThreadPoolExecutor
+from typing import Literal
+from urllib.parse import urlsplit, urlunsplit
+from aiohttp import web
+
+import browser
+import cdp_driver
+import delivery_router
+import encoder
+import jobs
+import jpegjoin
+import looplag
+import metrics
+import profiling
+import singleflight
+import workspace
+from progress import ProgressState, create_progress_bar, publisher
 
 # --- الإعدادات والثوابت ---
 DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
@@ -26,20 +49,39 @@ DROPBOX_ACCESS_TOKEN = os.getenv("DROPBOX_ACCESS_TOKEN")
 
 MIN_WIDTH = 650
 CLEANUP_DELAY_SECONDS = 1800
-LOCAL_TEMP_DIR = "manga_temp" 
+DROPBOX_FOLDER = os.getenv("DROPBOX_FOLDER", "")                       # "" = جذر التطبيق في Dropbox
+DROPBOX_STATE_FILE = os.getenv("DROPBOX_STATE_FILE", ".dropbox_lifecycle.json")
+DROPBOX_DELETE_LINGER = 30        # ثوانٍ إضافية بعد أقرب موعد لتجميع الحذف في طلب واحد
+DROPBOX_DELETE_BATCH_SIZE = 1000  # الحد الأقصى لـ files_delete_batch
+DROPBOX_RETRY_SECONDS = 300
+LOCAL_TEMP_DIR = "manga_temp"                                          # ما يتجاوز ميزانية الذاكرة (workspace.py) يُكتب هنا
+PROFILE_DIR = "downloads"                                               # ملفات الأداء (profile) لكل مهمة: downloads/<trace_id>/
 IMAGE_DOWNLOAD_TIMEOUT = 30 
+CHAPTER_TABS = int(os.getenv("CHAPTER_TABS", "3"))                      # عدد الفصول المفتوحة في تبويبات المتصفح في نفس الوقت
+IMAGE_DOWNLOAD_WORKERS = int(os.getenv("IMAGE_DOWNLOAD_WORKERS", "4"))  # عدد الصور التي تُنزّل بالتوازي
+DISABLE_BROWSER_IMAGES = os.getenv("DISABLE_BROWSER_IMAGES", "0") == "1"  # الصور تُنزّل بشكل منفصل، فلا حاجة لفكها في المتصفح
+# أخذ محتوى الصور التي حمّلها المتصفح أثناء التمرير بدلاً من تنزيلها مرة ثانية (لا يعمل مع تعطيل الصور)
+CAPTURE_FROM_BROWSER = os.getenv("CAPTURE_FROM_BROWSER", "1") == "1" and not DISABLE_BROWSER_IMAGES
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36"
 VALID_FORMATS = ['jpg', 'jpeg', 'webp', 'png']
 
 # --- الإعدادات والثوابت الإضافية لدمج الصور (التعديلات الجديدة) ---
 MIN_MERGED_HEIGHT = 15000  # الحد الأدنى لطول الصورة المدمجة بالبكسل
 MAX_MERGED_HEIGHT = 28000  # الحد الأقصى لطول الصورة المدمجة بالبكسل
 
+# --- إعدادات إزالة الصور المكررة ---
+# داخل الفصل تُحذف الصور المطابقة بكسلاً ببكسل فقط؛ المطابقة التقريبية لـ skip_banners وقائمة الحظر وحدها
+BANNER_HASH_SIZE = 16                                                   # بصمة dHash بحجم 16x16 = 256 بت
+BANNER_HASH_DISTANCE = int(os.getenv("BANNER_HASH_DISTANCE", "12"))     # أقصى فرق (بت من 256) لاعتبار صورة إعلاناً معروفاً
+BANNER_HASHES = os.getenv("BANNER_HASHES", "")            # بصمات إعلانات معروفة (hex بحجم 16x16، مفصولة بفواصل)
+BANNER_HASHES_FILE = os.getenv("BANNER_HASHES_FILE", "")  # أو ملف ببصمة في كل سطر
+
 
 # إعداد البوت
 intents = discord.Intents.default()
 intents.message_content = True
 bot = commands.Bot(command_prefix='!', intents=intents)
-dbx = dropbox.Dropbox(DROPBOX_ACCESS_TOKEN)
+dbx = dropbox.Dropbox(DROPBOX_ACCESS_TOKEN) if DROPBOX_ACCESS_TOKEN else None
 
 # --- دالة تهيئة متصفح Selenium ---
 def init_driver():
@@ -49,7 +91,7 @@ def init_driver():
     chrome_bin = os.environ.get("CHROME_BIN") or os.environ.get("GOOGLE_CHROME_BIN")
     chromedriver_path = os.environ.get("CHROMEDRIVER_PATH")
     
-    if not chrome_bin or not chromedriver_path:
+    if not chrome_bin or (not chromedriver_path and cdp_driver.BROWSER_BACKEND != "cdp"):
         print("[CRITICAL ERROR] Heroku environment variables (CHROME_BIN/CHROMEDRIVER_PATH) not found.")
         return None
 
@@ -63,9 +105,18 @@ def init_driver():
     chrome_options.add_argument("--disable-dev-shm-usage")
     # استراتيجية تحميل الصفحة
     chrome_options.page_load_strategy = 'eager'
+    browser.enable_performance_log(chrome_options)
+    if DISABLE_BROWSER_IMAGES:
+        browser.disable_images(chrome_options)
     
     chrome_options.binary_location = chrome_bin 
 
+    if cdp_driver.BROWSER_BACKEND == "cdp":
+        driver = cdp_driver.launch(chrome_bin, chrome_options.arguments, page_load_strategy='eager')
+        if driver:
+            driver.set_page_load_timeout(60)
+        return driver
+
     try:
         service = Service(executable_path=chromedriver_path)
         driver = webdriver.Chrome(service=service, options=chrome_options)
@@ -79,9 +130,11 @@ def init_driver():
 
 # --- الدوال المساعدة ---
 
-def download_and_check_image(image_url, target_format="jpg"):
+def download_and_check_image(image_url, target_format="jpg", job=None, content=None, headers=None):
     """
     تحميل الصورة، التحقق من حجمها، وتحويلها لـ format المستهدف.
+    content: محتوى الصورة إذا التُقط مسبقاً من المتصفح (لا يتم تنزيلها حينها).
+    headers: ترويسات التنزيل (User-Agent المتصفح و Referer صفحة الفصل).
     """
     target_format = target_format.lower()
     
@@ -98,178 +151,914 @@ def download_and_check_image(image_url, target_format="jpg"):
         save_format = 'jpeg'
         ext = 'jpg'
         
-    headers = {
-        "User-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36"
-    }
+    headers = headers or {"User-Agent": DEFAULT_USER_AGENT}
+
+    job = job or jobs.Job("image_download")
 
     try:
-        response = requests.get(image_url, stream=True, timeout=IMAGE_DOWNLOAD_TIMEOUT, headers=headers)
-        response.raise_for_status() 
-        
-        image_bytes = BytesIO(response.content)
-        img = Image.open(image_bytes)
-        
-        if save_format != 'png' and img.mode != 'RGB':
-            img = img.convert("RGB")
+        if content is not None:
+            metrics.CACHE_HITS.inc(cache="browser_capture")
+            metrics.BYTES_MOVED.inc(len(content), direction="browser_capture")
+            job.count("bytes_captured", len(content))
+        else:
+            with job.span("image_download", trace=False):
+                response = requests.get(image_url, stream=True, timeout=IMAGE_DOWNLOAD_TIMEOUT, headers=headers)
+                response.raise_for_status() 
+                content = response.content
+            
+            metrics.BYTES_MOVED.inc(len(content), direction="image_download")
+            job.count("bytes_downloaded", len(content))
+
+        with job.span("decode", trace=False):
+            img = Image.open(BytesIO(content))
+            
+            if save_format != 'png' and img.mode != 'RGB':
+                img = img.convert("RGB")
         
         if img.width >= MIN_WIDTH:
             return img, ext, save_format
         else:
             print(f"[ERROR LOG] Skipping image {image_url}: Width {img.width}px is less than {MIN_WIDTH}px.")
+            metrics.IMAGES_REJECTED.inc(reason="too_narrow")
             return None, None, None
             
     except requests.exceptions.HTTPError as e:
         print(f"[ERROR LOG] HTTP Error processing image {image_url}: Status {e.response.status_code} - {e}")
+        metrics.IMAGES_REJECTED.inc(reason="http_error")
         return None, None, None
     except requests.exceptions.Timeout:
         print(f"[ERROR LOG] Timeout Error processing image {image_url}: Download timed out after {IMAGE_DOWNLOAD_TIMEOUT}s.")
+        metrics.IMAGES_REJECTED.inc(reason="timeout")
         return None, None, None
     except Exception as e:
         print(f"[ERROR LOG] General Error processing image {image_url}: {type(e).__name__} - {e}")
+        metrics.IMAGES_REJECTED.inc(reason="error")
         return None, None, None
 
 
-async def cleanup_dropbox_file(dropbox_path: str, delay_seconds: int):
-    """ينتظر 15 دقيقة ثم يحذف الملف المضغوط من Dropbox."""
-    await asyncio.sleep(delay_seconds)
-    try:
-        dbx.files_delete_v2(dropbox_path)
-        print(f"🗑️ تم حذف ملف ZIP ({dropbox_path}) بنجاح بعد {delay_seconds} ثواني.")
-    except Exception as e:
-        print(f"❌ فشل حذف ملف ZIP ({dropbox_path}): {e}")
+# --- إزالة الصور المكررة (بصمة dHash) ---
+
+def canonical_image_url(image_url):
+    """مفتاح الرابط: الرابط كما هو مع توحيد حالة المخطط والنطاق فقط. الـ query يبقى لأنه كثيراً ما يحدد الصورة
+    نفسها (/_next/image?url=... و image.php?id=... وروابط CDN الموقّعة)؛ إعادة تقديم نفس الصورة برابط آخر تلتقطها بصمة البكسلات."""
+    parts = urlsplit(image_url)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ""))
+
+
+def image_dhash(img, size=BANNER_HASH_SIZE):
+    """بصمة إدراكية (size*size بت): مقارنة كل بكسل بجاره في نسخة رمادية مصغرة."""
+    small = img.convert("L").resize((size + 1, size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
 
+def pixel_digest(img):
+    """بصمة دقيقة لمحتوى الصورة بعد فكها: تتطابق فقط إذا تطابقت كل البكسلات."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{img.mode}:{img.width}x{img.height}".encode())
+    digest.update(img.tobytes())
+    return digest.digest()
 
-# --- دالة دمج الصور المحدثة (تطبيق منطق الارتفاع) ---
-def merge_chapter_images(chapter_folder: str, image_format: str):
+
+def load_banner_hashes():
+    hashes = set()
+    entries = BANNER_HASHES.split(",")
+    if BANNER_HASHES_FILE and os.path.exists(BANNER_HASHES_FILE):
+        with open(BANNER_HASHES_FILE, "r", encoding="utf-8") as f:
+            entries.extend(line.split("#", 1)[0] for line in f)
+    for entry in entries:
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            hashes.add(int(entry, 16))
+        except ValueError:
+            print(f"[WARNING] Ignoring invalid banner hash: {entry}")
+    return hashes
+
+
+class ImageDeduplicator:
+    """
+    يحذف الصور المكررة داخل الفصل (المطابقة تماماً فقط: صفحات قليلة التفاصيل بنصوص مختلفة
+    تتقارب بصماتها الإدراكية). مع skip_banners يحذف أيضاً الصور الشبيهة بصورة من فصل سابق
+    (إعلانات، صفحات الفريق) أو الموجودة في قائمة الحظر.
+    """
+
+    def __init__(self, skip_banners=False, max_distance=BANNER_HASH_DISTANCE, blocklist=None):
+        self.skip_banners = skip_banners
+        self.max_distance = max_distance
+        self.blocklist = load_banner_hashes() if blocklist is None else set(blocklist)
+        self._previous_chapters = []   # (hash, width, height) من الفصول السابقة
+        self._previous_digests = set()
+        self._previous_urls = set()
+        self._chapter = []
+        self._chapter_digests = set()
+        self._chapter_urls = set()
+
+    def start_chapter(self):
+        self._previous_chapters.extend(self._chapter)
+        self._previous_digests.update(self._chapter_digests)
+        self._previous_urls.update(self._chapter_urls)
+        self._chapter = []
+        self._chapter_digests = set()
+        self._chapter_urls = set()
+
+    def filter_urls(self, image_urls):
+        """
+        يزيل الروابط المكررة قبل التنزيل. يعيد (الروابط المتبقية، قائمة بأسباب الحذف).
+        """
+        kept, rejected = [], []
+        for image_url in image_urls:
+            key = canonical_image_url(image_url)
+            if key in self._chapter_urls:
+                rejected.append("duplicate_url")
+                continue
+            if self.skip_banners and key in self._previous_urls:
+                rejected.append("banner")
+                continue
+            self._chapter_urls.add(key)
+            kept.append(image_url)
+        return kept, rejected
+
+    def _matches(self, entries, fingerprint):
+        value, width, height = fingerprint
+        for other_value, other_width, other_height in entries:
+            # نسبة الأبعاد يجب أن تتطابق تقريباً حتى لا تُعتبر صفحتان طويلتان فارغتان نفس الصورة
+            if abs(width * other_height - other_width * height) > 0.02 * width * other_height:
+                continue
+            if (value ^ other_value).bit_count() <= self.max_distance:
+                return True
+        return False
+
+    def check(self, img):
+        """يعيد سبب الرفض ("duplicate" / "banner") أو None إذا كانت الصورة جديدة."""
+        fingerprint = None
+        digest = pixel_digest(img)
+        if self.skip_banners:
+            fingerprint = (image_dhash(img), img.width, img.height)
+            if any((fingerprint[0] ^ h).bit_count() <= self.max_distance for h in self.blocklist):
+                return "banner"
+            # صورة قليلة التفاصيل (لون واحد تقريباً) بصمتها قريبة من الصفر مثل أي صفحة فارغة أخرى:
+            # تُقارن بالفصول السابقة بالمطابقة التامة فقط
+            if fingerprint[0].bit_count() < 2 * self.max_distance:
+                fingerprint = None
+            if digest in self._previous_digests or (fingerprint and self._matches(self._previous_chapters, fingerprint)):
+                return "banner"
+        if digest in self._chapter_digests:
+            return "duplicate"
+        self._chapter_digests.add(digest)
+        if fingerprint:
+            self._chapter.append(fingerprint)
+        return None
+
+
+# --- إدارة ملفات Dropbox (الرفع، روابط المشاركة، الحذف بعد انتهاء المدة) ---
+
+def remote_zip_name(name):
+    return name.startswith("manga_") and name.endswith(".zip")
+
+
+class DropboxLifecycleManager:
+    """
+    مسؤول عن ملفات الـ ZIP في Dropbox: الرفع، إنشاء أو إيجاد رابط المشاركة، وحذفها بعد المدة.
+    مواعيد الحذف تُحفظ في ملف محلي، وعند التشغيل تُطابق مع محتوى مجلد Dropbox نفسه
+    (files_list_folder) حتى لا تبقى ملفات منسية إذا ضاع الملف المحلي مع إعادة تشغيل الـ dyno.
+    الملفات المنتهية تُحذف معاً بطلب files_delete_batch واحد.
+    """
+
+    def __init__(self, client, state_file, folder="", linger_seconds=DROPBOX_DELETE_LINGER):
+        self.client = client
+        self.state_file = state_file
+        self.folder = folder.rstrip("/")
+        self.linger_seconds = linger_seconds
+        self._deadlines = {}  # dropbox_path -> موعد الحذف
+        self._links = {}      # dropbox_path -> رابط المشاركة
+        self._heap = []       # (موعد الحذف, dropbox_path) - المدخلات القديمة تُتجاهل عند السحب
+        self._lock = threading.Lock()
+        self._wakeup = None
+        self._loop = None
+        self._task = None
+
+    def path_for(self, filename):
+        return f"{self.folder}/{filename}"
+
+    # --- تُستدعى من خيط المعالجة ---
+    def upload(self, source, dropbox_path, ttl_seconds):
+        """
+        يرفع الملف ويسجل موعد حذفه فوراً (قبل إنشاء الرابط) ثم يعيد رابط المشاركة.
+        source مسار ملف محلي أو bytes جاهزة (من مساحة عمل المهمة بدون كتابتها على القرص).
+        """
+        if isinstance(source, (bytes, bytearray)):
+            data = source
+        else:
+            with open(source, 'rb') as f:
+                data = f.read()
+        self.client.files_upload(data, dropbox_path, mode=dropbox.files.WriteMode('overwrite'))
+        metrics.BYTES_MOVED.inc(len(data), direction="dropbox_upload")
+        del data
+        self.track(dropbox_path, ttl_seconds)
+        return self.shared_link(dropbox_path)
+
+    def shared_link(self, dropbox_path):
+        with self._lock:
+            if dropbox_path in self._links:
+                metrics.CACHE_HITS.inc(cache="dropbox_shared_link")
+                return self._links[dropbox_path]
+        link = ""
+        try:
+            link = self.client.sharing_create_shared_link_with_settings(dropbox_path).url
+        except dropbox.exceptions.ApiError as e:
+            if e.error.is_shared_link_already_exists():
+                links = self.client.sharing_list_shared_links(path=dropbox_path, direct_only=True).links
+                if links:
+                    link = links[0].url
+        if not link:
+            return "(فشل إنشاء رابط مشاركة)"
+        with self._lock:
+            self._links[dropbox_path] = link
+            self._save()
+        return link
+
+    def track(self, dropbox_path, ttl_seconds):
+        with self._lock:
+            self._set(dropbox_path, time.time() + ttl_seconds)
+            self._save()
+        self._wake()
+
+    def expires_at(self, dropbox_path):
+        return self._deadlines.get(dropbox_path)
+
+    # --- داخل حلقة الأحداث ---
+    async def start(self):
+        if self._task and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._load()
+        try:
+            await asyncio.to_thread(self._reconcile)
+        except Exception as e:
+            print(f"[WARNING] Could not reconcile Dropbox folder: {type(e).__name__} - {e}")
+        self._task = asyncio.create_task(self._run())
+
+    def _wake(self):
+        if self._loop and self._wakeup:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _set(self, dropbox_path, deadline):
+        self._deadlines[dropbox_path] = deadline
+        heapq.heappush(self._heap, (deadline, dropbox_path))
+
+    def _is_current(self, entry):
+        deadline, dropbox_path = entry
+        return self._deadlines.get(dropbox_path) == deadline
+
+    def _list_remote(self):
+        remote = {}
+        listing = self.client.files_list_folder(self.folder)
+        while True:
+            for entry in listing.entries:
+                if isinstance(entry, dropbox.files.FileMetadata) and remote_zip_name(entry.name):
+                    remote[entry.path_display] = entry.server_modified.replace(tzinfo=timezone.utc).timestamp()
+            if not listing.has_more:
+                return remote
+            listing = self.client.files_list_folder_continue(listing.cursor)
+
+    def _reconcile(self):
+        remote = self._list_remote()
+        remote_lower = {path.lower() for path in remote}
+        tracked_lower = {path.lower() for path in self._deadlines}
+        adopted = 0
+        with self._lock:
+            # ملفات مسجلة لم تعد موجودة في Dropbox
+            for dropbox_path in list(self._deadlines):
+                if dropbox_path.lower() not in remote_lower:
+                    self._deadlines.pop(dropbox_path, None)
+                    self._links.pop(dropbox_path, None)
+            # ملفات في Dropbox بدون موعد (ضاع الملف المحلي): المدة تُحسب من وقت رفعها
+            for dropbox_path, modified in remote.items():
+                if dropbox_path.lower() not in tracked_lower:
+                    self._set(dropbox_path, modified + CLEANUP_DELAY_SECONDS)
+                    adopted += 1
+            self._save()
+        print(f"[INFO] Dropbox reconciled: {len(remote)} file(s), {adopted} adopted.")
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            due = []
+            with self._lock:
+                while self._heap and (self._heap[0][0] <= now or not self._is_current(self._heap[0])):
+                    entry = heapq.heappop(self._heap)
+                    if self._is_current(entry):
+                        due.append(entry[1])
+
+            if due:
+                failed = await asyncio.to_thread(self._delete_batch, due)
+                with self._lock:
+                    for dropbox_path in due:
+                        if dropbox_path in failed:
+                            # إعادة المحاولة لاحقاً
+                            self._set(dropbox_path, time.time() + DROPBOX_RETRY_SECONDS)
+                        else:
+                            self._deadlines.pop(dropbox_path, None)
+                            self._links.pop(dropbox_path, None)
+                    self._save()
+
+            with self._lock:
+                next_deadline = self._heap[0][0] if self._heap else None
+            # الانتظار قليلاً بعد أقرب موعد حتى تُحذف الملفات المتقاربة في طلب واحد
+            timeout = max(0.0, next_deadline + self.linger_seconds - time.time()) if next_deadline else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _delete_batch(self, paths):
+        """يحذف حتى 1000 ملف في كل طلب. يعيد مجموعة المسارات التي فشل حذفها."""
+        failed = set()
+        for i in range(0, len(paths), DROPBOX_DELETE_BATCH_SIZE):
+            chunk = paths[i:i + DROPBOX_DELETE_BATCH_SIZE]
+            try:
+                launch = self.client.files_delete_batch([dropbox.files.DeleteArg(p) for p in chunk])
+                if launch.is_complete():
+                    result = launch.get_complete()
+                else:
+                    job_id = launch.get_async_job_id()
+                    while True:
+                        time.sleep(1)
+                        status = self.client.files_delete_batch_check(job_id)
+                        if status.is_complete():
+                            result = status.get_complete()
+                            break
+                        if status.is_failed():
+                            raise RuntimeError(f"delete batch failed: {status.get_failed()}")
+            except Exception as e:
+                print(f"[ERROR LOG] Dropbox batch delete failed: {type(e).__name__} - {e}")
+                failed.update(chunk)
+                continue
+
+            chunk_failed = 0
+            for dropbox_path, entry in zip(chunk, result.entries):
+                if entry.is_success():
+                    continue
+                error = entry.get_failure()
+                # الملف غير موجود أصلاً = تم المطلوب
+                if error.is_path_lookup() and error.get_path_lookup().is_not_found():
+                    continue
+                failed.add(dropbox_path)
+                chunk_failed += 1
+            metrics.DROPBOX_DELETED.inc(len(chunk) - chunk_failed)
+            print(f"🗑️ تم حذف {len(chunk) - chunk_failed} ملف ZIP من Dropbox في طلب واحد.")
+        return failed
+
+    def _load(self):
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"[WARNING] Could not read Dropbox lifecycle state: {e}")
+            return
+        with self._lock:
+            for dropbox_path, deadline in saved.get("deadlines", {}).items():
+                self._set(dropbox_path, deadline)
+            self._links.update(saved.get("links", {}))
+
+    def _save(self):
+        tmp_path = f"{self.state_file}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"deadlines": self._deadlines, "links": self._links}, f)
+            os.replace(tmp_path, self.state_file)
+        except Exception as e:
+            print(f"[WARNING] Could not persist Dropbox lifecycle state: {e}")
+
+
+dropbox_lifecycle = DropboxLifecycleManager(dbx, DROPBOX_STATE_FILE, DROPBOX_FOLDER)
+download_flights = singleflight.SingleFlight("download")
+
+
+# --- دالة دمج الصور (تقسيم أمثل بالبرمجة الديناميكية) ---
+def plan_merge_groups(heights, min_height=MIN_MERGED_HEIGHT, max_height=MAX_MERGED_HEIGHT):
+    """
+    يقسم الصور المتتالية إلى مجموعات دمج بأقل عدد ممكن من الملفات الناتجة.
+    كل مجموعة من أكثر من صورة يجب أن يكون طولها بين min_height و max_height، والصورة
+    المفردة تبقى كما هي. عند تساوي عدد الملفات يُختار التقسيم الأكثر تساوياً في الأطوال
+    (أقل مجموع لمربعات الأطوال). تعيد قائمة (start, end) للمجموعات التي تحتاج دمجاً فقط.
+    """
+    n = len(heights)
+    prefix = [0]
+    for h in heights:
+        prefix.append(prefix[-1] + h)
+
+    # best[i] = (عدد الملفات، مجموع مربعات الأطوال، بداية آخر مجموعة) لأول i صورة
+    best = [(0, 0, 0)] + [None] * n
+    for i in range(1, n + 1):
+        # الصورة i-1 وحدها
+        count, squares, _ = best[i - 1]
+        candidate = (count + 1, squares + heights[i - 1] ** 2, i - 1)
+        j = i - 2
+        while j >= 0:
+            total = prefix[i] - prefix[j]
+            if total > max_height:
+                break
+            if total >= min_height:
+                count, squares, _ = best[j]
+                option = (count + 1, squares + total ** 2, j)
+                if option[:2] < candidate[:2]:
+                    candidate = option
+            j -= 1
+        best[i] = candidate
+
+    groups = []
+    i = n
+    while i > 0:
+        start = best[i][2]
+        if i - start > 1:
+            groups.append((start, i))
+        i = start
+    groups.reverse()
+    return groups
+
+
+def merge_chapter_images(ws, chapter_prefix: str, image_format: str):
     """
     تنفذ دمج الصور لملفات JPG/JPEG فقط، مع مراعاة الحدود الدنيا والقصوى للطول الكلي.
+    الصور في مساحة عمل المهمة ws تحت chapter_prefix (مثلاً "3/").
+    المجموعات المتوافقة تُدمج بدون فقدان (jpegjoin)، والباقي بفك الصور وإعادة ضغطها.
+    الصور ذات العرض المختلف عن العرض الأكثر تكراراً في الفصل يُعاد تحجيمها بدلاً من الحشو بالأسود.
     """
     if image_format.lower() not in ['jpg', 'jpeg']:
         print(f"[INFO] Skipping merge: Merge is only supported for JPG/JPEG format.")
         return
 
-    jpeg_files = sorted([f for f in os.listdir(chapter_folder) if f.lower().endswith(('.jpg', '.jpeg'))])
-    
-    # قائمة لتخزين مجموعات الملفات المراد دمجها
-    merge_groups = []
-    current_group = []
-    current_height = 0
+    jpeg_files = [name for name in ws.names(chapter_prefix) if name.lower().endswith(('.jpg', '.jpeg'))]
     
-    # 1. تجميع الملفات في مجموعات دمج (Merge Groups)
-    for filename in jpeg_files:
-        file_path = os.path.join(chapter_folder, filename)
+    # 1. قراءة أبعاد الصور (من الترويسة فقط بدون فك الصورة)
+    entries = []
+    for name in jpeg_files:
+        filename = name[len(chapter_prefix):]
         try:
-            with Image.open(file_path) as img:
-                img_height = img.height
+            with Image.open(ws.open(name)) as img:
+                entries.append((name, filename, img.width, img.height))
         except Exception:
             print(f"[ERROR LOG] Could not open image {filename}. Skipping.")
-            continue
 
-        # منطق التجميع
-        if not current_group:
-            # دائماً ابدأ مجموعة جديدة
-            current_group.append((file_path, filename))
-            current_height = img_height
-        elif current_height + img_height <= MAX_MERGED_HEIGHT:
-            # استمر في الإضافة إذا لم يتجاوز الحد الأقصى
-            current_group.append((file_path, filename))
-            current_height += img_height
-        else:
-            # إذا تجاوز الحد الأقصى، قم بإنهاء المجموعة الحالية
-            if current_height >= MIN_MERGED_HEIGHT and len(current_group) > 1:
-                # إذا تجاوزنا الحد الأقصى وكان الطول الحالي كافياً (أكبر من الحد الأدنى)، احفظ المجموعة
-                merge_groups.append(current_group)
-            
-            # ابدأ مجموعة جديدة بالصورة الحالية (التي لم تستطع الإضافة للمجموعة السابقة)
-            current_group = [(file_path, filename)]
-            current_height = img_height
-
-    # لا تنسَ المجموعة الأخيرة (إذا كانت موجودة)
-    if current_group:
-        if current_height >= MIN_MERGED_HEIGHT and len(current_group) > 1:
-            merge_groups.append(current_group)
-        # إذا لم يتم دمجها (قصر الطول أو ملف واحد)، اترك الملفات كما هي ليتم ترقيمها لاحقاً
+    if len(entries) < 2:
+        return
+
+    # العرض الموحد للفصل = العرض الأكثر تكراراً، والأطوال تُحسب بعد التحجيم إليه
+    widths = {}
+    for _, _, width, _ in entries:
+        widths[width] = widths.get(width, 0) + 1
+    strip_width = max(widths, key=lambda w: (widths[w], w))
+    heights = [round(height * strip_width / width) for _, _, width, height in entries]
+
+    # 2. تقسيم الصور إلى مجموعات الدمج
+    merge_groups = plan_merge_groups(heights)
         
     merged_count = 0
     files_to_delete = set()
     
-    # 2. تطبيق الدمج على المجموعات
-    for group in merge_groups:
+    # 3. تطبيق الدمج على المجموعات
+    for start, end in merge_groups:
+        group = entries[start:end]
         
+        # المسار الأول: ضم معاملات JPEG مباشرة إذا كانت الصور متوافقة (بدون فك وبدون فقدان جودة).
+        # الترويسات تُقرأ من مساحة العمل أولاً: المجموعات غير المتوافقة لا تُكتب كملفات أبداً.
+        # jpegtran يحتاج ملفات فعلية: مسارات tmpfs من مساحة العمل، والناتج يُضم إليها مكان الملف الهدف
+        headers = []
+        for name, _, _, _ in group:
+            with ws.open(name) as f:
+                headers.append(jpegjoin.read_header(f))
+        reason = jpegjoin.incompatibility(headers)
+        # أطوال الصفحات المسحوبة نادراً ما تكون من مضاعفات الـ iMCU (16 في 4:2:0): نضم البداية المحاذية
+        # بدون فقدان (حتى أول صورة غير محاذية) ويُعاد ترميز الباقي فقط
+        lossless_end = len(group) if reason is None else jpegjoin.aligned_prefix(headers) if reason == "mcu_alignment" else 0
+        if lossless_end < 2:
+            metrics.MERGE_GROUPS.inc(path="pixel", reason=reason)
+        else:
+            input_paths = [ws.path(name) for name, _, _, _ in group[:lossless_end]]
+            merged_path = f"{input_paths[0]}.merged.jpg"
+            if jpegjoin.merge_group(input_paths, merged_path, headers[:lossless_end]) is None:
+                ws.adopt(group[0][0], merged_path)
+                files_to_delete.update(name for name, _, _, _ in group[1:lossless_end])
+                merged_count += 1
+                print(f"Merged {lossless_end} images losslessly into {group[0][1]} (Height: {sum(heights[start:start + lossless_end])}px)")
+                if lossless_end == len(group):
+                    continue
+                metrics.MERGE_GROUPS.inc(path="pixel", reason=reason)
+                start += lossless_end
+                group = entries[start:end]
+                if len(group) < 2:
+                    continue
+
+        total_height = sum(heights[start:end])
         # الملف الأول في المجموعة هو الملف الهدف (الذي سيتم حفظ الصورة المدمجة فيه)
-        target_path, target_filename = group[0]
-        
-        try:
-            merged_img = Image.open(target_path).convert("RGB")
-            current_y = merged_img.height
-            max_width = merged_img.width
-            
-            # قائمة مؤقتة للصور المراد دمجها (بما في ذلك الصورة الأولى)
-            images_to_merge = [merged_img]
-            
-            # دمج باقي الصور في نفس المجموعة
-            for i in range(1, len(group)):
-                next_path, next_filename = group[i]
-                img_to_add = Image.open(next_path).convert("RGB")
-                
-                max_width = max(max_width, img_to_add.width)
-                current_y += img_to_add.height
-                images_to_merge.append(img_to_add)
-                
-                files_to_delete.add(next_path) # ضع الملف المضاف للحذف
+        target_name, target_filename = group[0][0], group[0][1]
 
-            # إنشاء الصورة النهائية المدمجة مرة واحدة
-            final_merged_img = Image.new('RGB', (max_width, current_y))
+        try:
+            final_merged_img = Image.new('RGB', (strip_width, total_height))
             y_offset = 0
-            for img in images_to_merge:
-                final_merged_img.paste(img, (0, y_offset))
-                y_offset += img.height
+            for (name, _, width, _), height in zip(group, heights[start:end]):
+                with Image.open(ws.open(name)) as img:
+                    img = img.convert("RGB")
+                    if width != strip_width:
+                        img = img.resize((strip_width, height), Image.LANCZOS)
+                    final_merged_img.paste(img, (0, y_offset))
+                y_offset += height
                 
             # حفظ الصورة المدمجة النهائية
-            final_merged_img.save(target_path, 'jpeg', quality=90) 
+            with ws.writer(target_name) as f:
+                final_merged_img.save(f, 'jpeg', quality=90)
+            final_merged_img.close()
+            files_to_delete.update(name for name, _, _, _ in group[1:])
             merged_count += 1
-            print(f"Merged {len(group)} images into {target_filename} (Height: {current_y}px)")
+            print(f"Merged {len(group)} images into {target_filename} (Height: {total_height}px)")
 
         except Exception as e:
             print(f"[ERROR LOG] Failed to process merge group starting with {target_filename}: {type(e).__name__} - {e}")
             continue
 
-    # 3. حذف الملفات المدمجة
-    for file_path in files_to_delete:
-        try:
-            os.remove(file_path)
-        except Exception as e:
-            print(f"[ERROR LOG] Failed to delete merged file {file_path}: {e}")
+    # 4. حذف الملفات المدمجة
+    for name in files_to_delete:
+        ws.delete(name)
     
-    # 4. إعادة ترقيم الملفات النهائية (المدمجة وغير المدمجة)
-    final_files = sorted([f for f in os.listdir(chapter_folder) if f.lower().endswith(tuple(VALID_FORMATS))])
+    # 5. إعادة ترقيم الملفات النهائية (المدمجة وغير المدمجة)
+    final_files = [name for name in ws.names(chapter_prefix) if name.lower().endswith(tuple(VALID_FORMATS))]
     
-    for index, filename in enumerate(final_files):
-        ext = filename.split('.')[-1]
-        new_filename = f"{index + 1:03d}.{ext}"
+    for index, name in enumerate(final_files):
+        ext = name.split('.')[-1]
+        new_name = f"{chapter_prefix}{index + 1:03d}.{ext}"
         
-        if filename != new_filename:
+        if name != new_name:
             try:
-                os.rename(os.path.join(chapter_folder, filename), os.path.join(chapter_folder, new_filename))
+                ws.rename(name, new_name)
             except Exception as e:
                 print(f"[ERROR LOG] Failed to rename file: {type(e).__name__} - {e}")
 
 
+# --- جدولة الفصول: تبويبات المتصفح وتنزيل الصور ---
+
+def _open_chapter_tab(driver, chapter_url, home_handle):
+    """
+    يفتح الفصل في تبويب جديد ويبدأ التحميل بدون انتظاره، ثم يعود للتبويب الرئيسي.
+    تعيد (معرّف التبويب، فئات الموارد المحظورة فيه).
+    """
+    driver.switch_to.new_window('tab')
+    handle = driver.current_window_handle
+    blocked_categories = browser.configure_tab(driver, chapter_url, buffer_bodies=CAPTURE_FROM_BROWSER)
+    driver.execute_script("window.location.href = arguments[0];", chapter_url)
+    driver.switch_to.window(home_handle)
+    return handle, blocked_categories
+
+
+def _close_chapter_tab(driver, handle, home_handle):
+    try:
+        if handle and handle in driver.window_handles:
+            driver.switch_to.window(handle)
+            driver.close()
+    except WebDriverException:
+        pass
+    try:
+        driver.switch_to.window(home_handle)
+    except WebDriverException:
+        pass
+
+
+def _harvest_chapter_images(driver, tab, job, network_log, chapter_url):
+    """
+    ينتقل لتبويب الفصل، ينتظر أول صورة، يمرر للأسفل ثم يعيد روابط الصور
+    مع محتوى الصور التي حمّلها المتصفح أثناء التمرير ({canonical_url: bytes}).
+    """
+    handle, blocked_categories = tab
+    driver.switch_to.window(handle)
+
+    with job.span("page_load"):
+        # 3.1 الانتظار حتى تحميل أول صورة (المحددات الأكثر شمولاً)
+        WebDriverWait(driver, 60).until( 
+            EC.presence_of_element_located((By.CSS_SELECTOR, 
+                'div#chapter-reader img, '
+                'div.chapter-reader img, '
+                'img.ts-main-image, '          
+                'img.w-full.object-contain, '  
+                'img.toon_image, '             
+                'div.reader__item img, '        
+                'img.wp-manga-chapter-img, '    
+                'img[id^="image-"], ' 
+                '#image-, '
+                'img[src*="cdn"], '            
+                'img[data-src], '              
+                'img[data-original]'           
+            ))
+        )
+    
+    # 3.2 التمرير لأسفل الصفحة للتعامل مع Lazy Loading
+    with job.span("scroll"):
+        last_height = driver.execute_script("return document.body.scrollHeight")
+        scroll_attempts = 0
+        max_scrolls = 10 
+        
+        while scroll_attempts < max_scrolls:
+            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+            time.sleep(3) 
+            
+            new_height = driver.execute_script("return document.body.scrollHeight")
+            
+            if new_height == last_height:
+                break
+                
+            last_height = new_height
+            scroll_attempts += 1
+    
+    # 3.3 استخلاص روابط الصور
+    with job.span("url_harvest"):
+        image_elements = driver.find_elements(By.TAG_NAME, 'img')
+        
+        image_srcs = []
+        for img in image_elements:
+            src = img.get_attribute('src')
+            data_src = img.get_attribute('data-src') 
+            
+            # الأولوية لـ data-src إذا كان موجوداً
+            if data_src and not data_src.startswith('data:'):
+                image_srcs.append(data_src)
+            elif src and not src.startswith('data:'):
+                image_srcs.append(src)
+
+    captured = {}
+    if CAPTURE_FROM_BROWSER:
+        with job.span("browser_capture", images=len(image_srcs)):
+            captured = network_log.capture_images(
+                handle, {canonical_image_url(src) for src in image_srcs}, key=canonical_image_url
+            )
+
+    browser.report_page(driver, network_log, job, "download", chapter_url, blocked_categories)
+    return image_srcs, captured
+
+
+def _ordered_map(executor, fn, items, window):
+    """مثل executor.map لكن بعدد محدود من المهام المعلقة حتى لا تتراكم الصور المفكوكة في الذاكرة."""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _download_chapter(chapter_num, image_srcs, ws, chapter_prefix, image_format, merge_images, deduplicator, job, progress_state, image_pool, captured=None, headers=None):
+    """
+    ينزل صور فصل واحد بالتوازي ويحفظها بالترتيب. تعمل الفصول واحداً تلو الآخر في خيط
+    الفصول حتى تبقى مقارنة الصور المكررة عبر الفصول بنفس الترتيب. تعيد عدد الصور المحفوظة.
+    الصور الموجودة في captured (من المتصفح) لا تُنزّل مرة ثانية.
+    الصور تُحفظ في مساحة عمل المهمة ws باسم chapter_prefix + رقم الصورة.
+    """
+    captured = captured if captured is not None else {}
+    try:
+        if image_srcs is None:
+            return 0
+
+        deduplicator.start_chapter()
+        image_srcs, url_rejections = deduplicator.filter_urls(image_srcs)
+        for reason in url_rejections:
+            metrics.IMAGES_REJECTED.inc(reason=reason)
+            job.count(f"skipped_{reason}")
+
+        if not image_srcs: 
+            print(f"[ERROR LOG] No unique image URLs found in chapter {chapter_num}")
+            return 0
+        
+        progress_state.update(
+            chapter=chapter_num,
+            chapter_images=0,
+            chapter_images_total=len(image_srcs),
+            status=f"جاري تنزيل صور الفصل {chapter_num}..."
+        )
+        images_downloaded = 0
+        image_counter = 1
+        downloads = _ordered_map(
+            image_pool,
+            lambda img_src: download_and_check_image(
+                img_src, image_format, job, content=captured.pop(canonical_image_url(img_src), None), headers=headers
+            ),
+            image_srcs,
+            IMAGE_DOWNLOAD_WORKERS * 2
+        )
+        for img_obj, ext, save_format in downloads:
+            if img_obj:
+                with job.span("dedup", trace=False):
+                    rejection = deduplicator.check(img_obj)
+                if rejection:
+                    metrics.IMAGES_REJECTED.inc(reason=rejection)
+                    job.count(f"skipped_{rejection}")
+                    job.event("image_skipped", chapter=chapter_num, reason=rejection)
+                    img_obj = None
+
+            if img_obj:
+                filename = f"{image_counter:03d}.{ext}"
+                
+                with job.span("encode", trace=False), ws.writer(chapter_prefix + filename) as f:
+                    if save_format in ['jpeg', 'webp']:
+                        img_obj.save(f, save_format, quality=90)
+                    elif save_format == 'png':
+                        img_obj.save(f, 'png')
+
+                images_downloaded += 1
+                job.count("images_downloaded")
+                job.event("image_saved", chapter=chapter_num, file=filename)
+                image_counter += 1
+                progress_state["images"] = progress_state.get("images", 0) + 1
+            progress_state["chapter_images"] = progress_state.get("chapter_images", 0) + 1
+        
+        if images_downloaded > 0 and merge_images:
+            progress_state["status"] = f"جاري دمج صور الفصل {chapter_num}..."
+            with job.span("merge"):
+                merge_chapter_images(ws, chapter_prefix, image_format)
+        elif images_downloaded == 0:
+            print(f"[ERROR LOG] No images were successfully downloaded in chapter {chapter_num}.")
+        return images_downloaded
+    finally:
+        progress_state["chapters_done"] = progress_state.get("chapters_done", 0) + 1
+
+
 # --- مهمة المعالجة الطويلة (تم تحديث محددات CSS) ---
-def _process_manga_download(url, chapter_number, chapters, merge_images, image_format):
+def _zip_chapters(ws, zip_name, prefixes):
+    """
+    يضغط صور الفصول (مجلد لكل فصل داخل الـ ZIP) في ملف zip_name داخل مساحة العمل نفسها.
+    الصور في الذاكرة تُكتب من نفس الـ bytes، والـ ZIP يبقى في الذاكرة ما دامت الميزانية تسمح.
+    """
+    with ws.writer(zip_name) as f, zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for prefix in prefixes:
+            for name in ws.names(prefix):
+                if ws.tier(name) == workspace.MEMORY:
+                    zipf.writestr(name, ws.read(name))
+                else:
+                    zipf.write(ws.path(name), name)
+
+
+def _store_zip(ws, zip_name, job, upload, output_dir, span_labels):
+    """يرفع ملف الـ ZIP من مساحة العمل إلى Dropbox، أو ينقله لـ output_dir عند upload=False. يعيد (المسار المحلي, مسار Dropbox, الرابط)."""
+    if not upload:
+        return ws.export(zip_name, os.path.join(output_dir or os.getcwd(), zip_name)), None, None
+    dropbox_path = dropbox_lifecycle.path_for(zip_name)
+    with job.span("dropbox_upload", **span_labels), delivery_router.timed("download", delivery_router.DROPBOX, job):
+        link = dropbox_lifecycle.upload(ws.read(zip_name), dropbox_path, CLEANUP_DELAY_SECONDS)
+    ws.delete(zip_name)
+    return None, dropbox_path, link
+
+
+class SharedAttachment:
+    """
+    ZIP صغير يبقى في مساحة عمل المهمة (ضمن ميزانية الذاكرة) حتى يرسله كل من انضم للمهمة كمرفق.
+    إذا رفض ديسكورد المرفق يُرفع لـ Dropbox مرة واحدة للمهمة كلها، وتُغلق مساحة العمل بعد آخر مستلم.
+    """
+
+    def __init__(self, ws, name):
+        self.ws = ws
+        self.name = name
+        self.released = 0
+        self._link = None
+        self._lock = asyncio.Lock()
+
+    def file(self):
+        # كل مستلم يقرأ من نفس الـ bytes (أو من ملف القرص إذا تجاوز الـ ZIP الميزانية)
+        return discord.File(self.ws.open(self.name), filename=self.name)
+
+    async def dropbox_link(self, job):
+        async with self._lock:
+            if self._link is None:
+                self._link = await asyncio.to_thread(self._upload, job)
+            return self._link
+
+    def _upload(self, job):
+        dropbox_path = dropbox_lifecycle.path_for(self.name)
+        with job.span("dropbox_upload"), delivery_router.timed("download", delivery_router.DROPBOX, job):
+            return dropbox_lifecycle.upload(self.ws.read(self.name), dropbox_path, CLEANUP_DELAY_SECONDS)
+
+    def release(self, holders):
+        """يُستدعى مرة من كل مستلم بعد انتهائه. holders = عدد من انضموا للمهمة."""
+        self.released += 1
+        if self.released >= holders:
+            self.ws.close()
+
+
+def _release_flight_attachment(flight):
+    """
+    يُستدعى مرة من كل عضو في المهمة بعد انتهائه. المرفق يُحرر عند انتهاء المهمة إن لم تكن انتهت بعد،
+    فتُغلق مساحة العمل بعد آخر عضو حتى لو لم يستلم بعضهم النتيجة.
+    """
+    def release(task):
+        if task.cancelled() or task.exception() is not None:
+            return
+        shared = task.result().get("attachment")
+        if shared:
+            shared.release(flight.waiters)
+
+    flight.task.add_done_callback(release)
+
+
+def _batch_label(batch):
+    first, last = batch[0][0], batch[-1][0]
+    return str(first) if first == last else f"{first}-{last}"
+
+
+def _deliver_batch(batch, job, progress_state, ws, upload=True, target_bytes=None, min_psnr=None, output_dir=None):
+    """
+    يسلّم دفعة فصول مكتملة: ضغط الصور (إن طُلب)، ZIP، ثم الرفع وإضافة الرابط لرسالة التقدم.
+    يعمل في خيط الرفع بالتوازي مع سحب الفصول التالية. batch قائمة [(رقم الفصل, بادئة الفصل في ws)].
+    """
+    label = _batch_label(batch)
+    prefixes = [prefix for _, prefix in batch]
+
+    encoder_report = None
+    if target_bytes or min_psnr:
+        image_names = [name for prefix in prefixes for name in ws.names(prefix)]
+        with job.span("size_encode", files=len(image_names)):
+            encoder_report = encoder.encode_files(image_names, target_bytes=target_bytes, min_psnr=min_psnr, command="download", store=ws)
+        job.count("bytes_saved", encoder_report["bytes_saved"])
+
+    zip_filename = f"manga_{uuid.uuid4().hex[:8]}_ch{label}.zip"
+    with job.span("zip", chapters=label):
+        _zip_chapters(ws, zip_filename, prefixes)
+    # الصور لم تعد لازمة بعد الـ ZIP: تحرير ميزانية الذاكرة قبل الرفع
+    for prefix in prefixes:
+        ws.delete_prefix(prefix)
+
+    zip_bytes = ws.size(zip_filename)
+    zip_path, dropbox_path, link = _store_zip(ws, zip_filename, job, upload, output_dir, {"chapters": label})
+    delivery = {
+        "chapters": label,
+        "zip_bytes": zip_bytes,
+        "zip_path": zip_path,
+        "dropbox_path": dropbox_path,
+        "link": link,
+        "encoder": encoder_report,
+    }
+
+    delivery["seconds"] = round(time.time() - job.started_at, 2)
+    if not progress_state.get("deliveries"):
+        metrics.TIME_TO_FIRST_LINK.observe(delivery["seconds"], command="download", mode="incremental")
+    job.event("batch_delivered", chapters=label, bytes=delivery["zip_bytes"])
+    progress_state["deliveries"] = progress_state.get("deliveries", []) + [{"chapters": label, "link": delivery["link"]}]
+    return delivery
+
+
+def delivery_fields(deliveries, field_limit=1000, max_fields=4):
+    """روابط الدفعات الجاهزة مقسمة على حقول ديسكورد (حد 1024 حرفاً للحقل)."""
+    lines = [f"فصل {d['chapters']}: {d['link']}" for d in deliveries if d.get("link")]
+    fields, current = [], ""
+    for index, line in enumerate(lines):
+        if len(current) + len(line) + 1 > field_limit:
+            fields.append(current)
+            current = ""
+            if len(fields) == max_fields:
+                fields[-1] += f"\n… و{len(lines) - index} روابط أخرى"
+                return fields
+        current += ("\n" if current else "") + line
+    if current:
+        fields.append(current)
+    return fields
+
+
+def _process_manga_download(url, chapter_number, chapters, merge_images, image_format, progress_state=None, upload=True, job=None, skip_banners=False, target_size_mb=None, min_psnr=None, deliver_every=0, work_dir=LOCAL_TEMP_DIR, output_dir=None, attachment_limit=0):
     """
     تحتوي على كل منطق الـ Selenium والملفات. تُشغل في خيط منفصل.
     تعيد قاموسًا بالنتائج النهائية.
+    عند upload=False يبقى ملف الـ ZIP محلياً بدون رفع (للقياس والتشغيل بدون Dropbox).
+    skip_banners يحذف الصور المتكررة عبر الفصول والموجودة في قائمة BANNER_HASHES.
+    target_size_mb / min_psnr يفعلان الضغط النهائي للصور (encoder.py) قبل إنشاء الـ ZIP.
+    deliver_every=N يسلّم كل N فصول في ZIP مستقل فور جاهزيتها (يُرفع أثناء سحب الفصول التالية)
+    بدلاً من ملف واحد في النهاية.
+    الصور والـ ZIP في مساحة عمل المهمة (workspace.py): في الذاكرة ضمن الميزانية المشتركة،
+    وما يتجاوزها يُكتب في work_dir. output_dir مكان ملفات الـ ZIP عند upload=False (افتراضياً مجلد التشغيل).
+    ملف ZIP واحد لا يتجاوز attachment_limit لا يُرفع: يعود في result["attachment"] (SharedAttachment)
+    ليُرسل كمرفق ديسكورد، ومساحة العمل تبقى مفتوحة حتى يُغلقها آخر مستلم.
     """
     driver = None
     chapters_processed = 0
-    
-    if os.path.exists(LOCAL_TEMP_DIR): shutil.rmtree(LOCAL_TEMP_DIR)
-    os.makedirs(LOCAL_TEMP_DIR, exist_ok=True)
+    if progress_state is None:
+        progress_state = {}
+    job = job or jobs.Job("download", url=url)
+    deduplicator = ImageDeduplicator(skip_banners=skip_banners)
+    ws = workspace.Workspace(job.trace_id, spill_dir=work_dir)
+    keep_workspace = False
     
     try:
         # 1. تهيئة المتصفح
-        driver = init_driver()
+        progress_state["status"] = "جاري تشغيل المتصفح..."
+        with job.span("driver_launch"):
+            driver = init_driver()
         if not driver:
             return {"success": False, "error": "فشل في تهيئة متصفح Chrome/Selenium."}
 
@@ -287,177 +1076,244 @@ def _process_manga_download(url, chapter_number, chapters, merge_images, image_f
             chapters = 1
 
         chapter_range = range(chapter_number, chapter_number + chapters) 
+        progress_state["chapters_total"] = len(chapter_range)
         
-        # 3. حلقة معالجة الفصول
-        for current_chapter_num in chapter_range:
-            if url_contains_chapter_num:
-                current_url = base_url_pattern.format(current_chapter_num)
-            else:
-                current_url = url
-                
-            local_chapter_folder = os.path.join(LOCAL_TEMP_DIR, str(current_chapter_num))
-            images_downloaded = 0
-            
-            try:
-                os.makedirs(local_chapter_folder, exist_ok=True)
-                
-                driver.get(current_url)
-                
-                # 3.1 الانتظار حتى تحميل أول صورة (المحددات الأكثر شمولاً)
-                WebDriverWait(driver, 60).until( 
-                    EC.presence_of_element_located((By.CSS_SELECTOR, 
-                        'div#chapter-reader img, '
-                        'div.chapter-reader img, '
-                        'img.ts-main-image, '          
-                        'img.w-full.object-contain, '  
-                        'img.toon_image, '             
-                        'div.reader__item img, '        
-                        'img.wp-manga-chapter-img, '    
-                        'img[id^="image-"], ' 
-                        '#image-, '
-                        'img[src*="cdn"], '            
-                        'img[data-src], '              
-                        'img[data-original]'           
-                    ))
-                )
-                
-                # 3.2 التمرير لأسفل الصفحة للتعامل مع Lazy Loading
-                last_height = driver.execute_script("return document.body.scrollHeight")
-                scroll_attempts = 0
-                max_scrolls = 10 
-                
-                while scroll_attempts < max_scrolls:
-                    driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-                    time.sleep(3) 
-                    
-                    new_height = driver.execute_script("return document.body.scrollHeight")
-                    
-                    if new_height == last_height:
-                        break
-                        
-                    last_height = new_height
-                    scroll_attempts += 1
-                
-                # 3.3 استخلاص روابط الصور
-                image_elements = driver.find_elements(By.TAG_NAME, 'img')
-                
-                image_srcs = []
-                for img in image_elements:
-                    src = img.get_attribute('src')
-                    data_src = img.get_attribute('data-src') 
-                    
-                    # الأولوية لـ data-src إذا كان موجوداً
-                    if data_src and not data_src.startswith('data:'):
-                        image_srcs.append(data_src)
-                    elif src and not src.startswith('data:'):
-                        image_srcs.append(src)
-                        
-                image_srcs = list(dict.fromkeys(image_srcs))
-
-
-                if not image_srcs: 
-                    print(f"[ERROR LOG] No unique image URLs found in chapter {current_chapter_num}")
-                    if os.path.exists(local_chapter_folder): shutil.rmtree(local_chapter_folder)
-                    continue
-                
-                # تنزيل وحفظ الصور
-                image_counter = 1
-                for img_src in image_srcs:
-                    if not img_src or img_src.startswith('data:'): continue
-
-                    img_obj, ext, save_format = download_and_check_image(img_src, image_format)
-                    
-                    if img_obj:
-                        filename = f"{image_counter:03d}.{ext}"
-                        local_file_path = os.path.join(local_chapter_folder, filename)
-                        
-                        if save_format in ['jpeg', 'webp']:
-                            img_obj.save(local_file_path, save_format, quality=90)
-                        elif save_format == 'png':
-                            img_obj.save(local_file_path, 'png') 
-
-                        images_downloaded += 1
-                        image_counter += 1
-                
+        # 3. حلقة معالجة الفصول: المتصفح يفتح حتى CHAPTER_TABS فصول في تبويبات بالتوازي،
+        # وبينما يُنزّل خيط الفصول صور الفصل الحالي ينتقل المتصفح للفصل التالي.
+        chapter_urls = [
+            (num, base_url_pattern.format(num) if url_contains_chapter_num else url)
+            for num in chapter_range
+        ]
+        home_handle = driver.current_window_handle
+        # الصور التي لم يحمّلها المتصفح تُنزّل بنفس هوية المتصفح (بعض الـ CDN ترفض HeadlessChrome)
+        user_agent = (driver.execute_script("return navigator.userAgent") or DEFAULT_USER_AGENT).replace("HeadlessChrome", "Chrome")
+        network_log = browser.NetworkLog(driver)
+        open_tabs = {}
+        next_to_open = 0
+        chapter_futures = []
+        delivery_futures = []
+        pending_batch = []   # فصول مكتملة لم تُسلّم بعد [(رقم الفصل, بادئة الفصل في ws)]
+        target_bytes = int(target_size_mb * 1024 * 1024) if target_size_mb else None
+        progress_state["deliveries"] = []
+        progress_state["status"] = "جاري فتح الفصول..."
+
+        with ThreadPoolExecutor(max_workers=1) as upload_pool, ThreadPoolExecutor(max_workers=1) as chapter_pool, ThreadPoolExecutor(max_workers=IMAGE_DOWNLOAD_WORKERS) as image_pool:
+            def flush_batch():
+                if not pending_batch:
+                    return
+                batch = list(pending_batch)
+                pending_batch.clear()
+                # ميزانية الحجم تُوزع على الدفعات حسب عدد فصولها
+                batch_target = int(target_bytes * len(batch) / len(chapter_range)) if target_bytes else None
+                delivery_futures.append((
+                    _batch_label(batch),
+                    upload_pool.submit(_deliver_batch, batch, job, progress_state, ws, upload, batch_target, min_psnr, output_dir)
+                ))
+
+            def finish_chapter(current_chapter_num, chapter_prefix, *download_args):
+                """يعمل في خيط الفصول، أي بترتيب الفصول: تنزيل الصور ثم ضم الفصل لدفعة التسليم."""
+                nonlocal chapters_processed
+                try:
+                    images_downloaded = _download_chapter(current_chapter_num, *download_args)
+                except Exception as e:
+                    print(f"[ERROR LOG] Chapter {current_chapter_num} failed (General): {type(e).__name__} - {e}")
+                    images_downloaded = 0
+
                 if images_downloaded > 0:
-                    if merge_images:
-                        merge_chapter_images(local_chapter_folder, image_format) 
                     chapters_processed += 1
+                    job.event("chapter_done", chapter=current_chapter_num, images=images_downloaded)
+                    if deliver_every:
+                        pending_batch.append((current_chapter_num, chapter_prefix))
+                        if len(pending_batch) >= deliver_every:
+                            flush_batch()
                 else:
-                    print(f"[ERROR LOG] No images were successfully downloaded in chapter {current_chapter_num}.")
-                    if os.path.exists(local_chapter_folder): shutil.rmtree(local_chapter_folder)
+                    ws.delete_prefix(chapter_prefix)
+
+            for chapter_index, (current_chapter_num, current_url) in enumerate(chapter_urls):
+                while next_to_open < len(chapter_urls) and next_to_open < chapter_index + max(1, CHAPTER_TABS):
+                    tab_chapter, tab_url = chapter_urls[next_to_open]
+                    try:
+                        open_tabs[tab_chapter] = _open_chapter_tab(driver, tab_url, home_handle)
+                    except WebDriverException as e:
+                        print(f"[ERROR LOG] Could not open a tab for chapter {tab_chapter}: {type(e).__name__} - {e}")
+                    next_to_open += 1
+
+                chapter_prefix = f"{current_chapter_num}/"
+                job.event("chapter_started", chapter=current_chapter_num, url=current_url)
+                image_srcs, captured = None, None
+                tab = open_tabs.pop(current_chapter_num, None)
+                handle = tab[0] if tab else None
                 
-            except TimeoutException as e:
-                print(f"[ERROR LOG] Chapter {current_chapter_num} failed (Selenium Timeout): Element not loaded within 60s. - {e}")
-                if os.path.exists(local_chapter_folder): shutil.rmtree(local_chapter_folder)
-                continue
-            except NoSuchElementException as e:
-                print(f"[ERROR LOG] Chapter {current_chapter_num} failed (Selenium Element Not Found): Cannot locate required image elements. - {e}")
-                if os.path.exists(local_chapter_folder): shutil.rmtree(local_chapter_folder)
-                continue
-            except Exception as e:
-                print(f"[ERROR LOG] Chapter {current_chapter_num} failed (General): {type(e).__name__} - {e}")
-                if os.path.exists(local_chapter_folder): shutil.rmtree(local_chapter_folder)
-                continue
+                try:
+                    if tab is None:
+                        raise WebDriverException("chapter tab was not opened")
+                    image_srcs, captured = _harvest_chapter_images(driver, tab, job, network_log, current_url)
+                except TimeoutException as e:
+                    print(f"[ERROR LOG] Chapter {current_chapter_num} failed (Selenium Timeout): Element not loaded within 60s. - {e}")
+                except NoSuchElementException as e:
+                    print(f"[ERROR LOG] Chapter {current_chapter_num} failed (Selenium Element Not Found): Cannot locate required image elements. - {e}")
+                except Exception as e:
+                    print(f"[ERROR LOG] Chapter {current_chapter_num} failed (General): {type(e).__name__} - {e}")
+                finally:
+                    _close_chapter_tab(driver, handle, home_handle)
+
+                chapter_futures.append(chapter_pool.submit(
+                    finish_chapter, current_chapter_num, chapter_prefix, image_srcs, ws, chapter_prefix,
+                    image_format, merge_images, deduplicator, job, progress_state, image_pool,
+                    captured, {"User-Agent": user_agent, "Referer": current_url}
+                ))
+
+            # انتظار كل الفصول (فشل فصل لا يؤثر على غيره)، ثم تسليم آخر دفعة غير مكتملة
+            for future in chapter_futures:
+                future.result()
+            flush_batch()
+
+            deliveries = []
+            failed_batches = []
+            for label, future in delivery_futures:
+                try:
+                    deliveries.append(future.result())
+                except Exception as e:
+                    print(f"[ERROR LOG] Chapter batch {label} delivery failed: {type(e).__name__} - {e}")
+                    job.event("batch_failed", chapters=label, error=str(e))
+                    failed_batches.append(label)
         
         # 4. إنهاء العملية (الضغط والرفع)
         if chapters_processed == 0:
             return {"success": False, "error": "**لم يتم معالجة أو تنزيل أي فصول بنجاح.**"}
 
+        result = {
+            "success": True, 
+            "shared_link": "", 
+            "chapters_processed": chapters_processed,
+            "zip_path": None,
+            "zip_bytes": 0,
+            "dropbox_path": None,
+            "url_was_fixed": not url_contains_chapter_num and chapters == 1,
+            "images_downloaded": job.counters.get("images_downloaded", 0),
+            "bytes_downloaded": job.counters.get("bytes_downloaded", 0),
+            "bytes_captured": job.counters.get("bytes_captured", 0),
+            "encoder": None,
+            "browser_transfer_bytes": job.counters.get("browser_transfer_bytes", 0),
+            "requests_blocked": {k[len("blocked_"):]: v for k, v in job.counters.items() if k.startswith("blocked_")},
+            "images_skipped": {k[len("skipped_"):]: v for k, v in job.counters.items() if k.startswith("skipped_")},
+            "timings": job.timings
+        }
+
+        if deliver_every:
+            if failed_batches:
+                # دفعة ناقصة تعني تحميلاً ناقصاً: نعيد الفشل مع روابط ما نجح والفصول التي لم تُرفع
+                return {
+                    "success": False,
+                    "error": f"**فشل رفع الفصول: {', '.join(failed_batches)}**",
+                    "deliveries": deliveries,
+                    "failed_batches": failed_batches,
+                }
+            result.update({
+                "shared_link": deliveries[0]["link"] or "",
+                "deliveries": deliveries,
+                "zip_bytes": sum(d["zip_bytes"] for d in deliveries),
+                "encoder": encoder.merge_reports([d["encoder"] for d in deliveries]),
+                "first_delivery_seconds": deliveries[0]["seconds"],
+                "workspace": ws.stats(),
+            })
+            return result
+
+        encoder_report = None
+        if target_size_mb or min_psnr:
+            progress_state["status"] = "جاري ضغط الصور..."
+            image_names = ws.names()
+            with job.span("size_encode", files=len(image_names)):
+                encoder_report = encoder.encode_files(
+                    image_names,
+                    target_bytes=int(target_size_mb * 1024 * 1024) if target_size_mb else None,
+                    min_psnr=min_psnr,
+                    command="download",
+                    store=ws
+                )
+            job.count("bytes_saved", encoder_report["bytes_saved"])
+
         unique_id = uuid.uuid4().hex[:8]
         zip_filename = f"manga_{unique_id}.zip"
-        local_zip_path = os.path.join(os.getcwd(), zip_filename)
-
-        with zipfile.ZipFile(local_zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(LOCAL_TEMP_DIR):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, LOCAL_TEMP_DIR)
-                    zipf.write(file_path, arcname)
-        
-        dropbox_path = f"/{zip_filename}"
-        with open(local_zip_path, 'rb') as f:
-            dbx.files_upload(f.read(), dropbox_path, mode=dropbox.files.WriteMode('overwrite'))
+        chapter_prefixes = sorted({name.split("/", 1)[0] + "/" for name in ws.names()})
 
-        shared_link = ""
-        try:
-            shared_link_metadata = dbx.sharing_create_shared_link_with_settings(dropbox_path)
-            shared_link = shared_link_metadata.url
-        except dropbox.exceptions.ApiError as e:
-            if e.error.is_shared_link_already_exists():
-                shared_links = dbx.sharing_list_shared_links(path=dropbox_path, direct_only=True).links
-                if shared_links:
-                    shared_link = shared_links[0].url
-            else:
-                shared_link = "(فشل إنشاء رابط مشاركة)"
+        progress_state["status"] = "جاري ضغط الملفات..."
+        with job.span("zip"):
+            _zip_chapters(ws, zip_filename, chapter_prefixes)
+        for prefix in chapter_prefixes:
+            ws.delete_prefix(prefix)
 
-        return {
-            "success": True, 
-            "shared_link": shared_link, 
-            "chapters_processed": chapters_processed,
-            "zip_path": local_zip_path,
-            "dropbox_path": dropbox_path,
-            "url_was_fixed": not url_contains_chapter_num and chapters == 1
-        }
+        result.update({
+            "zip_bytes": ws.size(zip_filename),
+            "encoder": encoder_report,
+        })
+        if upload and delivery_router.choose(result["zip_bytes"], attachment_limit, delivery_router.DROPBOX) == delivery_router.DISCORD:
+            # الـ ZIP يُرسل من مساحة العمل نفسها مع الرسالة النهائية (download_command)
+            result["attachment"] = SharedAttachment(ws, zip_filename)
+            result["workspace"] = ws.stats()
+            keep_workspace = True
+            return result
+        if upload:
+            progress_state["status"] = "جاري الرفع إلى Dropbox..."
+        zip_path, dropbox_path, shared_link = _store_zip(ws, zip_filename, job, upload, output_dir, {})
+        result["zip_path"] = zip_path
+        result["workspace"] = ws.stats()
+        if not upload:
+            return result
+        metrics.TIME_TO_FIRST_LINK.observe(time.time() - job.started_at, command="download", mode="single")
+
+        result["shared_link"] = shared_link
+        result["dropbox_path"] = dropbox_path
+        return result
 
     except Exception as e:
         print(f"[CRITICAL ERROR] Download task failed: {type(e).__name__} - {e}")
-        return {"success": False, "error": f"فشل العملية: {e}"}
+        # الدفعات التي سُلّمت قبل الفشل تبقى متاحة للمستخدم
+        return {"success": False, "error": f"فشل العملية: {e}", "deliveries": progress_state.get("deliveries", [])}
         
     finally:
         if driver: driver.quit()
-        if os.path.exists(LOCAL_TEMP_DIR): shutil.rmtree(LOCAL_TEMP_DIR)
+        job.count("workspace_spills", ws.spills)
+        if not keep_workspace:
+            ws.close()
+
+
+# --- خادم المقاييس ---
+METRICS_PORT = os.getenv("METRICS_PORT")
+web_server_started = False
+
+async def start_web_server():
+    global web_server_started
+    if web_server_started or not METRICS_PORT:
+        return
+    web_server_started = True
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics.metrics_handler)
+    jobs.add_routes(app)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '0.0.0.0', int(METRICS_PORT))
+    await site.start()
+    print(f"[INFO] Metrics server started on port {METRICS_PORT}")
 
 
-# --- أحداث البوت وأمر التطبيق (لم يتم تغييرها) ---
+# --- أحداث البوت وأمر التطبيق ---
 
 @bot.event
 async def on_ready():
     print(f'Bot is ready. Logged in as {bot.user}')
+    looplag.monitor.start()
+    await start_web_server()
     try:
         synced = await bot.tree.sync()
         print(f"Synced {len(synced)} slash commands.")
-        dbx.users_get_current_account()
+        if not dbx:
+            print("[WARNING] DROPBOX_ACCESS_TOKEN not found. Uploads will fail.")
+            return
+        await asyncio.to_thread(dbx.users_get_current_account)
+        await dropbox_lifecycle.start()
         print("Dropbox connection successful.")
     except Exception as e:
         print(f"Dropbox connection failed or slash commands sync failed: {e}")
@@ -469,7 +1325,12 @@ async def on_ready():
     chapter_number="رقم الفصل الأول الذي سيبدأ به الترقيم (افتراضي 1)",
     chapters="عدد الفصول المراد تحميلها (افتراضي 1)",
     merge_images="دمج الصور المزدوجة في كل فصل (JPG فقط - افتراضي: False)", 
-    image_format="صيغة الإخراج المطلوبة (مثل: jpg, webp, png - افتراضي: jpg)"
+    image_format="صيغة الإخراج المطلوبة (مثل: jpg, webp, png - افتراضي: jpg)",
+    skip_banners="تخطي الإعلانات وصفحات الفريق المتكررة في كل فصل (افتراضي: False)",
+    target_size_mb="الحجم المستهدف لملف الـ ZIP بالميجابايت (اختياري)",
+    quality_floor="أقل جودة مقبولة عند ضغط الصور (اختياري)",
+    deliver_every="رفع كل N فصول فور جاهزيتها بدلاً من ملف واحد في النهاية (0 = ملف واحد)",
+    profile="(للمشرفين) حفظ ملف أداء CPU والذاكرة لهذه المهمة"
 )
 async def download_command(
     interaction: discord.Interaction, 
@@ -477,15 +1338,25 @@ async def download_command(
     chapter_number: int = 1,
     chapters: int = 1,       
     merge_images: bool = False,
-    image_format: str = "jpg"
+    image_format: str = "jpg",
+    skip_banners: bool = False,
+    target_size_mb: int = None,
+    quality_floor: Literal["ممتازة", "جيدة", "مقبولة"] = None,
+    deliver_every: int = 0,
+    profile: bool = False
 ):
     user_mention = interaction.user.mention
+    deliver_every = max(0, deliver_every)
     
     if image_format.lower() not in VALID_FORMATS:
         error_msg = f"❌ **صيغة الإخراج غير مدعومة!** الصيغ المدعومة هي: {', '.join(VALID_FORMATS)}."
         await interaction.response.send_message(error_msg, ephemeral=True)
         return
 
+    if profile and not profiling.is_admin(interaction.user):
+        await interaction.response.send_message("❌ خيار `profile` متاح للمشرفين فقط.", ephemeral=True)
+        return
+
     initial_embed = discord.Embed(
         title="📥 تحميل فصل المانهوا",
         description=f"{user_mention} **جارِ المعالجة، الرجاء الانتظار...** ⌛",
@@ -495,44 +1366,211 @@ async def download_command(
     await interaction.response.send_message(embed=initial_embed, ephemeral=False)
     original_response = await interaction.original_response()
 
-    try:
-        result = await asyncio.to_thread(
-            _process_manga_download,
+    job = jobs.registry.start(
+        "download",
+        user_id=interaction.user.id,
+        url=url,
+        chapter_number=chapter_number,
+        chapters=chapters,
+        merge_images=merge_images,
+        image_format=image_format.lower(),
+        skip_banners=skip_banners,
+        target_size_mb=target_size_mb,
+        quality_floor=quality_floor,
+        deliver_every=deliver_every,
+        profile=profile
+    )
+    min_psnr = encoder.QUALITY_FLOORS.get(quality_floor)
+    attachment_limit = delivery_router.attachment_limit(interaction)
+
+    async def process(flight):
+        profiler = profiling.JobProfiler(os.path.join(PROFILE_DIR, flight.job.trace_id), flight.job) if profile else None
+        if profiler:
+            profiler.start()
+        try:
+            result = await asyncio.to_thread(
+                _process_manga_download,
+                url,
+                chapter_number,
+                chapters,
+                merge_images,
+                image_format.lower(),
+                flight.progress_state,
+                job=flight.job,
+                skip_banners=skip_banners,
+                target_size_mb=target_size_mb,
+                min_psnr=min_psnr,
+                deliver_every=deliver_every,
+                attachment_limit=attachment_limit
+            )
+        finally:
+            profile_files = await asyncio.to_thread(profiler.stop) if profiler else []
+        result["profile_files"] = profile_files
+        # الملف المحلي يُحذف مرة واحدة هنا، وكل من انضم للمهمة يستلم نفس رابط Dropbox
+        if result["success"] and result["zip_path"] and os.path.exists(result["zip_path"]):
+            await asyncio.to_thread(os.remove, result["zip_path"])
+        return result
+
+    # نفس الفصول بنفس الإعدادات قيد التحميل لمستخدم آخر؟ ننضم لمهمته بدلاً من متصفح جديد
+    flight, leader = download_flights.join(
+        singleflight.flight_key(
             url,
-            chapter_number,
-            chapters,
-            merge_images,
-            image_format.lower()
-        )
-    except Exception as e:
-        print(f"[CRITICAL ERROR] asyncio.to_thread failed: {type(e).__name__} - {e}")
-        result = {"success": False, "error": f"فشل غير متوقع في الخادم: {e}"}
+            chapter_number=chapter_number,
+            chapters=chapters,
+            merge_images=merge_images,
+            image_format=image_format.lower(),
+            skip_banners=skip_banners,
+            target_size_mb=target_size_mb,
+            min_psnr=min_psnr,
+            deliver_every=deliver_every,
+            # الملف الصغير يُرسل كمرفق: المهمة تُشارك فقط مع من لديه نفس حد المرفقات
+            attachment_limit=attachment_limit,
+            # مهمة عليها ملف أداء لا تُشارك مع غيرها (المطلوب قياس هذه المهمة بالذات)
+            **({"profile": job.trace_id} if profile else {})
+        ),
+        ProgressState({
+            "status": "تهيئة...",
+            "chapter": chapter_number,
+            "chapters_done": 0,
+            "chapters_total": chapters,
+            "chapter_images": 0,
+            "chapter_images_total": 0,
+            "images": 0
+        }),
+        job,
+        process
+    )
+    progress_state = flight.progress_state
+    if not leader:
+        job.event("coalesced", leader=flight.job.trace_id)
 
-    if result["success"]:
-        if os.path.exists(result["zip_path"]): os.remove(result["zip_path"])
-        
-        bot.loop.create_task(cleanup_dropbox_file(result["dropbox_path"], CLEANUP_DELAY_SECONDS))
-        
-        final_embed = discord.Embed(
-            title="✅ تم الرفع إلى Dropbox",
-            description=f"{user_mention} **تم رفع الملف بنجاح!**\n\n**رابط التحميل:**\n{result['shared_link']}\n\n"
-                        f"**ملاحظة:** سيتم حذف الملف تلقائيًا بعد **{CLEANUP_DELAY_SECONDS // 60} دقيقة**.",
-            color=discord.Color.green()
+    def render_progress():
+        chapters_done = progress_state["chapters_done"]
+        chapters_total = progress_state["chapters_total"]
+        embed = discord.Embed(
+            title="📥 تحميل فصل المانهوا",
+            description=f"{user_mention} **{progress_state['status']}**",
+            color=discord.Color.dark_grey()
         )
-        footer_text = f"تم معالجة {result['chapters_processed']} فصل/فصول بنجاح. الصيغة: {image_format.upper()}. الدمج: {'مفعل (طول 15k-28k)' if merge_images else 'غير مفعل'}."
-        if result.get('url_was_fixed'):
-            footer_text += " (تحذير: تم تحميل فصل واحد فقط لعدم وجود نمط ترقيم واضح)."
-            
-        final_embed.set_footer(text=footer_text)
+        embed.add_field(name="الفصول:", value=f"`{create_progress_bar(chapters_done, chapters_total)}` ({chapters_done}/{chapters_total})", inline=False)
+        if progress_state["chapter_images_total"]:
+            embed.add_field(
+                name=f"صور الفصل {progress_state['chapter']}:",
+                value=f"`{create_progress_bar(progress_state['chapter_images'], progress_state['chapter_images_total'])}`",
+                inline=False
+            )
+        embed.add_field(name="الصور المحفوظة:", value=f"`{progress_state['images']}`", inline=True)
+        for value in delivery_fields(progress_state.get("deliveries", [])):
+            embed.add_field(name="🔗 الفصول الجاهزة:", value=value, inline=False)
+        shared_text = "" if leader else f" | 🔗 مشترك مع {flight.job.trace_id}"
+        embed.set_footer(text=f"🔎 {job.trace_id}{shared_text}")
+        return embed
+
+    # كل عضو يحرر نصيبه من المرفق المشترك عند انتهائه مهما كانت النتيجة (فشل الانتظار أو إلغاؤه أيضاً)
+    try:
+        progress_handle = publisher.attach(progress_state, original_response, render_progress)
+        try:
+            result = await download_flights.wait(flight)
+        except Exception as e:
+            print(f"[CRITICAL ERROR] asyncio.to_thread failed: {type(e).__name__} - {e}")
+            result = {"success": False, "error": f"فشل غير متوقع في الخادم: {e}"}
+        finally:
+            original_response = await progress_handle.close()
+
+        sent_as_attachment = False
+        shared = result.get("attachment") if result["success"] else None
+        if shared:
+            attachment_embed = discord.Embed(
+                title="✅ الملف جاهز",
+                description=f"{user_mention} **الملف مرفق بهذه الرسالة.**",
+                color=discord.Color.green()
+            )
+            attachment_embed.set_footer(text=_download_footer(result, image_format, merge_images))
+            sent_as_attachment, result = await _send_attachment(original_response, attachment_embed, result, shared, job)
+        job.finish(result["success"], result.get("error"))
+
+        if result["success"] and not sent_as_attachment:
+            if result.get("deliveries"):
+                final_embed = discord.Embed(
+                    title="✅ تم الرفع إلى Dropbox",
+                    description=f"{user_mention} **تم رفع {len(result['deliveries'])} ملفات بنجاح!**\n\n"
+                                f"**ملاحظة:** يُحذف كل ملف تلقائيًا بعد **{CLEANUP_DELAY_SECONDS // 60} دقيقة** من رفعه.",
+                    color=discord.Color.green()
+                )
+                for value in delivery_fields(result["deliveries"]):
+                    final_embed.add_field(name="🔗 روابط التحميل:", value=value, inline=False)
+            else:
+                final_embed = discord.Embed(
+                    title="✅ تم الرفع إلى Dropbox",
+                    description=f"{user_mention} **تم رفع الملف بنجاح!**\n\n**رابط التحميل:**\n{result['shared_link']}\n\n"
+                                f"**ملاحظة:** سيتم حذف الملف تلقائيًا بعد **{CLEANUP_DELAY_SECONDS // 60} دقيقة**.",
+                    color=discord.Color.green()
+                )
+            final_embed.set_footer(text=_download_footer(result, image_format, merge_images))
         
-        await original_response.edit(embed=final_embed)
-    else:
-        error_embed = discord.Embed(
-            title="❌ فشل العملية",
-            description=f"حدث خطأ أثناء المعالجة:\n**{result.get('error', 'خطأ غير معروف')}**",
-            color=discord.Color.red()
-        )
-        await original_response.edit(embed=error_embed)
+            await original_response.edit(embed=final_embed)
+        elif not result["success"]:
+            error_embed = discord.Embed(
+                title="❌ فشل العملية",
+                description=f"حدث خطأ أثناء المعالجة:\n**{result.get('error', 'خطأ غير معروف')}**",
+                color=discord.Color.red()
+            )
+            # الفصول التي رُفعت قبل الفشل
+            for value in delivery_fields(result.get("deliveries", [])):
+                error_embed.add_field(name="🔗 ما تم رفعه قبل الفشل:", value=value, inline=False)
+            if result.get("failed_batches"):
+                error_embed.add_field(name="⚠️ فصول لم تُرفع:", value=f"`{', '.join(result['failed_batches'])[:1000]}`", inline=False)
+            await original_response.edit(embed=error_embed)
+
+        if result.get("profile_files"):
+            await send_profile_files(interaction, result["profile_files"])
+    finally:
+        _release_flight_attachment(flight)
+
+
+async def _send_attachment(message, embed, result, shared, job):
+    """
+    يرسل الـ ZIP مرفقاً بالرسالة النهائية. إذا رفضه ديسكورد (مثلاً حد مرفقات أصغر) يُستخدم رابط Dropbox
+    المشترك للمهمة. يعيد (هل أُرسل كمرفق, النتيجة). النتيجة مشتركة بين من انضموا للمهمة فلا تُعدّل في مكانها.
+    """
+    try:
+        with delivery_router.timed("download", delivery_router.DISCORD, job):
+            await message.edit(embed=embed, attachments=[shared.file()])
+        metrics.TIME_TO_FIRST_LINK.observe(time.time() - job.started_at, command="download", mode="attachment")
+        return True, result
+    except discord.HTTPException as e:
+        print(f"[WARNING] Attachment delivery failed, uploading to Dropbox instead: {type(e).__name__} - {e}")
+    try:
+        shared_link = await shared.dropbox_link(job)
+    except Exception as e:
+        print(f"[ERROR LOG] Dropbox fallback failed: {type(e).__name__} - {e}")
+        return False, {"success": False, "error": f"فشل رفع الملف: {e}", "profile_files": result.get("profile_files")}
+    return False, {**result, "shared_link": shared_link}
+
+
+def _download_footer(result, image_format, merge_images):
+    footer_text = f"تم معالجة {result['chapters_processed']} فصل/فصول بنجاح. الصيغة: {image_format.upper()}. الدمج: {'مفعل (طول 15k-28k)' if merge_images else 'غير مفعل'}."
+    if result.get("encoder"):
+        footer_text += f" تم توفير {encoder.format_savings(result['encoder'])} بالضغط."
+    if result.get('url_was_fixed'):
+        footer_text += " (تحذير: تم تحميل فصل واحد فقط لعدم وجود نمط ترقيم واضح)."
+    return footer_text
+
+
+async def send_profile_files(interaction, profile_files):
+    """
+    ملفات الأداء تُرسل للمشرف كمرفقات خاصة (هذا البوت لا يخدم مجلد downloads عبر الويب)،
+    ثم يُحذف مجلدها.
+    """
+    try:
+        files = [discord.File(path, filename=os.path.basename(path)) for path in profile_files if os.path.exists(path)]
+        if files:
+            await interaction.followup.send(content=f"🔬 ملفات الأداء للمهمة `{os.path.basename(os.path.dirname(profile_files[0]))}`", files=files, ephemeral=True)
+    except Exception as e:
+        print(f"[WARNING] Could not send profile files: {type(e).__name__} - {e}")
+    finally:
+        await asyncio.to_thread(shutil.rmtree, os.path.dirname(profile_files[0]), True)
 
 # تشغيل البوت
-bot.run(DISCORD_BOT_TOKEN)
+if __name__ == "__main__":
+    bot.run(DISCORD_BOT_TOKEN)
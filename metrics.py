@@ -0,0 +1,196 @@
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+# --- مقاييس الأداء (بصيغة Prometheus النصية) ---
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in self._metrics:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                lines.extend(metric.samples())
+        lines.extend(_process_samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.registry = registry
+        self._values = {}
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.registry.lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """يزيد القيمة طوال مدة التنفيذ (مثلاً عدد المهام الجارية)."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, help_text, labelnames, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        lines = []
+        for key, (bucket_counts, total, count) in self._values.items():
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', bound))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _process_samples():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return [
+        "# TYPE process_resident_memory_bytes gauge",
+        f"process_resident_memory_bytes {rss_bytes()}",
+        "# TYPE process_peak_resident_memory_bytes gauge",
+        f"process_peak_resident_memory_bytes {peak}",
+        "# TYPE process_threads gauge",
+        f"process_threads {threading.active_count()}",
+    ]
+
+
+# --- المقاييس المشتركة بين البوتين ---
+STAGE_SECONDS = Histogram("scraper_stage_seconds", "Wall time spent in each pipeline stage", ["stage"])
+BYTES_MOVED = Counter("scraper_bytes_total", "Bytes moved, by direction", ["direction"])
+IMAGES_REJECTED = Counter("scraper_images_rejected_total", "Images dropped before saving, by reason", ["reason"])
+CACHE_HITS = Counter("scraper_cache_hits_total", "Work skipped because a result was already available", ["cache"])
+QUEUE_DEPTH = Gauge("scraper_jobs_in_flight", "Jobs currently running, by command", ["command"])
+JOBS_TOTAL = Counter("scraper_jobs_total", "Finished jobs, by command and outcome", ["command", "outcome"])
+REQUESTS_BLOCKED = Counter("scraper_browser_requests_blocked_total", "Browser requests blocked by the resource filter, by category", ["category"])
+PAGE_LOAD_SECONDS = Histogram("scraper_page_load_seconds", "DOMContentLoaded time of scraped pages, with and without request blocking", ["command", "blocking"])
+LOOP_LAG_SECONDS = Histogram("scraper_event_loop_lag_seconds", "How late the event loop woke up a periodic probe")
+LOOP_LAG_QUANTILES = Gauge("scraper_event_loop_lag_quantile_seconds", "Recent event loop lag percentiles", ["quantile"])
+LOOP_BLOCKS = Counter("scraper_event_loop_blocks_total", "Times a callback held the event loop past the block threshold")
+DROPBOX_DELETED = Counter("scraper_dropbox_files_deleted_total", "Expired zip files removed from Dropbox")
+BYTES_SAVED = Counter("scraper_encoder_bytes_saved_total", "Output bytes saved by the size-budgeted encoder", ["command"])
+DRIVE_FAST_PATH = Counter("scraper_drive_fast_path_total", "How /fetchpdf tried the browserless path: export, viewer_images or fallback", ["outcome"])
+TIME_TO_FIRST_LINK = Histogram("scraper_time_to_first_link_seconds", "Time from job start until the user had a first download link", ["command", "mode"])
+JOBS_COALESCED = Counter("scraper_jobs_coalesced_total", "Requests that joined an identical job already in flight", ["command"])
+WORKSPACE_BYTES = Gauge("scraper_workspace_bytes", "Job workspace bytes held in memory and tmpfs against the shared budget", ["tier"])
+WORKSPACE_SPILLS = Counter("scraper_workspace_spills_total", "Workspace files written to disk because the memory budget was full")
+DELIVERY_SECONDS = Histogram("scraper_delivery_seconds", "Time to hand a finished output to the user, by command and backend (discord attachment, dropbox, drive, file_server)", ["command", "backend"])
+DELIVERIES = Counter("scraper_deliveries_total", "Finished outputs handed to users, by command, backend and outcome", ["command", "backend", "outcome"])
+MERGE_GROUPS = Counter("scraper_merge_groups_total", "Merged image groups, by path (lossless jpegtran or pixel re-encode) and reason", ["path", "reason"])
+
+
+@contextmanager
+def stage(name, timings=None):
+    """
+    يقيس مرحلة من مراحل المعالجة: يسجلها في الـ Histogram ويضيف مدتها لقاموس timings
+    الخاص بالمهمة (إن وُجد) حتى تظهر في نتائج القياس.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+async def metrics_handler(request):
+    from aiohttp import web
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
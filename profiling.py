@@ -0,0 +1,131 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+# --- التقاط ملف أداء (CPU والذاكرة) لمهمة واحدة عند الطلب ---
+#
+# يعمل فقط عندما يطلبه مشرف لمهمة معينة: بدونه لا يوجد أي خيط أو تتبع إضافي.
+# العينات تُؤخذ من كل خيوط العملية (خيط المتصفح، خيوط الصور، حلقة الأحداث)، فإذا كانت هناك مهام
+# أخرى تعمل في نفس الوقت ستظهر في الملف أيضاً تحت أسماء خيوطها.
+
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000   # الفترة بين عينتين
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "1800"))      # حد أقصى حتى لا يبقى الخيط للأبد
+TRACEMALLOC_FRAMES = 10
+TOP_ALLOCATIONS = 40
+ADMIN_USER_IDS = {int(x) for x in os.getenv("ADMIN_USER_IDS", "").split(",") if x.strip().isdigit()}
+
+FOLDED_FILENAME = "profile.folded"
+ALLOCATIONS_FILENAME = "allocations.txt"
+
+_tracemalloc_users = 0
+_tracemalloc_owned = False   # لا نوقف tracemalloc إذا كان مفعلاً قبلنا (PYTHONTRACEMALLOC)
+_tracemalloc_lock = threading.Lock()
+
+
+def is_admin(user):
+    """مشرف = في ADMIN_USER_IDS، أو لديه صلاحية Administrator في السيرفر."""
+    if user.id in ADMIN_USER_IDS:
+        return True
+    permissions = getattr(user, "guild_permissions", None)
+    return bool(permissions and permissions.administrator)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class JobProfiler:
+    """
+    عينات دورية لكل الخيوط بصيغة الـ stacks المطوية (folded: "خيط;دالة;دالة عدد")
+    التي يقرأها flamegraph.pl و speedscope مباشرة، مع tracemalloc لأكثر أماكن حجز الذاكرة.
+    """
+
+    def __init__(self, output_dir, job=None, interval=PROFILE_INTERVAL):
+        self.output_dir = output_dir
+        self.job = job
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+
+    def start(self):
+        global _tracemalloc_users, _tracemalloc_owned
+        with _tracemalloc_lock:
+            # tracemalloc على مستوى العملية: يبدأ مع أول مهمة تطلبه ويتوقف مع آخرها
+            if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                _tracemalloc_owned = True
+            _tracemalloc_users += 1
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._sample, name="job-profiler", daemon=True)
+        self._thread.start()
+        if self.job:
+            self.job.event("profiling_started", interval_ms=self.interval * 1000)
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        deadline = self._started + PROFILE_MAX_SECONDS
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                # المسافة تفصل الـ stack عن العدد في صيغة folded
+                labels.append(names.get(thread_id, f"thread-{thread_id}").replace(" ", "_"))
+                stack = ";".join(reversed(labels))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        """يوقف العينات ويكتب الملفات في output_dir. يعيد مسارات الملفات المكتوبة."""
+        global _tracemalloc_users, _tracemalloc_owned
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        snapshot = None
+        with _tracemalloc_lock:
+            if tracemalloc.is_tracing():
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+            _tracemalloc_users = max(0, _tracemalloc_users - 1)
+            if _tracemalloc_users == 0 and _tracemalloc_owned:
+                tracemalloc.stop()
+                _tracemalloc_owned = False
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        files = []
+        folded_path = os.path.join(self.output_dir, FOLDED_FILENAME)
+        with open(folded_path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+        files.append(folded_path)
+
+        if snapshot is not None:
+            allocations_path = os.path.join(self.output_dir, ALLOCATIONS_FILENAME)
+            snapshot = snapshot.filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            with open(allocations_path, "w", encoding="utf-8") as f:
+                f.write(f"traced memory: current={current / 1024 / 1024:.1f} MB, peak={peak / 1024 / 1024:.1f} MB\n")
+                f.write(f"samples: {self.samples}, duration: {time.monotonic() - self._started:.1f}s\n\n")
+                for index, stat in enumerate(snapshot.statistics("traceback")[:TOP_ALLOCATIONS], start=1):
+                    f.write(f"#{index}: {stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+                    for line in stat.traceback.format(most_recent_first=True):
+                        f.write(f"    {line}\n")
+                    f.write("\n")
+            files.append(allocations_path)
+
+        if self.job:
+            self.job.event("profiling_written", samples=self.samples, files=[os.path.basename(p) for p in files])
+        return files
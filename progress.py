@@ -0,0 +1,263 @@
+import asyncio
+import time
+from collections import deque
+
+import discord
+
+import metrics
+
+# --- إعدادات ميزانية التعديل (حدود ديسكورد التقريبية لكل قناة) ---
+CHANNEL_EDITS_PER_WINDOW = 5
+CHANNEL_WINDOW_SECONDS = 5.0
+CHANNEL_RESERVED_EDITS = 1     # نترك تعديلاً واحداً للرسائل النهائية وأوامر المستخدمين
+MIN_EDIT_INTERVAL = 2.0
+REFRESH_INTERVAL = 10.0        # تحديث دوري حتى بدون تغيير (لتحديث الـ ETA)
+REPOST_AFTER_SECONDS = 840     # رموز التفاعل تنتهي بعد 15 دقيقة
+SLOW_EDIT_SECONDS = 1.5        # تعديل أبطأ من هذا يعني أن ديسكورد بدأ بتقييدنا
+MAX_PENALTY = 8.0
+
+
+def create_progress_bar(current, total, length=15):
+    if total is None or total <= 0:
+        return "[▓▓▓▓▓▓▓▓▓▓▓▓▓▓▓] (غير محدد)"
+
+    percent = min(int((current / total) * 100), 100)
+    filled_length = min(int(length * current // total), length)
+    bar = '█' * filled_length + '░' * (length - filled_length)
+    return f"[{bar}] {percent}%"
+
+
+class ProgressState(dict):
+    """
+    قاموس حالة المهمة كما كان سابقاً، لكن كل تعديل عليه (حتى من خيط المعالجة)
+    يُبلغ الناشر بوجود تغيير بدلاً من الاعتماد على حلقة تحديث ثابتة.
+    يمكن لأكثر من رسالة متابعة نفس الحالة (مهمة مشتركة بين عدة مستخدمين).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.listeners = []
+
+    def _notify(self):
+        for listener in list(self.listeners):
+            listener()
+
+    def __setitem__(self, key, value):
+        changed = key not in self or self[key] != value
+        super().__setitem__(key, value)
+        if changed:
+            self._notify()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._notify()
+
+
+class _ChannelBudget:
+    def __init__(self):
+        self.edits = deque()
+        self.penalty = 1.0
+        self.blocked_until = 0.0
+
+    def _trim(self, now):
+        while self.edits and now - self.edits[0] >= CHANNEL_WINDOW_SECONDS:
+            self.edits.popleft()
+
+    def remaining(self, now):
+        self._trim(now)
+        return CHANNEL_EDITS_PER_WINDOW - CHANNEL_RESERVED_EDITS - len(self.edits)
+
+    def next_slot(self, now):
+        """أقرب وقت يمكن فيه تعديل رسالة في هذه القناة دون تجاوز الميزانية."""
+        if self.remaining(now) > 0:
+            return max(now, self.blocked_until)
+        return max(self.edits[0] + CHANNEL_WINDOW_SECONDS, self.blocked_until)
+
+    def reserve(self, now):
+        self.edits.append(now)
+        return now
+
+    def release(self, slot):
+        try:
+            self.edits.remove(slot)
+        except ValueError:
+            pass
+
+    def observe(self, latency, rate_limited=False, retry_after=None):
+        if rate_limited:
+            self.penalty = min(self.penalty * 2, MAX_PENALTY)
+            self.blocked_until = time.monotonic() + (retry_after or CHANNEL_WINDOW_SECONDS)
+        elif latency >= SLOW_EDIT_SECONDS:
+            self.penalty = min(self.penalty * 1.5, MAX_PENALTY)
+        else:
+            self.penalty = max(1.0, self.penalty * 0.9)
+
+
+class ProgressHandle:
+    def __init__(self, publisher, message, render, repost_after):
+        self.publisher = publisher
+        self.message = message
+        self.render = render
+        self.repost_after = repost_after
+        self.created_at = time.monotonic()
+        self.last_edit = 0.0
+        self.last_payload = None
+        self.dirty = True
+        self.busy = False
+        self.closed = False
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.state = None
+
+    @property
+    def channel_id(self):
+        return getattr(self.message.channel, "id", None)
+
+    def notify(self):
+        """آمن للاستدعاء من أي خيط."""
+        self.dirty = True
+        self.publisher.wake()
+
+    async def close(self):
+        """يوقف التحديثات وينتظر انتهاء أي تعديل جارٍ، ثم يعيد الرسالة الحالية."""
+        self.closed = True
+        if self.state is not None and self.notify in self.state.listeners:
+            self.state.listeners.remove(self.notify)
+        await self._idle.wait()
+        return self.message
+
+
+class ProgressPublisher:
+    """
+    ناشر مركزي لرسائل التقدم: المهام تُبلغه بالتغييرات فقط، وهو يدمجها، يتجاهل
+    الرسائل التي لم يتغير محتواها، ويوزع ميزانية التعديل لكل قناة على المهام النشطة فيها.
+    """
+
+    def __init__(self):
+        self._handles = []
+        self._channels = {}
+        self._wakeup = None
+        self._loop = None
+        self._task = None
+
+    def register(self, message, render, repost_after=REPOST_AFTER_SECONDS):
+        """
+        يسجل رسالة تقدم جديدة. render دالة تعيد Embed من الحالة الحالية.
+        """
+        self._ensure_running()
+        handle = ProgressHandle(self, message, render, repost_after)
+        self._handles.append(handle)
+        self.wake()
+        return handle
+
+    def attach(self, state, message, render, repost_after=REPOST_AFTER_SECONDS):
+        """اختصار: يسجل الرسالة ويربط تغييرات ProgressState بها."""
+        handle = self.register(message, render, repost_after)
+        handle.state = state
+        state.listeners.append(handle.notify)
+        return handle
+
+    def wake(self):
+        if not self._loop or not self._wakeup:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wakeup.set()
+        else:
+            try:
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                pass
+
+    def _ensure_running(self):
+        if self._task and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    def _budget(self, channel_id):
+        budget = self._channels.get(channel_id)
+        if budget is None:
+            budget = self._channels[channel_id] = _ChannelBudget()
+        return budget
+
+    def _min_interval(self, handle, budget):
+        # حصة عادلة من ميزانية القناة لكل مهمة نشطة فيها، مضروبة في عقوبة التقييد
+        active = sum(1 for h in self._handles if not h.closed and h.channel_id == handle.channel_id)
+        per_edit = CHANNEL_WINDOW_SECONDS / max(1, CHANNEL_EDITS_PER_WINDOW - CHANNEL_RESERVED_EDITS)
+        return max(MIN_EDIT_INTERVAL, per_edit * active) * budget.penalty
+
+    def _due_time(self, handle, now):
+        budget = self._budget(handle.channel_id)
+        earliest = handle.last_edit + self._min_interval(handle, budget)
+        if not handle.dirty:
+            earliest = max(earliest, handle.last_edit + REFRESH_INTERVAL)
+        return max(earliest, budget.next_slot(now))
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            next_wake = None
+
+            self._handles = [h for h in self._handles if not (h.closed and not h.busy)]
+            for handle in self._handles:
+                if handle.closed or handle.busy:
+                    continue
+                due = self._due_time(handle, now)
+                if due <= now:
+                    # نحجز الفتحة فوراً حتى لا تتجاوز مهام نفس القناة الميزانية
+                    slot = self._budget(handle.channel_id).reserve(now)
+                    handle.busy = True
+                    handle._idle.clear()
+                    self._loop.create_task(self._publish(handle, slot))
+                elif next_wake is None or due < next_wake:
+                    next_wake = due
+
+            timeout = None if next_wake is None else max(0.05, next_wake - now)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _publish(self, handle, slot):
+        budget = self._budget(handle.channel_id)
+        started = time.monotonic()
+        try:
+            handle.dirty = False
+            embed = handle.render()
+            payload = embed.to_dict()
+            if payload == handle.last_payload:
+                # لا شيء تغير: لا نستهلك طلباً من الميزانية
+                budget.release(slot)
+                metrics.CACHE_HITS.inc(cache="unchanged_embed")
+                return
+            with metrics.stage("discord_edit"):
+                if time.monotonic() - handle.created_at >= handle.repost_after:
+                    new_message = await handle.message.channel.send(embed=embed)
+                    try:
+                        await handle.message.delete()
+                    except Exception:
+                        pass
+                    handle.message = new_message
+                    handle.created_at = time.monotonic()
+                else:
+                    await handle.message.edit(embed=embed)
+            handle.last_payload = payload
+            budget.observe(time.monotonic() - started)
+        except discord.HTTPException as e:
+            budget.observe(time.monotonic() - started, e.status == 429, getattr(e, "retry_after", None))
+        except Exception as e:
+            print(f"[WARNING] Progress update failed: {type(e).__name__} - {e}")
+        finally:
+            handle.last_edit = time.monotonic()
+            handle.busy = False
+            handle._idle.set()
+            self.wake()
+
+
+publisher = ProgressPublisher()
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import metrics
+
+# --- دمج المهام المتطابقة المتزامنة (single-flight) ---
+
+# معاملات لا تغيّر المحتوى (مصدر المشاركة والتتبع)
+IGNORED_QUERY_PARAMS = {"usp", "fbclid", "gclid", "ref", "ref_src"}
+# نهايات روابط درايف التي تشير لنفس الملف
+DRIVE_VIEW_SUFFIXES = ("/view", "/edit", "/preview")
+
+
+def normalize_url(url):
+    """شكل موحد للرابط: بدون www، بدون الجزء بعد #، معاملات التتبع محذوفة والباقي مرتب."""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port:
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip("/")
+    for suffix in DRIVE_VIEW_SUFFIXES:
+        if path.endswith(suffix) and "/file/d/" in path:
+            path = path[: -len(suffix)]
+            break
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in IGNORED_QUERY_PARAMS and not k.lower().startswith("utm_")
+    )
+    return urlunsplit((parts.scheme.lower() or "https", host, path, urlencode(query), ""))
+
+
+def flight_key(url, **options):
+    """مفتاح المهمة: الرابط الموحد مع الخيارات التي تغيّر الملف الناتج فقط."""
+    return f"{normalize_url(url)}|{json.dumps(options, sort_keys=True, ensure_ascii=False)}"
+
+
+class Flight:
+    """مهمة جارية واحدة يشترك فيها كل من طلب نفس الملف."""
+
+    def __init__(self, key, progress_state, job):
+        self.key = key
+        self.progress_state = progress_state
+        self.job = job
+        self.waiters = 1
+        self.members = []   # معرّفات الطلبات المشتركة (لمن يحتاج تتبع مستلمي النتيجة)
+        self.started_at = time.time()
+        self.task = None
+
+
+class SingleFlight:
+    """
+    أول طلب لمفتاح معين ينفذ العمل، والطلبات المتطابقة التي تصل أثناء تنفيذه تنضم إليه:
+    تتابع نفس حالة التقدم وتستلم نفس النتيجة. بعد انتهاء المهمة يُحذف المفتاح،
+    فالطلب التالي يبدأ مهمة جديدة.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self._flights = {}
+
+    def join(self, key, progress_state, job, work, member=None):
+        """
+        work(flight) دالة async تنفذ المهمة فعلياً (تُستدعى للطلب الأول فقط).
+        يعيد (flight, leader): leader=False يعني أن الطلب انضم لمهمة جارية.
+        """
+        flight = self._flights.get(key)
+        if flight and not flight.task.done():
+            flight.waiters += 1
+            if member is not None:
+                flight.members.append(member)
+            metrics.JOBS_COALESCED.inc(command=self.command)
+            return flight, False
+
+        flight = Flight(key, progress_state, job)
+        if member is not None:
+            flight.members.append(member)
+        self._flights[key] = flight
+        flight.task = asyncio.create_task(work(flight))
+        flight.task.add_done_callback(lambda _: self._release(flight))
+        return flight, True
+
+    async def wait(self, flight):
+        # shield: إلغاء انتظار أحد المستخدمين لا يلغي المهمة على الباقين
+        return await asyncio.shield(flight.task)
+
+    def _release(self, flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def active(self):
+        return [
+            {"key": f.key, "trace_id": f.job.trace_id, "waiters": f.waiters, "started_at": f.started_at}
+            for f in self._flights.values()
+        ]
@@ -0,0 +1,384 @@
+import mmap
+import os
+import shutil
+import threading
+import uuid
+from io import BytesIO
+
+import metrics
+
+# --- مساحة عمل المهمة: الذاكرة أولاً، ثم القرص عند تجاوز الميزانية ---
+#
+# صفحات المهمة (صور الفصول، صفحات PDF، ملفات ZIP) تبقى في الذاكرة كـ bytes ما دامت ضمن
+# ميزانية مشتركة لكل المهام في العملية، وما يتجاوزها يُكتب في مجلد على القرص.
+# المراحل التالية (الدمج، الضغط، ZIP، الرفع) تقرأ نفس الـ bytes بدون نسخ إضافية.
+# الأدوات التي تحتاج مسار ملف فعلي (jpegtran، reportlab) تحصل على ملف في tmpfs إن وُجد،
+# وهو أيضاً ذاكرة ويُحسب ضمن نفس الميزانية.
+
+WORKSPACE_MEMORY_BYTES = int(os.getenv("WORKSPACE_MEMORY_MB", "256")) * 1024 * 1024
+WORKSPACE_TMPFS = os.getenv("WORKSPACE_TMPFS", "/dev/shm")                   # "" يعطل tmpfs
+WORKSPACE_SPILL_DIR = os.getenv("WORKSPACE_SPILL_DIR", "workspace_spill")   # القرص عند تجاوز الميزانية
+
+MEMORY, TMPFS, DISK = "memory", "tmpfs", "disk"
+
+
+class MemoryBudget:
+    """ميزانية مشتركة بين كل مساحات العمل في العملية (الذاكرة + tmpfs)."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def try_reserve(self, size):
+        with self._lock:
+            if self.used + size > self.limit:
+                return False
+            self.used += size
+        metrics.WORKSPACE_BYTES.set(self.used, tier="budget_used")
+        return True
+
+    def release(self, size):
+        with self._lock:
+            self.used = max(0, self.used - size)
+        metrics.WORKSPACE_BYTES.set(self.used, tier="budget_used")
+
+
+budget = MemoryBudget(WORKSPACE_MEMORY_BYTES)
+
+
+def _tmpfs_usable():
+    return bool(WORKSPACE_TMPFS) and os.path.isdir(WORKSPACE_TMPFS) and os.access(WORKSPACE_TMPFS, os.W_OK)
+
+
+def _write_file(path, data):
+    """يكتب الملف، وعند الفشل (مثلاً ENOSPC في tmpfs صغير) يحذف ما كُتب جزئياً ويرفع الاستثناء."""
+    try:
+        with open(path, "wb") as f:
+            f.write(data)
+    except OSError:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+
+
+class _Entry:
+    __slots__ = ("data", "path", "size", "tier")
+
+    def __init__(self, tier, size, data=None, path=None):
+        self.tier = tier
+        self.size = size
+        self.data = data
+        self.path = path
+
+
+class _Writer:
+    """
+    ملف للكتابة (لـ PIL.save و zipfile): يبدأ في الذاكرة، وإذا لم تعد الميزانية تكفي
+    يُنقل ما كُتب لملف على القرص ويكمل هناك.
+    """
+
+    def __init__(self, workspace, name):
+        self._workspace = workspace
+        self._name = name
+        self._buffer = BytesIO()
+        self._file = None
+        self._path = None
+        self._reserved = 0
+        self.closed = False
+
+    def write(self, data):
+        if self._file is None:
+            end = self._buffer.tell() + len(data)
+            grow = max(0, end - self._reserved)
+            if not grow or self._workspace.budget.try_reserve(grow):
+                self._reserved += grow
+                return self._buffer.write(data)
+            self._rollover()
+        return self._file.write(data)
+
+    def _rollover(self):
+        self._path = self._workspace._disk_path(self._name)
+        self._file = open(self._path, "w+b")
+        position = self._buffer.tell()
+        self._file.write(self._buffer.getbuffer())
+        self._file.seek(position)
+        self._buffer = None
+        self._workspace.budget.release(self._reserved)
+        self._reserved = 0
+        self._workspace._spilled()
+
+    def _active(self):
+        return self._file if self._file is not None else self._buffer
+
+    def tell(self):
+        return self._active().tell()
+
+    def seek(self, offset, whence=0):
+        return self._active().seek(offset, whence)
+
+    def flush(self):
+        self._active().flush()
+
+    def seekable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def readable(self):
+        return False
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._file is not None:
+            self._file.close()
+            self._workspace._commit(self._name, _Entry(DISK, os.path.getsize(self._path), path=self._path))
+            return
+        # getvalue لا ينسخ البيانات إذا لم يعد هناك من يشير للمخزن
+        data = self._buffer.getvalue()
+        self._buffer = None
+        if self._reserved > len(data):
+            self._workspace.budget.release(self._reserved - len(data))
+        self._workspace._commit(self._name, _Entry(MEMORY, len(data), data=data))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self):
+        self.closed = True
+        if self._file is not None:
+            self._file.close()
+            os.remove(self._path)
+        else:
+            self._buffer = None
+            self._workspace.budget.release(self._reserved)
+
+
+class Workspace:
+    """
+    ملفات مهمة واحدة بأسماء نسبية ("3/001.jpg"). الاستخدام من عدة خيوط آمن.
+    close() يحرر الذاكرة ويحذف ملفات tmpfs والقرص.
+    """
+
+    def __init__(self, name=None, spill_dir=None, budget=budget):
+        self.name = name or uuid.uuid4().hex[:12]
+        self.budget = budget
+        self.spills = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._disk_root = os.path.join(spill_dir or WORKSPACE_SPILL_DIR, self.name)
+        self._tmpfs_root = os.path.join(WORKSPACE_TMPFS, f"workspace_{self.name}") if _tmpfs_usable() else None
+        self._tmpfs_full = False
+
+    # --- الكتابة ---
+    def put(self, name, data, as_file=False):
+        """
+        يحفظ البيانات في الذاكرة إن سمحت الميزانية، وإلا على القرص.
+        as_file=True للبيانات التي ستُقرأ كمسار ملف (tmpfs بدلاً من الذاكرة، ثم القرص).
+        """
+        size = len(data)
+        if self.budget.try_reserve(size):
+            if not as_file:
+                self._commit(name, _Entry(MEMORY, size, data=bytes(data) if not isinstance(data, bytes) else data))
+                return
+            if self._tmpfs_root and not self._tmpfs_full:
+                path = self._tmpfs_write(name, data)
+                if path:
+                    self._commit(name, _Entry(TMPFS, size, path=path))
+                    return
+            self.budget.release(size)
+        path = self._disk_path(name)
+        _write_file(path, data)
+        self._spilled()
+        self._commit(name, _Entry(DISK, size, path=path))
+
+    def writer(self, name):
+        """ملف للكتابة يُحفظ باسم name عند إغلاقه (with ws.writer(name) as f: img.save(f, ...))."""
+        return _Writer(self, name)
+
+    def adopt(self, name, path):
+        """يضم ملفاً أنتجته أداة خارجية (مثل jpegtran) لمساحة العمل، وينقله من مكانه."""
+        size = os.path.getsize(path)
+        if self.budget.try_reserve(size):
+            with open(path, "rb") as f:
+                data = f.read()
+            os.remove(path)
+            self._commit(name, _Entry(MEMORY, size, data=data))
+            return
+        destination = self._disk_path(name)
+        shutil.move(path, destination)
+        self._spilled()
+        self._commit(name, _Entry(DISK, size, path=destination))
+
+    # --- القراءة ---
+    def open(self, name):
+        """ملف للقراءة. في الذاكرة: BytesIO يشارك نفس الـ bytes بدون نسخ."""
+        entry = self._get(name)
+        if entry.tier == MEMORY:
+            return BytesIO(entry.data)
+        return open(entry.path, "rb")
+
+    def read(self, name):
+        entry = self._get(name)
+        if entry.tier == MEMORY:
+            return entry.data
+        with open(entry.path, "rb") as f:
+            return f.read()
+
+    def view(self, name):
+        """memoryview على البيانات: مباشرة من الذاكرة، أو mmap للملفات (بدون قراءة الملف كاملاً)."""
+        entry = self._get(name)
+        if entry.tier == MEMORY:
+            return memoryview(entry.data)
+        if not entry.size:
+            return memoryview(b"")
+        with open(entry.path, "rb") as f:
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def path(self, name):
+        """مسار ملف فعلي للأدوات الخارجية. البيانات في الذاكرة تُنقل لـ tmpfs (أو القرص) مرة واحدة."""
+        with self._lock:
+            entry = self._entries[name]
+            if entry.tier != MEMORY:
+                return entry.path
+            path = self._tmpfs_write(name, entry.data) if self._tmpfs_root and not self._tmpfs_full else None
+            tier = TMPFS
+            if path is None:
+                # بدون tmpfs (أو امتلأ): الملف على القرص ولم يعد ضمن ميزانية الذاكرة
+                path = self._disk_path(name)
+                _write_file(path, entry.data)
+                self.budget.release(entry.size)
+                self._spilled()
+                tier = DISK
+            entry.data, entry.path, entry.tier = None, path, tier
+            return path
+
+    def size(self, name):
+        return self._get(name).size
+
+    def tier(self, name):
+        return self._get(name).tier
+
+    def names(self, prefix=""):
+        with self._lock:
+            return sorted(n for n in self._entries if n.startswith(prefix))
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._entries
+
+    # --- التعديل والتنظيف ---
+    def rename(self, old, new):
+        """مثل os.replace: ملف موجود باسم new يُحذف وتُحرر ميزانيته."""
+        with self._lock:
+            entry = self._entries.pop(old)
+            previous = self._entries.get(new)
+            self._entries[new] = entry
+        if previous:
+            self._free(previous)
+
+    def delete(self, name):
+        with self._lock:
+            entry = self._entries.pop(name, None)
+        if entry:
+            self._free(entry)
+
+    def delete_prefix(self, prefix):
+        for name in self.names(prefix):
+            self.delete(name)
+
+    def export(self, name, destination):
+        """ينقل الملف خارج مساحة العمل (مثلاً ZIP نهائي يبقى على القرص). يعيد المسار."""
+        with self._lock:
+            entry = self._entries.pop(name)
+        if entry.tier == MEMORY:
+            with open(destination, "wb") as f:
+                f.write(entry.data)
+        else:
+            shutil.move(entry.path, destination)
+        if entry.tier != DISK:
+            self.budget.release(entry.size)
+        return destination
+
+    def stats(self):
+        with self._lock:
+            entries = list(self._entries.values())
+        totals = {MEMORY: 0, TMPFS: 0, DISK: 0}
+        for entry in entries:
+            totals[entry.tier] += entry.size
+        return {"files": len(entries), "spills": self.spills, **{f"{tier}_bytes": size for tier, size in totals.items()}}
+
+    def close(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            self._free(entry)
+        for root in (self._tmpfs_root, self._disk_root):
+            if root:
+                shutil.rmtree(root, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- داخلي ---
+    def _get(self, name):
+        with self._lock:
+            return self._entries[name]
+
+    def _commit(self, name, entry):
+        with self._lock:
+            previous = self._entries.get(name)
+            self._entries[name] = entry
+        if previous:
+            self._free(previous)
+
+    def _free(self, entry):
+        if entry.tier != DISK:
+            self.budget.release(entry.size)
+        if entry.path and os.path.exists(entry.path):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        entry.data = None
+
+    def _file_path(self, root, name):
+        # اسم فريد لكل نسخة (الاستبدال يحذف القديمة بعد كتابة الجديدة) مع إبقاء الامتداد للأدوات
+        folder, filename = os.path.split(name)
+        path = os.path.join(root, folder, f"{uuid.uuid4().hex[:6]}_{filename}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _tmpfs_write(self, name, data):
+        """يكتب في tmpfs ويعيد المسار، أو None إذا فشلت الكتابة (tmpfs ممتلئ أو غير متاح)."""
+        try:
+            path = self._file_path(self._tmpfs_root, name)
+            _write_file(path, data)
+            return path
+        except OSError as e:
+            # غالباً tmpfs ممتلئ: باقي ملفات هذه المهمة تذهب للقرص مباشرة
+            print(f"[WARNING] Workspace tmpfs write failed, using disk instead: {type(e).__name__} - {e}")
+            self._tmpfs_full = True
+            return None
+
+    def _disk_path(self, name):
+        return self._file_path(self._disk_root, name)
+
+    def _spilled(self):
+        self.spills += 1
+        metrics.WORKSPACE_SPILLS.inc()